@@ -0,0 +1,831 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the vcloud.zip link processing engine, run against a local mock of
+the vcloud.zip -> hubcloud.one -> redirect chain so results don't depend on the
+real sites and no real traffic is sent.
+Features:
+- Local HTTP server imitating every hop of the chain, with page padding and latency
+  to make bodies and round trips look like the real ones
+- Per-stage encoding benchmark: client CPU time, wall time and bytes on the wire for
+  every Accept-Encoding the installed httpx can decode, to pick STAGE_ACCEPT_ENCODING
+- Engine benchmark: full link resolution through a worker pool with per-stage latency
+- Pipeline and processes benchmarks: the same links through the script's own completion
+  loop (scheduling, concurrency controller, persister saving progress) in one process
+  and through the shared-memory result table with several worker processes
+- Egress benchmark: throughput through 1..N local stand-in proxies while the mock
+  limits concurrent requests per egress address, like the real sites' per-IP limits
+- Replay benchmark: engine throughput and extraction regressions against a recorded
+  archive (vcloud_replay), either recorded from the mock or from a real --record run
+- Persistence benchmark: save_progress and the finalize walk and write on a synthetic
+  catalogue of the same size
+- Results store (NDJSON, one line per run) with latency histograms, and a pass/fail
+  report against a saved baseline with the percent change of every metric
+"""
+
+import io
+import os
+import sys
+import json
+import gzip
+import time
+import zlib
+import base64
+import argparse
+import threading
+import http.client
+import tempfile
+import urllib.parse
+from contextlib import contextmanager, redirect_stdout
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import process_vcloud_links_parallel as engine
+from vcloud_transport import (
+    STAGE_ACCEPT_ENCODING, configure_accept_encoding, auto_accept_encoding, set_transport_factory,
+    configure_proxies, egress_stats,
+)
+from vcloud_replay import start_recording, stop_recording, start_replay, compare_with_recording
+from vcloud_store import write_json_output
+
+
+# Upper bounds of the latency histogram buckets in milliseconds, the last one open-ended
+HISTOGRAM_BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float("inf"))
+
+# Encodings the mock server compresses with, most preferred first
+SERVER_PREFERENCE = ("zstd", "br", "gzip", "deflate")
+
+# Header carrying the host a request was meant for, added by LocalRoutingTransport
+ORIGINAL_HOST_HEADER = "X-Bench-Host"
+
+# Header naming the stand-in proxy a request came through, the mock's idea of a client IP
+EGRESS_HEADER = "X-Bench-Egress"
+
+
+def _b64(text):
+    return base64.b64encode(text.encode('utf-8')).decode('ascii')
+
+
+def encode_start(payload):
+    """
+    Encode a payload the way real start parameters are: base64, reversed, base64 again
+    """
+    return _b64(_b64(payload)[::-1])
+
+
+def mock_link(index, api=False):
+    """
+    Return the vcloud URL of the index-th mock link
+    """
+    if api:
+        return f"https://vcloud.zip/api/file/{index:08d}"
+    return f"https://vcloud.zip/bench{index:08d}"
+
+
+def _padding(size):
+    """
+    HTML of roughly size bytes, repetitive the way script and style heavy pages are
+    """
+    block = ('<div class="row"><script src="/static/js/app.min.js?v=20240101"></script>'
+             '<span class="hint">Please wait while we prepare your download link</span></div>\n')
+    return block * (size // len(block) + 1)
+
+
+def _compress(body, encoding):
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=6)
+    if encoding == "deflate":
+        return zlib.compress(body)
+    if encoding == "br":
+        try:
+            import brotli
+        except ImportError:
+            import brotlicffi as brotli
+        return brotli.compress(body)
+    if encoding == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor().compress(body)
+    return body
+
+
+class _LocalHTTPServer(ThreadingHTTPServer):
+    # The default listen backlog of 5 drops connections under the engine's concurrency
+    request_queue_size = 128
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients close connections early (headers_only hops), that's not worth a traceback
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class MockChainServer:
+    """
+    Local HTTP server playing every site of the chain
+    page_bytes pads the HTML pages, latency is added to every response
+    per_egress_limit caps the requests served at once per egress, more queue up
+    bytes_sent counts body bytes on the wire per (host, encoding)
+    """
+
+    def __init__(self, page_bytes=40 * 1024, latency=0.0, per_egress_limit=None):
+        self.page_bytes = page_bytes
+        self.latency = latency
+        self.per_egress_limit = per_egress_limit
+        self.egress_slots = {}
+        self.padding = _padding(page_bytes)
+        self.lock = threading.Lock()
+        self.bytes_sent = {}
+        self.requests = 0
+        self.httpd = _LocalHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="mock-server", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def reset_counters(self):
+        with self.lock:
+            self.bytes_sent = {}
+            self.requests = 0
+
+    def route(self, host, path, query):
+        """
+        Return (status, headers, body) for a request
+        """
+        params = urllib.parse.parse_qs(query)
+        if host == "vcloud.zip" and path.startswith("/api/"):
+            index = path.rsplit("/", 1)[-1]
+            return 200, {}, f'{self.padding}<a href="https://vcloud.zip/bench{index}">Download</a>'
+        if host == "vcloud.zip":
+            foo = _b64(f"https://hubcloud.one/drive/?id={path.strip('/')}+ID")
+            return 200, {}, f'{self.padding}<a href="https://www-hubcloud-one.cdn.ampproject.org/c/s/foo/{foo}">Go</a>'
+        if host == "hubcloud.one" and path.startswith("/tg/"):
+            id_value = params["id"][0]
+            r = _b64(f"https://chain.test/hop1?k={urllib.parse.quote_plus(id_value)}")
+            re2 = _b64(f"https://hubcloud.one/go.php?r={urllib.parse.quote_plus(r)}")
+            return 302, {"Location": f"https://hubcloud.one/re2/{urllib.parse.quote_plus(re2)}"}, ""
+        if host == "hubcloud.one":
+            return 200, {}, f'{self.padding}<p>Redirecting</p>'
+        if host == "chain.test" and path == "/hop1":
+            return 302, {"Location": f"https://chain.test/hop2?{query}"}, ""
+        if host == "chain.test" and path == "/hop2":
+            return 200, {}, f'<meta http-equiv="refresh" content="0;url=/hop3?{query}">{self.padding}'
+        if host == "chain.test":
+            digits = "".join(ch for ch in params["k"][0] if ch.isdigit()) or "0"
+            start = encode_start(f"-1001727177969_{int(digits)}_1768370204")
+            return 302, {"Location": f"https://t.me/bench_bot?start={start}"}, ""
+        if host == "t.me":
+            return 200, {}, f'{self.padding}<a href="tg://resolve?domain=bench_bot">Open</a>'
+        return 404, {}, "not found"
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out in separate writes, don't let Nagle hold the body back
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                if server.per_egress_limit:
+                    with server.lock:
+                        slots = server.egress_slots.setdefault(self.headers.get(EGRESS_HEADER, "direct"),
+                                                               threading.Semaphore(server.per_egress_limit))
+                    with slots:
+                        if server.latency:
+                            time.sleep(server.latency)
+                elif server.latency:
+                    time.sleep(server.latency)
+                parsed = urllib.parse.urlsplit(self.path)
+                host = self.headers.get(ORIGINAL_HOST_HEADER, "")
+                status, headers, text = server.route(host, parsed.path, parsed.query)
+
+                body = text.encode('utf-8')
+                encoding = "identity"
+                if body:
+                    offered = [item.strip() for item in self.headers.get("Accept-Encoding", "").split(",")]
+                    for candidate in SERVER_PREFERENCE:
+                        if candidate in offered:
+                            try:
+                                body = _compress(body, candidate)
+                            except ImportError:
+                                continue
+                            encoding = candidate
+                            break
+
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                if encoding != "identity":
+                    self.send_header("Content-Encoding", encoding)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+                with server.lock:
+                    key = (host, encoding)
+                    server.bytes_sent[key] = server.bytes_sent.get(key, 0) + len(body)
+                    server.requests += 1
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+class StandInProxy:
+    """
+    Minimal forward HTTP proxy standing in for an egress, tagging what it forwards
+    with its name so the mock server can tell egresses apart
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.httpd = _LocalHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name=f"proxy-{name}", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _handler_class(self):
+        proxy = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                # Forward proxies get the absolute URL as the request target
+                target = urllib.parse.urlsplit(self.path)
+                headers = {name: value for name, value in self.headers.items()
+                           if name.lower() not in ("proxy-connection", "connection")}
+                headers[EGRESS_HEADER] = proxy.name
+                connection = http.client.HTTPConnection(target.hostname, target.port)
+                try:
+                    connection.request("GET", target.path + (f"?{target.query}" if target.query else ""),
+                                       headers=headers)
+                    response = connection.getresponse()
+                    body = response.read()
+                finally:
+                    connection.close()
+                self.send_response(response.status)
+                for name, value in response.getheaders():
+                    if name.lower() not in ("connection", "transfer-encoding", "content-length"):
+                        self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def local_routing_transport(port, proxy=None):
+    """
+    Build an httpx transport sending every request to the mock server on port,
+    keeping the original host in a header so the URLs the engine sees are unchanged
+    With proxy, requests go through that (stand-in) proxy
+    """
+    import httpx
+
+    class LocalRoutingTransport(httpx.BaseTransport):
+        def __init__(self):
+            self.inner = httpx.HTTPTransport(proxy=proxy)
+
+        def handle_request(self, request):
+            headers = request.headers.copy()
+            headers[ORIGINAL_HOST_HEADER] = request.url.host
+            local = httpx.Request(request.method, request.url.copy_with(scheme="http", host="127.0.0.1", port=port),
+                                  headers=headers, stream=request.stream, extensions=request.extensions)
+            return self.inner.handle_request(local)
+
+        def close(self):
+            self.inner.close()
+
+    return LocalRoutingTransport()
+
+
+@contextmanager
+def quiet():
+    """
+    Silence the engine's per-link progress output
+    """
+    with redirect_stdout(io.StringIO()):
+        yield
+
+
+@contextmanager
+def without_stage_delays():
+    """
+    Drop the delays between stages for the duration of a benchmark
+    """
+    saved = [list(resolver.stages) for resolver in engine.RESOLVERS]
+    for resolver in engine.RESOLVERS:
+        resolver.stages[:] = [(name, func, 0) for name, func, _ in resolver.stages]
+    try:
+        yield
+    finally:
+        for resolver, stages in zip(engine.RESOLVERS, saved):
+            resolver.stages[:] = stages
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def _stage_inputs(index):
+    """
+    Input of every stage for the index-th mock link, as the previous stage would produce it
+    """
+    id_value = f"bench{index:08d}+ID"
+    return {
+        "vcloud_api": mock_link(index, api=True),
+        "vcloud_page": mock_link(index),
+        "hubcloud_go": id_value,
+        "redirect_hop": f"https://chain.test/hop1?k={urllib.parse.quote_plus(id_value)}",
+    }
+
+
+STAGE_FUNCTIONS = {
+    "vcloud_api": engine.resolve_api_vcloud_url,
+    "vcloud_page": engine.fetch_hubcloud_id,
+    "hubcloud_go": engine.resolve_hubcloud_id,
+    "redirect_hop": engine.follow_redirect_chain_and_extract_start,
+}
+
+
+def bench_encodings(server, requests_per_case):
+    """
+    Run every stage with every encoding it could negotiate and measure the cost
+    CPU is the benchmark thread's own time, so the server's compression isn't counted
+    Returns rows of (stage, encoding, cpu ms, wall ms, bytes) per stage call
+    """
+    candidates = ["identity"] + [item.strip() for item in auto_accept_encoding().split(",")]
+    saved = dict(STAGE_ACCEPT_ENCODING)
+    rows = []
+    try:
+        for stage, func in STAGE_FUNCTIONS.items():
+            for encoding in candidates:
+                configure_accept_encoding({stage: encoding})
+                server.reset_counters()
+                cpu_started = time.thread_time()
+                wall_started = time.perf_counter()
+                with quiet():
+                    for index in range(requests_per_case):
+                        func(_stage_inputs(index)[stage])
+                cpu = time.thread_time() - cpu_started
+                wall = time.perf_counter() - wall_started
+                sent = sum(server.bytes_sent.values())
+                rows.append((stage, encoding, 1000 * cpu / requests_per_case, 1000 * wall / requests_per_case,
+                             sent / requests_per_case))
+    finally:
+        configure_accept_encoding(saved)
+    return rows
+
+
+def bench_engine(server, links, workers, urls=None, records=None):
+    """
+    Resolve links end to end through a worker pool with the current configuration
+    urls overrides the mock links, records collects the link records if given
+    Returns (seconds, errors, {stage: [seconds]})
+    """
+    if urls is None:
+        urls = [mock_link(index) for index in range(links)]
+
+    def resolve(url):
+        started = time.perf_counter()
+        record = engine.resolve_link(url)
+        return record, time.perf_counter() - started
+
+    stage_seconds = {}
+    errors = 0
+    started = time.perf_counter()
+    with quiet(), without_stage_delays(), ThreadPoolExecutor(max_workers=workers) as executor:
+        for record, link_seconds in executor.map(resolve, urls):
+            if record["error"]:
+                errors += 1
+            if records is not None:
+                records.append(record)
+            for stage, seconds in record["timings"].items():
+                stage_seconds.setdefault(stage, []).append(seconds)
+            # Whole link, stages and everything between them
+            stage_seconds.setdefault("link", []).append(link_seconds)
+    return time.perf_counter() - started, errors, stage_seconds
+
+
+def bench_pipeline(server, links, workers, processes=1):
+    """
+    Resolve links through process_unprocessed_urls, or process_urls_in_processes when
+    processes > 1 (workers are split between them), saving progress to a scratch file
+    Stage timings come from the result stream the run writes
+    Returns (seconds, errors, {stage: [seconds]})
+    """
+    urls = [mock_link(index) for index in range(links)]
+    directory = tempfile.mkdtemp(prefix="vcloud_bench_")
+    progress_file = os.path.join(directory, "progress.json")
+    progress = engine.load_progress(progress_file)
+    stream = io.StringIO()
+    try:
+        started = time.perf_counter()
+        with quiet(), without_stage_delays():
+            if processes > 1:
+                engine.process_urls_in_processes(urls, progress, progress_file, max(1, workers // processes),
+                                                 processes, 0, len(urls), result_stream=stream)
+            else:
+                engine.process_unprocessed_urls(urls, progress, progress_file, workers, 0, len(urls),
+                                                result_stream=stream)
+        seconds = time.perf_counter() - started
+    finally:
+        for name in os.listdir(directory):
+            os.unlink(os.path.join(directory, name))
+        os.rmdir(directory)
+
+    stage_seconds = {}
+    for line in stream.getvalue().splitlines():
+        for stage, value in json.loads(line)["timings"].items():
+            stage_seconds.setdefault(stage, []).append(value)
+    errors = sum(1 for url in urls if url not in progress["processed"])
+    return seconds, errors, stage_seconds
+
+
+def route_to(server):
+    """
+    Send the engine's traffic to the mock server
+    """
+    set_transport_factory(lambda proxy=None: local_routing_transport(server.port, proxy))
+
+
+def bench_egress(args, egress_counts):
+    """
+    Resolve the same number of links through 1..N stand-in proxies, against a mock that
+    serves only a few requests at a time per egress
+    Returns rows of (egresses, seconds, errors)
+    """
+    server = MockChainServer(page_bytes=args.page_kb * 1024, latency=args.egress_latency_ms / 1000,
+                             per_egress_limit=args.egress_limit).start()
+    route_to(server)
+    rows = []
+    try:
+        for count in egress_counts:
+            proxies = [StandInProxy(f"egress{number}").start() for number in range(count)]
+            configure_proxies([proxy.url for proxy in proxies], limit=args.egress_limit)
+            try:
+                seconds, errors, _ = bench_engine(server, args.links, args.egress_limit * count)
+                rows.append((count, seconds, errors, egress_stats()))
+            finally:
+                configure_proxies([])
+                for proxy in proxies:
+                    proxy.stop()
+    finally:
+        server.stop()
+    return rows
+
+
+def bench_replay(server, args):
+    """
+    Resolve the links of an archive again from the archive alone
+    Without --archive, the engine benchmark's mock run is recorded first and replayed
+    Returns (recorded seconds or None, links, seconds, errors, differences, misses)
+    """
+    path = args.archive
+    recorded_seconds = None
+    if path is None:
+        handle, path = tempfile.mkstemp(prefix="vcloud_bench_", suffix=".ndjson.gz")
+        os.close(handle)
+        start_recording(path, lambda proxy=None: local_routing_transport(server.port, proxy))
+        try:
+            recorded_seconds, _, _ = bench_engine(server, args.links, args.workers)
+        finally:
+            stop_recording()
+    try:
+        archive = start_replay(path, args.replay_speed)
+        records = []
+        try:
+            seconds, errors, _ = bench_engine(None, 0, args.workers, urls=list(archive.links), records=records)
+        finally:
+            route_to(server)
+    finally:
+        if args.archive is None:
+            os.remove(path)
+    return recorded_seconds, len(records), seconds, errors, compare_with_recording(archive, records), archive.misses
+
+
+def bench_persistence(links, repeats):
+    """
+    Time save_progress and the finalize walk and write for a run of links links
+    Returns {step: [seconds]} over repeats runs
+    """
+    progress = {
+        "processed": {mock_link(index): encode_start(f"-1001727177969_{index}_1768370204") for index in range(links)},
+        "intermediate": {mock_link(index): {"id": f"bench{index:08d}+ID", "decoded_r": f"https://chain.test/{index}"}
+                         for index in range(links)},
+        "validated": {},
+    }
+    catalogue = json.dumps([{"title": f"Entry {index}", "size": "1.4 GB", "files": [{"url": mock_link(index)}]}
+                            for index in range(links)])
+    seconds = {"save_progress": [], "finalize_walk": [], "finalize_write": []}
+    directory = tempfile.mkdtemp(prefix="vcloud_bench_")
+    try:
+        for _ in range(repeats):
+            started = time.perf_counter()
+            engine.save_progress(os.path.join(directory, "progress.json"), progress)
+            seconds["save_progress"].append(time.perf_counter() - started)
+
+            # A fresh copy every time, the walk replaces the links it finds
+            data = json.loads(catalogue)
+            started = time.perf_counter()
+            engine.update_json_with_results(data, progress["processed"])
+            seconds["finalize_walk"].append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            write_json_output(os.path.join(directory, "output.json"), data)
+            seconds["finalize_write"].append(time.perf_counter() - started)
+    finally:
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+    return seconds
+
+
+def histogram(values):
+    """
+    Count seconds values into the HISTOGRAM_BOUNDS_MS buckets
+    """
+    counts = [0] * len(HISTOGRAM_BOUNDS_MS)
+    for value in values:
+        milliseconds = 1000 * value
+        counts[next(number for number, bound in enumerate(HISTOGRAM_BOUNDS_MS) if milliseconds <= bound)] += 1
+    return counts
+
+
+def latency_metrics(prefix, seconds_by_name, metrics, histograms):
+    """
+    Add min/p50/p95/max in milliseconds and a histogram for every named list of seconds
+    """
+    for name, values in seconds_by_name.items():
+        for label, value in (("min", min(values)), ("p50", percentile(values, 0.5)),
+                             ("p95", percentile(values, 0.95)), ("max", max(values))):
+            metrics[f"{prefix}.{name}.{label}_ms"] = round(1000 * value, 3)
+        histograms[f"{prefix}.{name}"] = histogram(values)
+
+
+def metric_is_better_higher(name):
+    """
+    Throughput metrics (.._per_s) are better higher, everything else (times, bytes) lower
+    """
+    return name.endswith("_per_s")
+
+
+def append_results(path, run):
+    """
+    Append a run to the results store, one JSON object per line
+    """
+    with open(path, 'a') as f:
+        f.write(json.dumps(run, separators=(',', ':')) + "\n")
+
+
+def load_baseline(path):
+    """
+    Load a baseline saved with --save-baseline, or the last run of a results store
+    """
+    with open(path, 'r') as f:
+        content = f.read()
+    try:
+        return json.loads(content)
+    except ValueError:
+        # A results store holds one run per line
+        lines = [line for line in content.splitlines() if line.strip()]
+        if not lines:
+            raise ValueError(f"{path} holds no benchmark run")
+        return json.loads(lines[-1])
+
+
+def compare_with_baseline(metrics, baseline_metrics, tolerance, gated):
+    """
+    Compare every metric with its baseline value
+    A metric in gated fails when it got worse by more than tolerance percent
+    Returns rows of (name, baseline, current, percent change, passed), passed is None
+    for metrics that are only reported
+    """
+    rows = []
+    for name in sorted(set(metrics) & set(baseline_metrics)):
+        current, base = metrics[name], baseline_metrics[name]
+        if base == 0:
+            delta = 0.0 if current == 0 else float("inf")
+        else:
+            delta = 100.0 * (current - base) / base
+        worse = -delta if metric_is_better_higher(name) else delta
+        rows.append((name, base, current, delta, worse <= tolerance if name in gated else None))
+    return rows
+
+
+def print_sla_report(rows, tolerance, missing):
+    print(f"\n{'Metric':<44} {'Baseline':>10} {'Current':>10} {'Change':>8}   (fail when worse by > {tolerance:g}%)")
+    for name, base, current, delta, passed in rows:
+        verdict = "info" if passed is None else "PASS" if passed else "FAIL"
+        print(f"{name:<44} {base:>10.3f} {current:>10.3f} {delta:>+7.1f}%  {verdict}")
+    if missing:
+        print(f"Not in this run, not compared: {', '.join(sorted(missing))}")
+    gated = [row for row in rows if row[4] is not None]
+    failed = sum(1 for row in gated if not row[4])
+    print(f"SLA: {'FAIL' if failed else 'PASS'}, {failed} of {len(gated)} gated metrics regressed")
+    return failed == 0
+
+
+def print_persistence_table(links, seconds):
+    print(f"\nPersistence ({links} links)")
+    print(f"{'Step':<16} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+    for step, values in seconds.items():
+        print(f"{step:<16} {1000 * percentile(values, 0.5):>8.1f} {1000 * percentile(values, 0.95):>8.1f} "
+              f"{1000 * max(values):>8.1f}")
+
+
+def print_replay_table(speed, result):
+    recorded_seconds, links, seconds, errors, differences, misses = result
+    if recorded_seconds is not None:
+        print(f"\nRecorded: {links} links in {recorded_seconds:.2f}s ({links / recorded_seconds:.1f} links/s)")
+    pace = f"{speed:g}x recorded speed" if speed > 0 else "no delays"
+    print(f"Replayed: {links} links in {seconds:.2f}s ({links / seconds:.1f} links/s, {pace}), "
+          f"{errors} errors, {misses} unrecorded requests")
+    print(f"Start values differing from the recording: {len(differences)}")
+    for url, recorded, replayed in differences[:10]:
+        print(f"  {url}: recorded {recorded!r}, replayed {replayed!r}")
+
+
+def print_egress_table(links, rows):
+    print(f"\n{'Egresses':>8} {'Seconds':>8} {'Links/s':>8} {'Speedup':>8} {'Errors':>7}   ({links} links)")
+    base = rows[0][1] if rows else 0
+    for count, seconds, errors, stats in rows:
+        print(f"{count:>8} {seconds:>8.2f} {links / seconds:>8.1f} {base / seconds:>7.2f}x {errors:>7}")
+        print("         links per egress: " + ", ".join(str(item["links"]) for item in stats))
+
+
+def print_encoding_table(rows):
+    print(f"\n{'Stage':<14} {'Encoding':<10} {'CPU ms':>8} {'Wall ms':>8} {'Bytes':>9}   (per stage call)")
+    offered = [item.strip() for item in auto_accept_encoding().split(",")]
+    # What the mock server picks when offered everything, the same preference order as the real sites
+    auto = next(encoding for encoding in SERVER_PREFERENCE if encoding in offered)
+    for stage, encoding, cpu, wall, sent in rows:
+        setting = STAGE_ACCEPT_ENCODING.get(stage)
+        marker = " *" if encoding == (auto if setting == "auto" else setting) else ""
+        print(f"{stage:<14} {encoding:<10} {cpu:>8.3f} {wall:>8.3f} {sent:>9.0f}{marker}")
+    print("* current STAGE_ACCEPT_ENCODING setting")
+
+
+def print_engine_table(links, seconds, errors, stage_seconds, title="Engine"):
+    print(f"\n{title}: {links} links in {seconds:.2f}s ({links / seconds:.1f} links/s), {errors} errors")
+    print(f"{'Stage':<16} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+    for stage, values in stage_seconds.items():
+        print(f"{stage:<16} {1000 * percentile(values, 0.5):>8.1f} {1000 * percentile(values, 0.95):>8.1f} "
+              f"{1000 * max(values):>8.1f}")
+
+
+BENCHMARKS = ("encoding", "engine", "pipeline", "processes", "egress", "replay", "persistence")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the vcloud.zip link engine against a local mock chain")
+    parser.add_argument("benchmarks", nargs="*", metavar="BENCHMARK",
+                        help=f"Benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument("--links", type=int, default=200, help="Links resolved by the engine benchmark")
+    parser.add_argument("-w", "--workers", type=int, default=20,
+                        help="Worker threads for the engine and pipeline benchmarks, in total for processes")
+    parser.add_argument("--processes", type=int, default=2, help="Worker processes of the processes benchmark")
+    parser.add_argument("--requests", type=int, default=100, help="Calls per stage and encoding")
+    parser.add_argument("--page-kb", type=int, default=40, help="Size of the mock HTML pages in KiB")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Latency added to every mock response")
+    parser.add_argument("--egresses", default="1,2,4", help="Egress counts the egress benchmark compares")
+    parser.add_argument("--egress-limit", type=int, default=2,
+                        help="Requests the mock serves at once per egress, also the per-proxy limit")
+    parser.add_argument("--egress-latency-ms", type=float, default=100.0,
+                        help="Latency of every mock response in the egress benchmark")
+    parser.add_argument("--archive", metavar="ARCHIVE",
+                        help="Archive the replay benchmark replays, e.g. from a --record run of the real script "
+                             "(default: record the mock engine run first)")
+    parser.add_argument("--replay-speed", type=float, default=0.0,
+                        help="Replay at this multiple of the recorded speed, 0 for no delays (default: 0)")
+    parser.add_argument("--persistence-links", type=int, default=25000,
+                        help="Links in the progress and catalogue of the persistence benchmark")
+    parser.add_argument("--repeats", type=int, default=5, help="Runs of each persistence step")
+    parser.add_argument("--results", metavar="FILE", help="Append this run's metrics and histograms to FILE (NDJSON)")
+    parser.add_argument("--save-baseline", metavar="FILE", help="Save this run as the baseline in FILE")
+    parser.add_argument("--baseline", metavar="FILE",
+                        help="Compare this run with the baseline in FILE (or the last run of a results file), "
+                             "exit with status 1 when a metric regressed")
+    parser.add_argument("--tolerance", type=float, default=15.0,
+                        help="Percent a metric may get worse than the baseline before it fails (default: 15)")
+    args = parser.parse_args()
+    benchmarks = args.benchmarks or list(BENCHMARKS)
+    for name in benchmarks:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark {name!r}, expected one of {', '.join(BENCHMARKS)}")
+
+    baseline = None
+    if args.baseline:
+        try:
+            baseline = load_baseline(args.baseline)
+        except (OSError, ValueError) as e:
+            parser.error(f"can't use baseline {args.baseline}: {e}")
+
+    server = MockChainServer(page_bytes=args.page_kb * 1024, latency=args.latency_ms / 1000).start()
+    route_to(server)
+    print(f"Mock chain on port {server.port}, pages {args.page_kb} KiB, "
+          f"latency {args.latency_ms:g} ms, decodable encodings: {auto_accept_encoding()}")
+    metrics = {}
+    histograms = {}
+    # Metrics a regression fails the run on. Engine latencies under a worker pool are mostly
+    # queueing and move by 40% between identical runs, the engine is gated on throughput;
+    # the single-threaded persistence steps are gated on their fastest run, which stays
+    # within a few percent while their medians carry fsync noise. The rest is for information
+    gated = set()
+    try:
+        if "encoding" in benchmarks:
+            rows = bench_encodings(server, args.requests)
+            print_encoding_table(rows)
+            for stage, encoding, cpu, _, sent in rows:
+                metrics[f"encoding.{stage}.{encoding}.cpu_ms"] = round(cpu, 3)
+                metrics[f"encoding.{stage}.{encoding}.bytes"] = round(sent)
+                gated.add(f"encoding.{stage}.{encoding}.bytes")
+        if "engine" in benchmarks:
+            seconds, errors, stage_seconds = bench_engine(server, args.links, args.workers)
+            print_engine_table(args.links, seconds, errors, stage_seconds)
+            metrics["engine.links_per_s"] = round(args.links / seconds, 2)
+            metrics["engine.errors"] = errors
+            gated.update(("engine.links_per_s", "engine.errors"))
+            latency_metrics("engine", stage_seconds, metrics, histograms)
+        for name, processes, title in (("pipeline", 1, "Pipeline"),
+                                       ("processes", args.processes, f"Processes ({args.processes})")):
+            if name in benchmarks:
+                seconds, errors, stage_seconds = bench_pipeline(server, args.links, args.workers, processes)
+                print_engine_table(args.links, seconds, errors, stage_seconds, title)
+                metrics[f"{name}.links_per_s"] = round(args.links / seconds, 2)
+                metrics[f"{name}.errors"] = errors
+                gated.update((f"{name}.links_per_s", f"{name}.errors"))
+                latency_metrics(name, stage_seconds, metrics, histograms)
+        if "egress" in benchmarks:
+            rows = bench_egress(args, [int(count) for count in args.egresses.split(",")])
+            print_egress_table(args.links, rows)
+            for count, seconds, errors, _ in rows:
+                metrics[f"egress.{count}.links_per_s"] = round(args.links / seconds, 2)
+                gated.add(f"egress.{count}.links_per_s")
+        if "replay" in benchmarks:
+            result = bench_replay(server, args)
+            print_replay_table(args.replay_speed, result)
+            _, links, seconds, errors, differences, misses = result
+            metrics["replay.links_per_s"] = round(links / seconds, 2)
+            metrics["replay.mismatches"] = len(differences)
+            gated.update(("replay.links_per_s", "replay.mismatches"))
+        if "persistence" in benchmarks:
+            seconds = bench_persistence(args.persistence_links, args.repeats)
+            print_persistence_table(args.persistence_links, seconds)
+            latency_metrics("persistence", seconds, metrics, histograms)
+            gated.update(f"persistence.{step}.min_ms" for step in seconds)
+    finally:
+        set_transport_factory(None)
+        server.stop()
+
+    run = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "benchmarks": benchmarks,
+        "settings": {name: getattr(args, name) for name in ("links", "workers", "processes", "requests", "page_kb",
+                                                            "latency_ms", "persistence_links", "repeats")},
+        "metrics": metrics,
+        "gated": sorted(gated),
+        "histogram_bounds_ms": list(HISTOGRAM_BOUNDS_MS[:-1]),
+        "histograms": histograms,
+    }
+    if args.results:
+        append_results(args.results, run)
+        print(f"\nResults appended to {args.results}")
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(run, f, indent=2)
+        print(f"Baseline saved to {args.save_baseline}")
+    if baseline is not None:
+        if baseline.get("settings") != run["settings"]:
+            print(f"Warning: baseline settings {baseline.get('settings')} differ from this run's, "
+                  f"deltas may not be meaningful")
+        rows = compare_with_baseline(metrics, baseline["metrics"], args.tolerance, gated)
+        if not print_sla_report(rows, args.tolerance, set(baseline["metrics"]) - set(metrics)):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Standalone checks of process_vcloud_links_parallel. Run with
+python check_process_vcloud_links_parallel.py, exits with status 1 when a check fails.
+Features:
+- Outputs patched from a previous one (patch_previous_output) against the output a
+  full pass writes, after results arrive, drift, or the input changes
+- A result stored by a run that stopped before writing its output still reaches the
+  next patched output, and an entry whose results are unchanged isn't rewritten
+- ConcurrencyTuner against simulated goodput curves: it climbs to and stays around the
+  best limit, backs off when errors or captchas pile up and waits for enough samples
+- Needs what the processing script itself needs, no network access
+"""
+
+import io
+import os
+import sys
+import copy
+import json
+import shutil
+import tempfile
+from contextlib import redirect_stdout
+
+
+def catalogue(titles):
+    """
+    Catalogue with one entry per title, every entry holding two links and one entry none
+    """
+    entries = [{"title": title, "files": [{"url": f"https://vcloud.zip/{title}-1"},
+                                          {"url": f"https://vcloud.zip/{title}-2"}]}
+               for title in titles]
+    return entries + [{"title": "no links", "files": []}]
+
+
+def check_patch_previous_output():
+    import process_vcloud_links_parallel as engine
+    from vcloud_store import entry_result_digests, record_output_in_manifest, write_json_output
+
+    failures = []
+    directory = tempfile.mkdtemp(prefix="vcloud_check_")
+    try:
+        input_file = os.path.join(directory, "input.json")
+        output_file = os.path.join(directory, "output.json")
+        manifest_file = os.path.join(directory, "manifest.json")
+
+        def discover(document):
+            with open(input_file, 'w') as f:
+                json.dump(document, f)
+            with redirect_stdout(io.StringIO()):
+                return engine.discover_links(input_file)
+
+        def write_full(data, manifest, results):
+            # What a full pass writes, and what it records for the next run
+            expected = copy.deepcopy(data)
+            engine.update_json_with_results(expected, results)
+            write_json_output(output_file, expected, 2)
+            record_output_in_manifest(manifest_file, manifest, output_file, results)
+            return expected
+
+        def patch(name, data, manifest, previous_manifest, results, expected_rewritten, input_changed=False):
+            expected = copy.deepcopy(data)
+            engine.update_json_with_results(expected, results)
+            digests = entry_result_digests(manifest, results)
+            # Like the engine, an unchanged input is never loaded
+            patched, rewritten = engine.patch_previous_output(output_file, input_file,
+                                                              data if input_changed else None, manifest,
+                                                              previous_manifest, results, digests)
+            if patched != expected:
+                failures.append(f"{name}: patched output differs from a full pass")
+            if rewritten != expected_rewritten:
+                failures.append(f"{name}: rewrote {rewritten} entries, expected {expected_rewritten}")
+
+        titles = ["a", "b", "c"]
+        data, manifest = discover(catalogue(titles))
+        # The second link of "b" failed in the first run
+        results = {url: f"start-{url[-3:]}" for url in manifest["links"] if url != "https://vcloud.zip/b-2"}
+        write_full(data, manifest, results)
+        previous_manifest = copy.deepcopy(manifest)
+
+        patch("unchanged", data, manifest, previous_manifest, results, 0)
+        # A later run stored the missing result but stopped before writing its output
+        resolved = dict(results, **{"https://vcloud.zip/b-2": "start-b-2"})
+        patch("result stored by a stopped run", data, manifest, previous_manifest, resolved, 1)
+        drifted = dict(resolved, **{"https://vcloud.zip/c-1": "start-c-1v2"})
+        patch("drifted result", data, manifest, previous_manifest, drifted, 2)
+
+        changed_data, changed_manifest = discover(catalogue(["a", "b", "d"]))
+        patch("changed input", changed_data, changed_manifest, previous_manifest,
+              dict(results, **{"https://vcloud.zip/d-1": "start-d-1"}), 1, input_changed=True)
+
+        # Manifests from before the applied results were recorded reuse nothing with links
+        data, manifest = discover(catalogue(titles))
+        previous_manifest.pop("output_results")
+        patch("manifest without applied results", data, manifest, previous_manifest, results, 3)
+    finally:
+        shutil.rmtree(directory)
+    return failures
+
+
+def run_tuner(tuner, goodput_at, windows, error_rate_at=lambda limit: 0.0):
+    """
+    Feed the tuner windows of simulated links, goodput_at(limit) successes per second,
+    and return the limit after each window
+    """
+    limits = []
+    now = 0.0
+    for _ in range(windows):
+        limit = tuner.controller.limit
+        successes = int(goodput_at(limit) * tuner.window)
+        failures = int(successes * error_rate_at(limit) / max(1e-9, 1 - error_rate_at(limit)))
+        for outcome in [True] * successes + [False] * failures:
+            tuner.observe({"start": "s" if outcome else None})
+        now += tuner.window
+        tuner.tick(now)
+        limits.append(tuner.controller.limit)
+    return limits
+
+
+def check_concurrency_tuner():
+    import process_vcloud_links_parallel as engine
+
+    def new_tuner(limit, **options):
+        tuner = engine.ConcurrencyTuner(engine.ConcurrencyController(limit, 100), window=10.0, step=5, **options)
+        # Simulated time, tick() is given the end of each window
+        tuner.window_started = 0.0
+        return tuner
+
+    failures = []
+    # Goodput grows with the limit up to 40 and falls off beyond it
+    peaked = lambda limit: 200 - 4 * abs(limit - 40)
+    limits = run_tuner(new_tuner(10), peaked, 30)
+    if not all(30 <= limit <= 50 for limit in limits[-10:]):
+        failures.append(f"limits on a curve peaking at 40 ended at {limits[-10:]}")
+
+    # Flat goodput: fewer workers for the same goodput is better
+    limits = run_tuner(new_tuner(60, minimum=5), lambda limit: 100, 30)
+    if max(limits[-10:]) > 15:
+        failures.append(f"limits with flat goodput ended at {limits[-10:]}, expected them to come down")
+
+    # Rising goodput up to the maximum: the limit stays near it
+    limits = run_tuner(new_tuner(50), lambda limit: 2 * limit, 30)
+    if min(limits[-10:]) < 90:
+        failures.append(f"limits with goodput rising to the maximum ended at {limits[-10:]}")
+
+    # Errors above max_error_rate back off multiplicatively, never below minimum
+    limits = run_tuner(new_tuner(100, minimum=8, max_error_rate=0.2), lambda limit: 100, 8,
+                       error_rate_at=lambda limit: 0.5)
+    if limits[:3] != [70, 49, 34] or limits[-1] != 8:
+        failures.append(f"limits while backing off on errors {limits}, expected 70, 49, 34 ... down to 8")
+
+    captchas = [0]
+    tuner = new_tuner(100, max_error_rate=0.2, captchas=lambda: captchas[0])
+    for _ in range(10):
+        tuner.observe({"start": "s"})
+    captchas[0] = 5
+    tuner.tick(tuner.window)
+    if tuner.controller.limit != 70:
+        failures.append(f"limit {tuner.controller.limit} after a window with 5 captchas in 10 links, expected 70")
+
+    tuner = new_tuner(50)
+    for _ in range(tuner.MIN_SAMPLES - 1):
+        tuner.observe({"start": "s"})
+    if tuner.tick(tuner.window * 3) is not None:
+        failures.append("a window ended before it had MIN_SAMPLES finished links")
+    return failures
+
+
+CHECKS = [
+    ("patch_previous_output matches a full pass", check_patch_previous_output),
+    ("ConcurrencyTuner climbs to the best limit and backs off on errors", check_concurrency_tuner),
+]
+
+
+def main():
+    failed = 0
+    for name, check in CHECKS:
+        failures = check()
+        print(f"{'FAIL' if failures else 'ok  '} {name}")
+        for failure in failures[:10]:
+            print(f"     {failure}")
+        failed += bool(failures)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
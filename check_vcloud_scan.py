@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Standalone checks of vcloud_scan. Run with python check_vcloud_scan.py, exits with
+status 1 when a check fails.
+Features:
+- Links found by the byte scan (scan_url_fields) against the parsed path
+  (find_vcloud_links) on a catalogue with "url" fields in every position the scanner
+  has to tell apart
+- Output spliced from the input bytes (splice_values) against the parsed path's
+  (update_json_with_results)
+- Needs what the processing script itself needs, no network access
+"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+
+
+def scan_document():
+    """
+    Catalogue text with "url" fields in every position the scanner has to tell apart
+    """
+    return ('[\n'
+            '  {"url": "https://vcloud.zip/plain", "files": [{"url" : "https://vcloud.zip/spaced"}]},\n'
+            '  {"title": "{\\"url\\": \\"https://vcloud.zip/inside-a-string\\"}", "url":"https://vcloud.zip/after"},\n'
+            '  {"note": "url", "url": "https://vcloud.zip/esc\\u0061ped\\/slash"},\n'
+            '  {"key ending in \\"url": "https://vcloud.zip/not-a-url-field"},\n'
+            '  {"url": null, "other": {"url": 5}, "list": ["url", "https://vcloud.zip/not-a-field"]},\n'
+            '  {\n    "url"\n      :\n    "https://vcloud.zip/newlines"\n  },\n'
+            '  {"url": "https://example.org/not-a-vcloud-link"},\n'
+            '  {"url": "https://vcloud.zip/plain"}\n'
+            ']\n')
+
+
+def check_scan():
+    import process_vcloud_links_parallel as engine
+    from vcloud_scan import scan_url_fields, splice_values
+
+    def accept(url):
+        return engine.match_resolver(url) is not None
+
+    failures = []
+    directory = tempfile.mkdtemp(prefix="vcloud_check_")
+    try:
+        path = os.path.join(directory, "input.json")
+        text = scan_document()
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        data = json.loads(text)
+
+        urls, offsets = scan_url_fields(path, accept)
+        expected = [url for _, url in engine.find_vcloud_links(data)]
+        if urls != expected:
+            failures.append(f"scan found {urls}, the parsed path {expected}")
+
+        results = {url: f"start-{number}" for number, url in enumerate(dict.fromkeys(expected)) if number % 2 == 0}
+        spliced = json.loads(b"".join(splice_values(path, urls, offsets, results)))
+        engine.update_json_with_results(data, results)
+        if spliced != data:
+            failures.append(f"spliced output {spliced} differs from the parsed path's {data}")
+    finally:
+        shutil.rmtree(directory)
+    return failures
+
+
+CHECKS = [
+    ("scan_url_fields/splice_values match the parsed path", check_scan),
+]
+
+
+def main():
+    failed = 0
+    for name, check in CHECKS:
+        failures = check()
+        print(f"{'FAIL' if failures else 'ok  '} {name}")
+        for failure in failures[:10]:
+            print(f"     {failure}")
+        failed += bool(failures)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Standalone checks of vcloud_shared. Run with python check_vcloud_shared.py, exits with
+status 1 when a check fails.
+Features:
+- Claims, published results and the completion log of a SharedResultTable read back
+  in one process, including failed links, a full heap and a stop request
+- Forked processes claiming and publishing concurrently: every link is handed out
+  once and collected once, with the start value its worker published
+- Only depends on the standard library, the second check needs the fork start method
+"""
+
+import sys
+import time
+import multiprocessing
+
+
+def check_table():
+    from vcloud_shared import SharedResultTable, EMPTY, DONE, FAILED
+
+    failures = []
+    table = SharedResultTable.create(4, multiprocessing.Lock())
+    try:
+        claims = [table.claim() for _ in range(5)]
+        if claims != [0, 1, 2, 3, None]:
+            failures.append(f"claims {claims}, expected [0, 1, 2, 3, None]")
+
+        table.publish(2, "c3RhcnQ=", {"error": None, "timings": {"vcloud_page": 0.1}})
+        table.publish(0, None, {"error": "ValueError: no id", "timings": {}})
+        results, cursor = table.collect(0)
+        expected = [(2, "c3RhcnQ=", {"error": None, "timings": {"vcloud_page": 0.1}}),
+                    (0, None, {"error": "ValueError: no id", "timings": {}})]
+        if results != expected or cursor != 2:
+            failures.append(f"collected {results} up to {cursor}, expected {expected} up to 2")
+        states = [table.read(index)[0] for index in range(4)]
+        if states != [FAILED, EMPTY, DONE, EMPTY]:
+            failures.append(f"slot states {states}")
+
+        table.publish(1, "ü", {})
+        results, cursor = table.collect(cursor)
+        if results != [(1, "ü", {})] or cursor != 3:
+            failures.append(f"second collect {results} up to {cursor}")
+        if table.collect(cursor) != ([], 3):
+            failures.append("collecting again returned results twice")
+    finally:
+        table.close()
+
+    table = SharedResultTable.create(3, multiprocessing.Lock(), heap_bytes_per_link=16)
+    try:
+        if table.publish(0, "x" * 100, {}):
+            failures.append("a result larger than the heap was published")
+        if table.collect(0) != ([], 0) or table.read(0)[0] != EMPTY:
+            failures.append("a result that didn't fit the heap reached the log")
+        table.request_stop()
+        if not table.stopped() or table.claim() is not None:
+            failures.append("links were still handed out after a stop request")
+    finally:
+        table.close()
+    return failures
+
+
+def _claim_and_publish(table):
+    while True:
+        index = table.claim()
+        if index is None:
+            return
+        table.publish(index, f"start-{index}", {"error": None})
+
+
+def check_processes():
+    from vcloud_shared import SharedResultTable
+
+    if "fork" not in multiprocessing.get_all_start_methods():
+        return []
+    context = multiprocessing.get_context("fork")
+    count = 2000
+    table = SharedResultTable.create(count, context.Lock())
+    try:
+        workers = [context.Process(target=_claim_and_publish, args=(table,)) for _ in range(4)]
+        for process in workers:
+            process.start()
+        collected = []
+        cursor = 0
+        while any(process.is_alive() for process in workers):
+            results, cursor = table.collect(cursor)
+            collected.extend(results)
+            time.sleep(0.01)
+        for process in workers:
+            process.join()
+        results, cursor = table.collect(cursor)
+        collected.extend(results)
+    finally:
+        table.close()
+
+    failures = []
+    indexes = sorted(index for index, _, _ in collected)
+    if indexes != list(range(count)):
+        failures.append(f"collected {len(indexes)} results for {len(set(indexes))} of {count} links")
+    wrong = [(index, start) for index, start, _ in collected if start != f"start-{index}"]
+    if wrong:
+        failures.append(f"start values of other links: {wrong[:5]}")
+    return failures
+
+
+CHECKS = [
+    ("SharedResultTable claims, publishes and collects", check_table),
+    ("SharedResultTable shared by forked processes", check_processes),
+]
+
+
+def main():
+    failed = 0
+    for name, check in CHECKS:
+        failures = check()
+        print(f"{'FAIL' if failures else 'ok  '} {name}")
+        for failure in failures[:10]:
+            print(f"     {failure}")
+        failed += bool(failures)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
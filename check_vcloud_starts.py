@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Standalone checks of vcloud_starts. Run with python check_vcloud_starts.py, exits with
+status 1 when a check fails.
+Features:
+- Start values encoded like the real ones decode to the payload and fields they were
+  built from, corrupt ones to None
+- link_id of plain and API-style links
+- Range lookups of the channel index built from stored message keys
+- Only depends on the standard library
+"""
+
+import sys
+import base64
+
+
+def encode_start(payload):
+    """
+    Encode a payload the way real start parameters are: base64, reversed, base64 again
+    """
+    inner = base64.b64encode(payload.encode('utf-8')).decode('ascii')
+    return base64.b64encode(inner[::-1].encode('ascii')).decode('ascii')
+
+
+def check_start_table():
+    from vcloud_starts import start_table, message_key
+
+    processed = {
+        "https://vcloud.zip/a1": encode_start("-1001727177969_19853_1768370204"),
+        "https://vcloud.zip/a2": encode_start("not a channel message"),
+        "https://vcloud.zip/a3": encode_start("-1001727177969_19853_1768370204")[:-2] + "!!",
+        "https://vcloud.zip/a4": "",
+    }
+    expected = {
+        "payload": ["-1001727177969_19853_1768370204", "not a channel message", None, ""],
+        "channel_id": [-1001727177969, None, None, None],
+        "message_id": [19853, None, None, None],
+        "timestamp": [1768370204, None, None, None],
+    }
+    failures = []
+    table = start_table(processed)
+    for column, values in expected.items():
+        if table[column] != values:
+            failures.append(f"{column}: {table[column]}, expected {values}")
+    keys = [message_key(start) for start in processed.values()]
+    if keys != [[-1001727177969, 19853], None, None, None]:
+        failures.append(f"message keys {keys}")
+    return failures
+
+
+def check_link_id():
+    from vcloud_starts import link_id
+
+    cases = {
+        "https://vcloud.zip/xgxzrzgzcxgazgq": "xgxzrzgzcxgazgq",
+        "https://vcloud.zip/xgxzrzgzcxgazgq/": "xgxzrzgzcxgazgq",
+        "https://vcloud.zip/api/index.php?link=WHJl+cVN/OM0Y%3D%3D": "WHJl+cVN/OM0Y==",
+        "https://vcloud.zip/api/index.php?x=1&link=dG9rZW4=": "dG9rZW4=",
+    }
+    return [f"{url}: {link_id(url)!r}, expected {expected!r}"
+            for url, expected in cases.items() if link_id(url) != expected]
+
+
+def check_start_index():
+    from vcloud_starts import StartIndex
+
+    messages = {
+        "https://vcloud.zip/b": [-100, 7],
+        "https://vcloud.zip/a": [-100, 7],
+        "https://vcloud.zip/c": [-100, 3],
+        "https://vcloud.zip/d": [-100, 12],
+        "https://vcloud.zip/e": [-200, 7],
+        "https://vcloud.zip/f": None,
+    }
+    index = StartIndex.from_messages(messages)
+    cases = [
+        ((-100, None, None), [(3, "https://vcloud.zip/c"), (7, "https://vcloud.zip/a"), (7, "https://vcloud.zip/b"),
+                              (12, "https://vcloud.zip/d")]),
+        ((-100, 7, 7), [(7, "https://vcloud.zip/a"), (7, "https://vcloud.zip/b")]),
+        ((-100, 4, None), [(7, "https://vcloud.zip/a"), (7, "https://vcloud.zip/b"), (12, "https://vcloud.zip/d")]),
+        ((-100, 8, 11), []),
+        ((-300, None, None), []),
+    ]
+    return [f"range{arguments}: {index.range(*arguments)}, expected {expected}"
+            for arguments, expected in cases if index.range(*arguments) != expected]
+
+
+CHECKS = [
+    ("start values decode to their payload and fields", check_start_table),
+    ("link_id of plain and API-style links", check_link_id),
+    ("StartIndex range lookups", check_start_index),
+]
+
+
+def main():
+    failed = 0
+    for name, check in CHECKS:
+        failures = check()
+        print(f"{'FAIL' if failures else 'ok  '} {name}")
+        for failure in failures[:10]:
+            print(f"     {failure}")
+        failed += bool(failures)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
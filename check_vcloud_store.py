@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Standalone checks of vcloud_store. Run with python check_vcloud_store.py, exits with
+status 1 when a check fails.
+Features:
+- Output serialization (write_json_output) byte for byte against json.dumps, indented
+  and compact, with one and several workers, and read back through load_json_output
+  when compressed
+- Files written atomically get the mode a plain open() would give them, or keep theirs
+- BatchedPersister saves per batch and per interval, applies every item in order, keeps
+  going past a failed apply or save and reports what failed when closed
+- Every check works in a scratch directory, nothing outside it is touched
+- Only depends on the standard library
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+from contextlib import contextmanager, redirect_stderr
+
+
+@contextmanager
+def scratch_directory():
+    directory = tempfile.mkdtemp(prefix="vcloud_check_")
+    try:
+        yield directory
+    finally:
+        shutil.rmtree(directory)
+
+
+def sample_documents():
+    """
+    Documents covering the layouts the output writer special-cases
+    """
+    entry = {"title": "Entry \"1\"\n", "size": 1.5, "tags": ["a", {"b": [None, True]}], "empty": {}, "none": [],
+             "unicode": "ü\u2028", "files": [{"url": "https://vcloud.zip/a1"}]}
+    return [
+        [],
+        {},
+        "scalar",
+        [entry] * 50,
+        {f"key {number}": dict(entry, number=number) for number in range(50)},
+        [[], {}, [[]], 0, "x"],
+    ]
+
+
+def check_write_json_output():
+    from vcloud_store import write_json_output, load_json_output, output_path
+
+    failures = []
+    with scratch_directory() as directory:
+        path = os.path.join(directory, "output.json")
+        for number, data in enumerate(sample_documents()):
+            for indent, expected in ((2, json.dumps(data, indent=2)),
+                                     (None, json.dumps(data, separators=(',', ':')))):
+                for workers in (1, 2):
+                    write_json_output(path, data, indent, workers=workers)
+                    with open(path, 'r', encoding='utf-8') as f:
+                        written = f.read()
+                    if written != expected:
+                        failures.append(f"document {number}, indent {indent}, {workers} workers: "
+                                        f"{written[:60]!r}... differs from json.dumps")
+            compressed = output_path(path, "gzip")
+            write_json_output(compressed, data, compression="gzip")
+            if load_json_output(compressed) != data:
+                failures.append(f"document {number} doesn't read back from gzip output")
+    return failures
+
+
+def check_file_modes():
+    from vcloud_store import atomic_write_json, write_json_output
+
+    umask = os.umask(0)
+    os.umask(umask)
+    expected = 0o666 & ~umask
+    failures = []
+    with scratch_directory() as directory:
+        path = os.path.join(directory, "progress.json")
+        atomic_write_json(path, {"processed": {}})
+        for name in ("progress.json", "progress.json.sha256"):
+            mode = os.stat(os.path.join(directory, name)).st_mode & 0o777
+            if mode != expected:
+                failures.append(f"new {name} has mode {mode:o}, expected {expected:o} under umask {umask:03o}")
+        os.chmod(path, 0o640)
+        atomic_write_json(path, {"processed": {}})
+        write_json_output(os.path.join(directory, "output.json"), [])
+        mode = os.stat(path).st_mode & 0o777
+        if mode != 0o640:
+            failures.append(f"rewritten progress.json has mode {mode:o}, expected the 640 it had")
+    return failures
+
+
+def check_batched_persister():
+    from vcloud_store import BatchedPersister
+
+    failures = []
+    # The persister warns about failed applies and saves on stderr
+    with redirect_stderr(io.StringIO()):
+        state = []
+        snapshots = []
+        persister = BatchedPersister(state.append, lambda: snapshots.append(list(state)), batch_size=3, interval=60)
+        persister.start()
+        for item in range(7):
+            persister.submit(item)
+        persister.close()
+        if snapshots != [[0, 1, 2], [0, 1, 2, 3, 4, 5], list(range(7))] or persister.saves != 3:
+            failures.append(f"batches of 3 saved {snapshots}")
+
+        snapshots = []
+        persister = BatchedPersister(lambda item: None, lambda: snapshots.append(time.monotonic()),
+                                     batch_size=100, interval=0.2)
+        persister.start()
+        submitted = time.monotonic()
+        persister.submit("a")
+        time.sleep(0.6)
+        saved_before_close = len(snapshots)
+        persister.close()
+        if saved_before_close != 1 or not 0.15 <= snapshots[0] - submitted < 0.5:
+            failures.append(f"a partial batch was saved {saved_before_close} times within 0.6s, "
+                            f"expected once after 0.2s")
+
+        def apply(item):
+            if item == "bad":
+                raise ValueError("bad item")
+            state.append(item)
+
+        state = []
+        persister = BatchedPersister(apply, lambda: None, batch_size=2)
+        persister.start()
+        for item in ("a", "bad", "b"):
+            persister.submit(item)
+        try:
+            persister.close()
+            failures.append("close() didn't report the failed apply")
+        except ValueError:
+            pass
+        if state != ["a", "b"]:
+            failures.append(f"items after a failed apply: {state}, expected ['a', 'b']")
+
+        attempts = []
+
+        def save():
+            attempts.append(len(state))
+            if len(attempts) == 1:
+                raise OSError("disk full")
+
+        state = []
+        persister = BatchedPersister(state.append, save, batch_size=1)
+        persister.start()
+        persister.submit("a")
+        persister.submit("b")
+        try:
+            persister.close()
+        except OSError:
+            failures.append("close() raised a save error that a later save recovered from")
+        if attempts[-1] != 2:
+            failures.append(f"saves after a failed one covered {attempts}, expected the last to hold both items")
+
+        persister = BatchedPersister(lambda item: None, lambda: 1 / 0)
+        persister.start()
+        persister.submit("a")
+        try:
+            persister.close()
+            failures.append("close() didn't report the failed final save")
+        except ZeroDivisionError:
+            pass
+    return failures
+
+
+CHECKS = [
+    ("write_json_output matches json.dumps", check_write_json_output),
+    ("atomic writes keep the usual file modes", check_file_modes),
+    ("BatchedPersister batches, retries and reports errors", check_batched_persister),
+]
+
+
+def main():
+    failed = 0
+    for name, check in CHECKS:
+        failures = check()
+        print(f"{'FAIL' if failures else 'ok  '} {name}")
+        for failure in failures[:10]:
+            print(f"     {failure}")
+        failed += bool(failures)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,22 +7,71 @@ Features:
 - Error handling for failed links
 - Minimal output showing progress
 - Uses fresh HTTP clients like the working individual resolver
-- Thread-safe progress saving
+- Thread-safe progress saving, batched on a dedicated persistence thread
+- Cached link manifest and lazy imports so resumed runs start making requests immediately
+- Per-stage timeouts and optional hedged requests for slow hops
+- Optional memo of redirect hops shared between chains
+- DNS cache shared by all workers, warmed up before the first request
+- Resolver registry keyed by URL pattern, so each kind of link runs its cheapest chain
+- Known hubcloud ids and decoded r URLs are persisted and reused to skip phase 1
+- Optional NDJSON stream of results as each link completes
+- Crash-safe progress and output writes with fallback to the last good snapshot
+- Graceful shutdown on SIGINT/SIGTERM and live concurrency changes with SIGUSR1/SIGUSR2
+- Sampled per-link hop traces, always kept for failed and slow links
+- Profiling mode attributing wall and CPU time per stage and thread
+- Accept-Encoding negotiated per stage, hubcloud_go reads headers only
+- Export of the decoded start values as a columnar table, decoded in bulk
+- (channel id, message id) of every processed link stored as results arrive, for the
+  channel index of vcloud_starts.py
+- Priority scheduling by a catalogue field, catalogue position or a sidecar file of weights
+- Optional pool of egress proxies, each link's chain pinned to one healthy egress
+- Record mode capturing all traffic for offline replay (see benchmark_vcloud_links.py replay)
+- Output serialized in parallel worker processes, optionally compact and gzip/zstd compressed
+- Optional byte-level scan of the input for discovery, with the output spliced from the input bytes
+- Revalidation of processed links by re-checking their first stored intermediate value,
+  re-resolving only the links that drifted
+- Optional auto-tuning of the concurrency by hill climbing on goodput, backing off on
+  errors and captchas
+- Optional multi-process mode, workers of every process claiming links from and
+  publishing results to a result table in shared memory
 """
 
 import sys
 import json
-import httpx
+import argparse
 import re
 import base64
 import os
 import time
 from urllib.parse import urlparse, parse_qs, unquote_plus
-from concurrent.futures import ThreadPoolExecutor, as_completed
 import logging
 from datetime import datetime, timedelta
 import threading
 
+from vcloud_store import (
+    file_fingerprint, read_link_manifest, load_link_manifest, manifest_matches_input, build_link_manifest,
+    save_link_manifest, top_level_entries, rebuild_from_entries, entry_digest, entry_result_digests,
+    output_matches_manifest, record_output_in_manifest, atomic_write_json, load_json_with_fallback,
+    BatchedPersister, output_path, check_compression, load_json_output, write_json_output, atomic_write_bytes,
+)
+from vcloud_scan import scan_url_fields, splice_values
+
+from vcloud_transport import (
+    new_client, hedged_get, configure_timeouts, configure_hedging, hedge_stats,
+    configure_redirect_memo, redirect_memo_lookup, redirect_memo_store, redirect_memo_stats,
+    configure_dns_cache, warm_dns, dns_stats, KNOWN_HOSTS, configure_host_limits,
+    configure_tracing, close_tracing, start_link_trace, finish_link_trace, trace_branch,
+    configure_accept_encoding,
+    configure_proxies, egress_capacity, egress_stats, link_egress, egress_failed, report_captcha,
+    captcha_count,
+)
+from vcloud_profile import start_profiling, stop_profiling, profile_section, profiled
+from vcloud_starts import export_progress, message_key, update_message_keys
+from vcloud_replay import start_recording, record_link_result, stop_recording
+
+# httpx and concurrent.futures are imported where they are first needed,
+# so a resume that finds nothing left to do never pays for loading them
+
 # Set up logging to only show warnings and errors
 logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -30,198 +79,209 @@ logger = logging.getLogger(__name__)
 # Global lock for thread-safe file writing
 progress_lock = threading.Lock()
 
+# Set on SIGINT/SIGTERM: no new links are started and waits between phases are cut short
+shutdown_event = threading.Event()
 
-def get_hubcloud_url_from_vcloud(vcloud_url):
+
+class ShutdownRequested(Exception):
     """
-    Replicate the functionality of vcloud_resolver.sh to get to the hubcloud URL with re parameter
-    Uses fresh HTTP client like the working individual resolver
-    Handles both regular vcloud.zip links and API-style links
+    Raised inside a worker to abandon a link when the run is shutting down
     """
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64; rv:143.0) Gecko/20100101 Firefox/143.0',
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-        'Accept-Language': 'en-US,en;q=0.5',
-        'Accept-Encoding': 'gzip, deflate, br, zstd',
-        'Connection': 'keep-alive',
-        'Upgrade-Insecure-Requests': '1',
-        'Sec-Fetch-Dest': 'document',
-        'Sec-Fetch-Mode': 'navigate',
-        'Sec-Fetch-Site': 'none',
-        'Sec-Fetch-User': '?1',
-        'Priority': 'u=0, i'
-    }
 
-    # Check if this is an API-style URL (contains /api/)
-    if '/api/' in vcloud_url:
-        print(f"Processing API-style URL: {vcloud_url}")
-        # For API-style URLs, we need to get the actual vcloud.zip URL from the HTML
-        with httpx.Client() as client:
-            response = client.get(vcloud_url, headers=headers)
-            html_response = response.text
-
-            # Extract the actual vcloud.zip URL from the HTML
-            # Look for href attributes containing vcloud.zip
-            actual_url_match = re.search(r'href="(https://vcloud\.zip/[^\s\'\"<>]+)"', html_response)
-            if actual_url_match:
-                actual_vcloud_url = actual_url_match.group(1)
-                print(f"Found actual vcloud URL: {actual_vcloud_url}")
-                # Now process the actual URL
-                vcloud_url = actual_vcloud_url
-            else:
-                raise ValueError(f"Could not find actual vcloud.zip URL in API response for {vcloud_url}")
 
+# Browser-like headers sent with every request
+# Accept-Encoding is set per stage, see STAGE_ACCEPT_ENCODING in vcloud_transport
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64; rv:143.0) Gecko/20100101 Firefox/143.0',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+    'Connection': 'keep-alive',
+    'Upgrade-Insecure-Requests': '1',
+    'Sec-Fetch-Dest': 'document',
+    'Sec-Fetch-Mode': 'navigate',
+    'Sec-Fetch-Site': 'none',
+    'Sec-Fetch-User': '?1',
+    'Priority': 'u=0, i'
+}
+
+# Delay between the two phases to improve success rate
+PHASE_DELAY = 5
+
+
+def resolve_api_vcloud_url(api_url):
+    """
+    Get the actual vcloud.zip URL linked from an API-style URL (contains /api/)
+    """
+    print(f"Processing API-style URL: {api_url}")
+    # For API-style URLs, we need to get the actual vcloud.zip URL from the HTML
+    with new_client() as client:
+        response = hedged_get(client, api_url, "vcloud_api", headers=HEADERS)
+        html_response = response.text
+
+    # Extract the actual vcloud.zip URL from the HTML
+    # Look for href attributes containing vcloud.zip
+    actual_url_match = re.search(r'href="(https://vcloud\.zip/[^\s\'\"<>]+)"', html_response)
+    if not actual_url_match:
+        raise ValueError(f"Could not find actual vcloud.zip URL in API response for {api_url}")
+
+    actual_vcloud_url = actual_url_match.group(1)
+    print(f"Found actual vcloud URL: {actual_vcloud_url}")
+    return actual_vcloud_url
+
+
+def decode_id_from_foo_url(url):
+    """
+    Decode the base64 string after /foo/ and extract the id parameter from it
+    """
+    foo_match = re.search(r'foo/([^/]*)', url)
+
+    if not foo_match:
+        raise ValueError("Could not extract base64 string after /foo/")
+
+    base64_part = foo_match.group(1)
+    try:
+        decoded_bytes = base64.b64decode(base64_part)
+        decoded_url = decoded_bytes.decode('utf-8')
+    except Exception as e:
+        raise ValueError(f"Could not decode base64 string: {str(e)}")
+
+    # Extract id parameter directly from the URL string to preserve + signs
+    id_match = re.search(r'[?&]id=([^&]*)', decoded_url)
+    if not id_match:
+        raise ValueError("Could not extract id parameter from decoded URL")
+
+    return id_match.group(1)
+
+
+def fetch_hubcloud_id(vcloud_url):
+    """
+    GET the vcloud link and extract the hubcloud id from the cdn.ampproject.org URL in its HTML
+    """
     # Create a fresh client for each URL like the working individual resolver
-    with httpx.Client() as client:
+    with new_client() as client:
         # Step 1: GET the vcloud link to get the HTML
-        response = client.get(vcloud_url, headers=headers)
+        response = hedged_get(client, vcloud_url, "vcloud_page", headers=HEADERS)
         html_response = response.text
 
-        # Step 2: Extract the cdn.ampproject.org URL from the HTML
-        amp_url_match = re.search(r'https://[^\s"<>\']*\.cdn\.ampproject\.org[^\s"<>\']*', html_response)
+    # Step 2: Extract the cdn.ampproject.org URL from the HTML
+    amp_url_match = re.search(r'https://[^\s"<>\']*\.cdn\.ampproject\.org[^\s"<>\']*', html_response)
 
-        if not amp_url_match:
-            all_amp_urls = re.findall(r'https://[^\s"<>\']*ampproject[^\s"<>\']*', html_response)
-            if all_amp_urls:
-                amp_url = all_amp_urls[0]  # Use the first one found
-            else:
-                raise ValueError("Could not find cdn.ampproject.org URL in the response")
+    if not amp_url_match:
+        all_amp_urls = re.findall(r'https://[^\s"<>\']*ampproject[^\s"<>\']*', html_response)
+        if all_amp_urls:
+            amp_url = all_amp_urls[0]  # Use the first one found
+            trace_branch("amp_any")
         else:
-            amp_url = amp_url_match.group(0)
+            raise ValueError("Could not find cdn.ampproject.org URL in the response")
+    else:
+        amp_url = amp_url_match.group(0)
+        trace_branch("amp_cdn")
 
-        # Step 3: Decode the base64 string after /foo/ to get the URL with id parameter
-        foo_match = re.search(r'foo/([^/]*)', amp_url)
+    # Steps 3 and 4: Decode the base64 string after /foo/ and extract the id parameter
+    return decode_id_from_foo_url(amp_url)
 
-        if not foo_match:
-            raise ValueError("Could not extract base64 string after /foo/")
 
-        base64_part = foo_match.group(1)
+def hubcloud_id_from_url(vcloud_url):
+    """
+    Shortcut: return the hubcloud id when it can be read from the vcloud URL itself,
+    either as an id parameter or as a /foo/ segment, so the page fetch can be skipped
+    Returns None for ordinary links
+    """
+    id_match = re.search(r'[?&]id=([^&]+)', vcloud_url)
+    if id_match:
+        return id_match.group(1)
+    if 'foo/' in vcloud_url:
+        try:
+            return decode_id_from_foo_url(vcloud_url)
+        except ValueError:
+            return None
+    return None
+
+
+def decode_r_from_url(url):
+    """
+    Decode the r parameter from a hubcloud redirect URL, going through /re2/ when present
+    Returns the URL as-is when it has neither
+    """
+    # Check for /re2/ in the URL
+    re2_match = re.search(r're2/([^/]+)', url)
+
+    if re2_match:
+        trace_branch("re2")
+        base64_re2 = re2_match.group(1)
+        # URL decode the base64 string to restore + signs
+        base64_re2 = unquote_plus(base64_re2)
         try:
-            decoded_bytes = base64.b64decode(base64_part)
-            decoded_url = decoded_bytes.decode('utf-8')
+            decoded_re2_bytes = base64.b64decode(base64_re2)
+            decoded_re2 = decoded_re2_bytes.decode('utf-8')
         except Exception as e:
-            raise ValueError(f"Could not decode base64 string: {str(e)}")
+            raise ValueError(f"Could not decode base64 string after /re2/: {str(e)}")
+
+        # Step 7: Decode the base64 string in the r parameter of the resulting URL
+        # Extract r parameter directly from the URL string to preserve + signs
+        r_match = re.search(r'[?&]r=([^&]*)', decoded_re2)
+        if not r_match:
+            raise ValueError("Could not extract r parameter")
+    else:
+        # If no /re2/, look for base64 in the r parameter of the URL directly
+        r_match = re.search(r'[?&]r=([^&]*)', url)
+        if not r_match:
+            # If no r parameter, return the URL as-is
+            trace_branch("as_is")
+            return url
+        trace_branch("r_param")
+
+    r_param = r_match.group(1)
+    # URL decode the r parameter to restore + signs
+    r_param = unquote_plus(r_param)
+    try:
+        decoded_r_bytes = base64.b64decode(r_param)
+        decoded_r = decoded_r_bytes.decode('utf-8')
+    except Exception as e:
+        raise ValueError(f"Could not decode r parameter: {str(e)}")
 
-        # Step 4: Extract the id parameter from the decoded URL
-        # Extract id parameter directly from the URL string to preserve + signs
-        id_match = re.search(r'[?&]id=([^&]*)', decoded_url)
-        if not id_match:
-            raise ValueError("Could not extract id parameter from decoded URL")
+    return decoded_r
 
-        id_value = id_match.group(1)
 
-        # Step 5: Construct the hubcloud.one/tg//go?id= URL and GET it
-        hubcloud_url = f"https://hubcloud.one/tg//go?id={id_value}"
+def resolve_hubcloud_id(id_value):
+    """
+    GET hubcloud.one/tg//go?id= for the id and decode the URL it redirects to
+    """
+    # Step 5: Construct the hubcloud.one/tg//go?id= URL and GET it
+    hubcloud_url = f"https://hubcloud.one/tg//go?id={id_value}"
 
+    with new_client() as client:
         # Perform the request with follow_redirects=True to get the final URL like the bash script does
-        final_response = client.get(hubcloud_url, headers=headers, follow_redirects=True)
+        # Only the final URL is used, so the landing page itself isn't downloaded
+        final_response = hedged_get(client, hubcloud_url, "hubcloud_go", headers=HEADERS, follow_redirects=True,
+                                    headers_only=True)
         final_url = str(final_response.url)
 
-        # Check if we got redirected to a Google "sorry" page (captcha)
-        if "google.com/sorry" in final_url:
-            # Extract the continue parameter which contains the actual destination
-            continue_match = re.search(r'continue=([^&]*)', final_url)
-            if continue_match:
-                continue_url_encoded = continue_match.group(1)
-                import urllib.parse
-                actual_url = urllib.parse.unquote(continue_url_encoded)
-
-                # Now process the actual URL
-                # Check for /re2/ in the actual URL
-                re2_match = re.search(r're2/([^/]+)', actual_url)
-
-                if re2_match:
-                    base64_re2 = re2_match.group(1)
-                    # URL decode the base64 string to restore + signs
-                    base64_re2 = unquote_plus(base64_re2)
-                    try:
-                        decoded_re2_bytes = base64.b64decode(base64_re2)
-                        decoded_re2 = decoded_re2_bytes.decode('utf-8')
-                    except Exception as e:
-                        raise ValueError(f"Could not decode base64 string after /re2/: {str(e)}")
-
-                    # Step 7: Decode the base64 string in the r parameter of the resulting URL
-                    # Extract r parameter directly from the URL string to preserve + signs
-                    r_match = re.search(r'[?&]r=([^&]*)', decoded_re2)
-                    if not r_match:
-                        raise ValueError("Could not extract r parameter")
+    # Check if we got redirected to a Google "sorry" page (captcha)
+    if "google.com/sorry" in final_url:
+        # Extract the continue parameter which contains the actual destination
+        continue_match = re.search(r'continue=([^&]*)', final_url)
+        if not continue_match:
+            raise ValueError("Could not extract continue URL from Google captcha page")
+        trace_branch("captcha_continue")
+        report_captcha()
+        import urllib.parse
+        final_url = urllib.parse.unquote(continue_match.group(1))
 
-                    r_param = r_match.group(1)
-                    # URL decode the r parameter to restore + signs
-                    r_param = unquote_plus(r_param)
-                    try:
-                        decoded_r_bytes = base64.b64decode(r_param)
-                        decoded_r = decoded_r_bytes.decode('utf-8')
-                    except Exception as e:
-                        raise ValueError(f"Could not decode r parameter: {str(e)}")
-
-                    return decoded_r
-                else:
-                    # If no /re2/ in the actual URL, look for r parameter
-                    r_match = re.search(r'[?&]r=([^&]*)', actual_url)
-                    if r_match:
-                        r_param = r_match.group(1)
-                        # URL decode the r parameter to restore + signs
-                        r_param = unquote_plus(r_param)
-                        try:
-                            decoded_r_bytes = base64.b64decode(r_param)
-                            decoded_r = decoded_r_bytes.decode('utf-8')
-                        except Exception as e:
-                            raise ValueError(f"Could not decode r parameter: {str(e)}")
-
-                        return decoded_r
-                    else:
-                        # If no r parameter, return the actual URL as-is
-                        return actual_url
-            else:
-                raise ValueError("Could not extract continue URL from Google captcha page")
-
-        # Original logic for non-captcha pages
-        re2_match = re.search(r're2/([^/]+)', final_url)
-
-        if re2_match:
-            base64_re2 = re2_match.group(1)
-            # URL decode the base64 string to restore + signs
-            base64_re2 = unquote_plus(base64_re2)
-            try:
-                decoded_re2_bytes = base64.b64decode(base64_re2)
-                decoded_re2 = decoded_re2_bytes.decode('utf-8')
-            except Exception as e:
-                raise ValueError(f"Could not decode base64 string after /re2/: {str(e)}")
+    return decode_r_from_url(final_url)
 
-            # Step 7: Decode the base64 string in the r parameter of the resulting URL
-            # Extract r parameter directly from the URL string to preserve + signs
-            r_match = re.search(r'[?&]r=([^&]*)', decoded_re2)
-            if not r_match:
-                raise ValueError("Could not extract r parameter")
 
-            r_param = r_match.group(1)
-            # URL decode the r parameter to restore + signs
-            r_param = unquote_plus(r_param)
-            try:
-                decoded_r_bytes = base64.b64decode(r_param)
-                decoded_r = decoded_r_bytes.decode('utf-8')
-            except Exception as e:
-                raise ValueError(f"Could not decode r parameter: {str(e)}")
+def get_hubcloud_url_from_vcloud(vcloud_url):
+    """
+    Replicate the functionality of vcloud_resolver.sh to get to the hubcloud URL with re parameter
+    Uses fresh HTTP client like the working individual resolver
+    Handles both regular vcloud.zip links and API-style links
+    """
+    # Check if this is an API-style URL (contains /api/)
+    if '/api/' in vcloud_url:
+        vcloud_url = resolve_api_vcloud_url(vcloud_url)
 
-            return decoded_r
-        else:
-            # If no /re2/, look for base64 in the r parameter of the final URL directly
-            # Extract r parameter directly from the final URL
-            r_match = re.search(r'[?&]r=([^&]*)', final_url)
-            if r_match:
-                r_param = r_match.group(1)
-                # URL decode the r parameter to restore + signs
-                r_param = unquote_plus(r_param)
-                try:
-                    decoded_r_bytes = base64.b64decode(r_param)
-                    decoded_r = decoded_r_bytes.decode('utf-8')
-                except Exception as e:
-                    raise ValueError(f"Could not decode r parameter: {str(e)}")
-
-                return decoded_r
-            else:
-                # If no r parameter, return the final URL as-is
-                return final_url
+    return resolve_hubcloud_id(fetch_hubcloud_id(vcloud_url))
 
 
 def follow_redirect_chain_and_extract_start(decoded_r_url):
@@ -229,31 +289,28 @@ def follow_redirect_chain_and_extract_start(decoded_r_url):
     Follow the redirect chain from the decoded_r URL and extract the start parameter
     Uses fresh HTTP client like the working individual resolver
     """
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64; rv:143.0) Gecko/20100101 Firefox/143.0',
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-        'Accept-Language': 'en-US,en;q=0.5',
-        'Accept-Encoding': 'gzip, deflate, br, zstd',
-        'Connection': 'keep-alive',
-        'Upgrade-Insecure-Requests': '1',
-        'Sec-Fetch-Dest': 'document',
-        'Sec-Fetch-Mode': 'navigate',
-        'Sec-Fetch-Site': 'none',
-        'Sec-Fetch-User': '?1',
-        'Priority': 'u=0, i'
-    }
-
     current_url = decoded_r_url
     max_redirects = 10
     redirect_count = 0
+    response = None
 
     # Create a fresh client for each redirect chain like the working individual resolver
-    with httpx.Client() as client:
+    with new_client() as client:
         while redirect_count < max_redirects:
-            response = client.get(current_url, headers=headers, follow_redirects=False)
+            # Jump over hops other chains have already followed
+            memo_url = redirect_memo_lookup(current_url)
+            if memo_url:
+                trace_branch("memo_skip")
+                current_url = memo_url
+                redirect_count += 1
+                continue
+
+            response = hedged_get(client, current_url, "redirect_hop", headers=HEADERS, follow_redirects=False)
             location = response.headers.get('Location')
 
             if location:
+                trace_branch("location")
+                redirect_memo_store(current_url, response, location)
                 current_url = location
                 redirect_count += 1
                 continue  # Continue the loop to follow the next redirect
@@ -262,6 +319,7 @@ def follow_redirect_chain_and_extract_start(decoded_r_url):
             meta_refresh_match = re.search(r'url=([^\'"&\s<>]+)', response.text)
 
             if meta_refresh_match:
+                trace_branch("meta_refresh")
                 import urllib.parse
                 meta_url = urllib.parse.unquote(meta_refresh_match.group(1))
                 # If the URL is relative, make it absolute
@@ -280,6 +338,8 @@ def follow_redirect_chain_and_extract_start(decoded_r_url):
             break
         else:
             # If we hit the max redirects limit
+            if response is None:
+                raise ValueError("Redirect memo loops without reaching a page")
             final_response_php = response
             final_redirect_url = str(response.url)
 
@@ -289,47 +349,281 @@ def follow_redirect_chain_and_extract_start(decoded_r_url):
         start_param_list = final_query.get('start', [])
 
         if start_param_list:
+            trace_branch("start_query")
             return start_param_list[0]
         else:
             # Check if start parameter is in the HTML content
             start_match = re.search(r'start=([^\'"&\s<>]+)', final_response_php.text)
             if start_match:
+                trace_branch("start_html")
                 import urllib.parse
                 return urllib.parse.unquote(start_match.group(1))
             else:
                 # As a last resort, check the final URL directly
                 final_url_start_match = re.search(r'[?&]start=([^&\s\'"<>#]+)', final_redirect_url)
                 if final_url_start_match:
+                    trace_branch("start_url")
                     import urllib.parse
                     return urllib.parse.unquote(final_url_start_match.group(1))
                 else:
                     raise ValueError("Could not extract start parameter from any source")
 
 
-def process_vcloud_link(vcloud_url):
+class LinkResolver:
     """
-    Process a single vcloud URL and return the start parameter
-    Uses fresh HTTP clients like the working individual resolver
+    Describes how to turn one kind of link into a start parameter
+    stages is a list of (name, function, delay) run in order, each function takes the
+    previous stage's value; delay is slept before the stage when an earlier stage ran.
+    outputs names the intermediate value some stages produce ({stage: name}), so it can be
+    persisted and used to skip those stages next time.
+    shortcut(url) may return (stage name, value) to start the chain at a later stage
+    host_limits caps concurrent requests per host for this kind of link
     """
-    try:
-        # Step 1: Use vcloud_resolver.sh logic to get to the hubcloud URL
-        decoded_r_url = get_hubcloud_url_from_vcloud(vcloud_url)
 
-        # Add a delay between the two phases to improve success rate
-        time.sleep(5)
+    def __init__(self, name, pattern, stages, shortcut=None, host_limits=None, outputs=None):
+        self.name = name
+        self.pattern = re.compile(pattern)
+        self.stages = stages
+        self.shortcut = shortcut
+        self.host_limits = host_limits or {}
+        self.outputs = outputs or {}
+
+    def matches(self, url):
+        return self.pattern.search(url) is not None
+
+    def starting_points(self, url, known):
+        """
+        Return the (stage index, value, output name) triples the chain can start from,
+        cheapest first; output name is the known value's name, None when the value isn't
+        a stored one
+        """
+        points = []
+        # Stage i can start from a known output of stage i - 1
+        for index in range(len(self.stages) - 1, 0, -1):
+            name = self.outputs.get(self.stages[index - 1][0])
+            if name and known.get(name):
+                points.append((index, known[name], name))
+
+        if self.shortcut is not None:
+            shortcut = self.shortcut(url)
+            if shortcut is not None:
+                stage_name, value = shortcut
+                points.append(([stage[0] for stage in self.stages].index(stage_name), value, None))
+
+        points.append((0, url, None))
+        points.sort(key=lambda point: -point[0])
+        return points
+
+    def resolve(self, url, known=None, on_stage=None, on_stale=None):
+        """
+        Run the cheapest chain of stages for url and return the start parameter
+        known maps output names to values from the catalogue or an earlier run; the chain
+        starts after the latest stage whose output is known. If a known value turns out
+        to be stale the chain falls back to the next cheapest starting point.
+        on_stage(stage name, output name or None, value, seconds) is called after every stage
+        on_stale(output name) is called for every known value the chain gave up on
+        """
+        points = self.starting_points(url, known or {})
+        for attempt, (start_index, value, known_name) in enumerate(points):
+            try:
+                return self.run_stages(start_index, value, on_stage)
+            except ShutdownRequested:
+                raise
+            except Exception as e:
+                if attempt == len(points) - 1:
+                    raise
+                # A known value may point at a host that is gone, so any error falls back.
+                # Otherwise only a failed extraction does, for network errors going back
+                # wouldn't help
+                if known_name is None and not isinstance(e, ValueError):
+                    raise
+                if known_name is not None and on_stale is not None:
+                    on_stale(known_name)
+
+    def revalidate(self, url, known=None, on_stage=None):
+        """
+        Cheaply check that the values stored for url still hold
+        The chain runs from its cheapest start that doesn't rely on stored outputs (the
+        shortcut or the beginning) up to the first stage whose output is stored, and the
+        fresh output is compared with the stored one. Returns None when they match, the
+        stored start parameter still holds then. Otherwise the rest of the chain runs from
+        the fresh value and its start parameter is returned
+        """
+        known = known or {}
+        start_index, value = 0, url
+        shortcut = self.shortcut(url) if self.shortcut is not None else None
+        if shortcut is not None:
+            stage_name, value = shortcut
+            start_index = [stage[0] for stage in self.stages].index(stage_name)
+
+        for index in range(start_index, len(self.stages)):
+            name = self.outputs.get(self.stages[index][0])
+            if name and known.get(name):
+                fresh = self.run_stages(start_index, value, on_stage, stop=index + 1)
+                if fresh == known[name]:
+                    return None
+                trace_branch("drift")
+                return self.run_stages(index + 1, fresh, on_stage, ran_stage=True)
+        # Nothing stored to compare with, only resolving the whole chain tells
+        return self.run_stages(start_index, value, on_stage)
+
+    def run_stages(self, start_index, value, on_stage=None, stop=None, ran_stage=False):
+        """
+        Run stages start_index up to stop (the end when None) on value and return the last output
+        ran_stage tells that an earlier stage already ran, so the next stage's delay applies
+        """
+        for stage_name, func, delay in self.stages[start_index:stop]:
+            if delay and ran_stage:
+                # Interruptible sleep, the values produced so far are already recorded
+                # so the next run picks the link up from here
+                if shutdown_event.wait(delay):
+                    raise ShutdownRequested("shutdown requested")
+            elif ran_stage and shutdown_event.is_set():
+                raise ShutdownRequested("shutdown requested")
+            started = time.monotonic()
+            with profile_section(stage_name):
+                value = func(value)
+            ran_stage = True
+            if on_stage is not None:
+                on_stage(stage_name, self.outputs.get(stage_name), value, time.monotonic() - started)
+        return value
+
+
+# Registered resolvers, the first one whose pattern matches a link handles it
+RESOLVERS = []
+
+
+def register_resolver(resolver, first=False):
+    """
+    Register a resolver for a new kind of link
+    Resolvers registered with first=True take precedence over the built-in ones
+    """
+    if first:
+        RESOLVERS.insert(0, resolver)
+    else:
+        RESOLVERS.append(resolver)
+    if resolver.host_limits:
+        configure_host_limits(resolver.host_limits)
 
-        # Step 2: Use debug_new_url.py logic to follow the redirect chain and extract start parameter
-        start_param = follow_redirect_chain_and_extract_start(decoded_r_url)
 
-        return start_param
-    except Exception as e:
-        print(f"Error processing {vcloud_url}: {e}")
-        return None
+def match_resolver(url):
+    """
+    Return the resolver handling url, or None when no resolver knows the link
+    """
+    for resolver in RESOLVERS:
+        if resolver.matches(url):
+            return resolver
+    return None
+
+
+def resolvers_signature():
+    """
+    Identify the registered link patterns, so cached link lists are rebuilt when they change
+    """
+    return "|".join(f"{resolver.name}={resolver.pattern.pattern}" for resolver in RESOLVERS)
+
+
+def _vcloud_shortcut(url):
+    id_value = hubcloud_id_from_url(url)
+    return ("hubcloud_go", id_value) if id_value else None
+
+
+VCLOUD_STAGES = [
+    ("vcloud_page", fetch_hubcloud_id, 0),
+    ("hubcloud_go", resolve_hubcloud_id, 0),
+    ("redirect_chain", follow_redirect_chain_and_extract_start, PHASE_DELAY),
+]
+
+# The hubcloud id and the decoded r URL are persisted, so re-resolving a link skips phase 1
+VCLOUD_OUTPUTS = {"vcloud_page": "id", "hubcloud_go": "decoded_r"}
+
+# Fields of a link's parent object in the catalogue that supply those values
+CATALOGUE_KNOWN_FIELDS = {"hubcloud_id": "id", "decoded_r": "decoded_r"}
+
+# API-style links first need the actual vcloud.zip URL from their HTML
+register_resolver(LinkResolver("vcloud_api", r'^(?=.*vcloud\.zip).*/api/',
+                               [("vcloud_api", resolve_api_vcloud_url, 0)] + VCLOUD_STAGES,
+                               outputs=VCLOUD_OUTPUTS))
+register_resolver(LinkResolver("vcloud", r'vcloud\.zip', VCLOUD_STAGES, shortcut=_vcloud_shortcut,
+                               outputs=VCLOUD_OUTPUTS))
+
+
+def load_resolver_plugins(module_names):
+    """
+    Import modules that register extra resolvers, so new mirror domains
+    can be supported without editing this script
+    """
+    import importlib
+
+    for module_name in module_names:
+        importlib.import_module(module_name)
+
+
+def resolve_link(vcloud_url, known=None, stored_start=None):
+    """
+    Resolve a single link and return a record of the outcome:
+    {"url", "start", "timings", "intermediate", "error", "drift", "stale"} where timings
+    holds the seconds spent in each stage, intermediate the values produced along the way
+    (hubcloud id, decoded r URL) for later runs to reuse and stale the names of known
+    values the chain had to fall back from
+    known holds such values from the catalogue or an earlier run
+    With stored_start, the start parameter of an earlier run, the link is revalidated
+    instead (see LinkResolver.revalidate): drift tells whether the start parameter changed
+    """
+    record = {"url": vcloud_url, "start": None, "timings": {}, "intermediate": {}, "error": None,
+              "drift": None, "stale": []}
+    start_link_trace(vcloud_url)
+
+    def on_stage(stage_name, output_name, value, seconds):
+        record["timings"][stage_name] = round(seconds, 3)
+        if output_name:
+            record["intermediate"][output_name] = value
+
+    def on_stale(output_name):
+        record["stale"].append(output_name)
+
+    interrupted = False
+    # Every hop of the chain leaves through the same egress when there is a proxy pool
+    with link_egress():
+        try:
+            resolver = match_resolver(vcloud_url)
+            if resolver is None:
+                raise ValueError("No resolver registered for this link")
+
+            if stored_start is not None:
+                # Only the first stored value is checked, the chain runs on if it drifted
+                start = resolver.revalidate(vcloud_url, known, on_stage)
+                record["start"] = stored_start if start is None else start
+                record["drift"] = record["start"] != stored_start
+            else:
+                # Run the resolver's stages: get to the hubcloud URL, then follow the
+                # redirect chain and extract the start parameter
+                record["start"] = resolver.resolve(vcloud_url, known, on_stage, on_stale)
+        except ShutdownRequested as e:
+            record["error"] = str(e)
+            interrupted = True
+        except Exception as e:
+            print(f"Error processing {vcloud_url}: {e}")
+            record["error"] = str(e)
+            egress_failed()
+    finish_link_trace(record["start"], record["error"])
+    if not interrupted:
+        record_link_result(vcloud_url, record["start"], record["error"])
+    return record
+
+
+def process_vcloud_link(vcloud_url, known=None):
+    """
+    Process a single vcloud URL and return the start parameter
+    Uses fresh HTTP clients like the working individual resolver
+    """
+    return resolve_link(vcloud_url, known)["start"]
 
 
 def find_vcloud_links(data, links_list=None):
     """
     Recursively find all vcloud.zip links in the JSON data
+    Any link a registered resolver matches counts, not only vcloud.zip ones
     Returns a list of tuples: (path_to_link, link_url)
     """
     if links_list is None:
@@ -337,7 +631,7 @@ def find_vcloud_links(data, links_list=None):
 
     if isinstance(data, dict):
         for key, value in data.items():
-            if key == "url" and isinstance(value, str) and "vcloud.zip" in value:
+            if key == "url" and isinstance(value, str) and match_resolver(value) is not None:
                 # Find the parent object that contains this URL
                 path = [data]
                 links_list.append((path, value))
@@ -357,12 +651,13 @@ def update_json_with_results(data, results_map):
     def update_recursive(obj):
         if isinstance(obj, dict):
             for key, value in obj.items():
-                if key == "url" and isinstance(value, str) and "vcloud.zip" in value and value in results_map:
+                # Only discovered links are keys of results_map
+                if key == "url" and isinstance(value, str) and value in results_map:
                     # Replace the URL with the start parameter
                     obj[key] = results_map[value]
                 elif isinstance(value, (dict, list)):
                     update_recursive(value)
-        elif isinstance(data, list):
+        elif isinstance(obj, list):
             for item in obj:
                 update_recursive(item)
 
@@ -373,137 +668,1165 @@ def load_progress(progress_file):
     """
     Load progress from a file
     """
-    if os.path.exists(progress_file):
-        # Check if file is empty
-        if os.path.getsize(progress_file) == 0:
-            return {"processed": {}}
-        with open(progress_file, 'r') as f:
-            return json.load(f)
-    return {"processed": {}}
+    # A truncated or corrupt file falls back to the last good snapshot instead of resetting
+    progress = load_json_with_fallback(progress_file, default={"processed": {}})
+    # Intermediate values (hubcloud id, decoded r URL) per link, see resolve_link
+    progress.setdefault("intermediate", {})
+    # When each link's start value was last confirmed by a revalidation
+    progress.setdefault("validated", {})
+    # Intermediate values that turned out stale, per link
+    progress.setdefault("stale", {})
+    # [channel id, message id] each processed link's start value points at, None when it
+    # points elsewhere, see vcloud_starts.message_key
+    progress.setdefault("messages", {})
+    return progress
 
 
 def save_progress(progress_file, progress_data):
     """
     Save progress to a file
     """
-    with progress_lock:  # Thread-safe file writing
-        with open(progress_file, 'w') as f:
-            json.dump(progress_data, f, indent=2)
+    with progress_lock, profile_section("save_progress"):  # Thread-safe file writing
+        # Written to a temp file and renamed into place so a crash never truncates it
+        atomic_write_json(progress_file, progress_data, indent=2)
 
 
-def process_json_file(input_file, num_workers=5):
+def apply_link_record(progress, record):
     """
-    Process the JSON file with vcloud.zip links
-    Uses parallel processing with multiple workers
+    Store the outcome of resolve_link in the progress data
+    together with the message its start value points at
     """
-    # Define progress and output file names
-    base_name = os.path.splitext(input_file)[0]
-    progress_file = f"{base_name}_progress.json"
-    output_file = f"{base_name}_output.json"
+    url = record["url"]
+    # Forget stored values that led nowhere, and remember them so the catalogue doesn't
+    # supply them again; the fallback's fresh values replace them below
+    stored = progress["intermediate"].get(url)
+    if stored:
+        for name in record.get("stale", ()):
+            if name in stored:
+                progress["stale"].setdefault(url, {})[name] = stored.pop(name)
+        if not stored:
+            del progress["intermediate"][url]
+    # Keep what was learned along the way even when the link failed
+    if record["intermediate"]:
+        progress["intermediate"].setdefault(url, {}).update(record["intermediate"])
+
+    if record["start"] is not None:
+        # Success - store the result
+        progress["processed"][url] = record["start"]
+        progress["messages"][url] = message_key(record["start"])
+        if record.get("drift") is not None:
+            progress["validated"][url] = time.time()
+
+
+# Result streams whose reader went away
+_abandoned_streams = set()
+
+
+def open_result_stream(path):
+    """
+    Open the NDJSON result stream, "-" streams to stdout
+    When streaming to stdout, the progress output moves to stderr so the stream stays parseable
+    """
+    if path == "-":
+        stream = sys.stdout
+        sys.stdout = sys.stderr
+        return stream
+    # Line buffered so each record reaches a FIFO reader as soon as it is written
+    return open(path, 'w', buffering=1)
 
-    # Load the JSON data
-    with open(input_file, 'r') as f:
-        data = json.load(f)
 
-    # Find all vcloud.zip links
-    print("Finding vcloud.zip links in JSON data...")
-    vcloud_links = find_vcloud_links(data)
+def close_result_stream(stream, path):
+    """
+    Close a stream from open_result_stream, for "-" stdout is given its place back
+    unless the reader went away
+    """
+    abandoned = stream in _abandoned_streams
+    _abandoned_streams.discard(stream)
+    if path != "-":
+        try:
+            stream.close()
+        except (BrokenPipeError, ValueError):
+            pass
+        return
+    if not abandoned:
+        sys.stdout = stream
 
-    # Extract just the URLs for processing
-    vcloud_urls = [link[1] for link in vcloud_links]
-    print(f"Found {len(vcloud_urls)} vcloud.zip links to process")
 
-    # Load previous progress
-    progress = load_progress(progress_file)
+def write_result_record(stream, record):
+    """
+    Write one {url, start, timings, error} record to the result stream
+    Returns False when the consumer went away and streaming should stop
+    """
+    line = json.dumps({
+        "url": record["url"],
+        "start": record["start"],
+        "timings": record["timings"],
+        "error": record["error"],
+    }, separators=(',', ':'))
+    try:
+        stream.write(line + "\n")
+        stream.flush()
+    except (BrokenPipeError, ValueError):
+        print("\nResult stream closed by the reader, no longer streaming", file=sys.stderr)
+        _abandoned_streams.add(stream)
+        return False
+    return True
 
-    # Determine which links still need processing
-    unprocessed_urls = [url for url in vcloud_urls if url not in progress["processed"]]
-    print(f"Unprocessed links: {len(unprocessed_urls)}")
 
-    # Calculate statistics
-    total_links = len(vcloud_urls)
-    processed_count = len(progress["processed"])
-    remaining_count = len(unprocessed_urls)
+class ConcurrencyController:
+    """
+    Number of links allowed in flight at once, adjustable while the run is going
+    The worker pool is sized for maximum, only limit of its threads get work
+    """
+
+    def __init__(self, limit, maximum):
+        self.lock = threading.Lock()
+        self.maximum = max(1, maximum)
+        self.limit = min(max(1, limit), self.maximum)
+
+    def set_limit(self, limit):
+        with self.lock:
+            self.limit = min(max(1, limit), self.maximum)
+            return self.limit
+
+    def adjust(self, delta):
+        with self.lock:
+            self.limit = min(max(1, self.limit + delta), self.maximum)
+            return self.limit
+
+
+class ConcurrencyTuner:
+    """
+    Hill climbing on the concurrency limit: at the end of every window the goodput
+    (successful links per second) is compared with the previous window's, the limit keeps
+    moving the same way while goodput improves, turns around when it drops and goes down
+    when it stays flat, since fewer workers for the same goodput is the better spot
+    An error or captcha rate above max_error_rate backs off multiplicatively instead,
+    whatever the goodput, so a run doesn't keep pushing a host that started refusing it
+    """
+
+    # Goodput changes smaller than this fraction count as flat
+    TOLERANCE = 0.05
+    # Fraction of the limit kept when backing off
+    BACKOFF = 0.7
+    # A window with fewer finished links says too little, it is extended until it has them
+    MIN_SAMPLES = 5
+
+    def __init__(self, controller, minimum=1, window=30.0, step=5, max_error_rate=0.2, captchas=None):
+        self.controller = controller
+        self.minimum = min(max(1, minimum), controller.maximum)
+        self.window = window
+        self.step = max(1, step)
+        self.max_error_rate = max_error_rate
+        # Running count of captchas, read at the start and end of each window
+        self.captchas = captchas or (lambda: 0)
+        self.direction = 1
+        self.previous_goodput = None
+        self.best = (0.0, controller.limit)
+        self._start_window(time.monotonic())
+
+    def _start_window(self, now):
+        self.window_started = now
+        self.successes = 0
+        self.failures = 0
+        self.window_captchas = self.captchas()
+
+    def observe(self, record):
+        """
+        Count a finished link in the current window
+        """
+        if record["start"] is not None:
+            self.successes += 1
+        else:
+            self.failures += 1
+
+    def tick(self, now=None):
+        """
+        Adjust the limit when the current window is over, called regularly by the pool loop
+        Returns (old limit, new limit, goodput, error rate) when the window ended, else None
+        """
+        now = time.monotonic() if now is None else now
+        elapsed = now - self.window_started
+        finished = self.successes + self.failures
+        if elapsed < self.window or finished < self.MIN_SAMPLES:
+            return None
+
+        goodput = self.successes / elapsed
+        captchas = self.captchas() - self.window_captchas
+        error_rate = min(1.0, (self.failures + captchas) / finished)
+        limit = self.controller.limit
+        if goodput > self.best[0]:
+            self.best = (goodput, limit)
+
+        if error_rate > self.max_error_rate:
+            target = int(limit * self.BACKOFF)
+            self.direction = -1
+        else:
+            if self.previous_goodput is not None:
+                if goodput < self.previous_goodput * (1 - self.TOLERANCE):
+                    self.direction = -self.direction
+                elif goodput <= self.previous_goodput * (1 + self.TOLERANCE):
+                    self.direction = -1
+            target = limit + self.direction * self.step
+
+        target = min(max(self.minimum, target), self.controller.maximum)
+        if target == limit:
+            # Stuck at a bound, probe the other way next time
+            self.direction = -self.direction
+        new_limit = self.controller.set_limit(target)
+        self.previous_goodput = goodput
+        self._start_window(now)
+        return limit, new_limit, goodput, error_rate
+
+
+def install_signal_handlers(controller, step, abort=None):
+    """
+    SIGINT/SIGTERM: stop taking new links, let in-flight ones finish and flush progress
+    (a second SIGINT/SIGTERM calls abort(), which abandons in-flight links, flushes
+    progress and exits)
+    SIGUSR1/SIGUSR2: raise/lower the number of concurrent links by step; with controller None
+    (--processes) they are only acknowledged, so they don't kill the run
+    Returns a function restoring the previous handlers
+    """
+    import signal
+
+    if threading.current_thread() is not threading.main_thread():
+        # Signal handlers can only be installed from the main thread
+        return lambda: None
+
+    previous = {}
+
+    def request_shutdown(signum, frame):
+        if shutdown_event.is_set():
+            # Asked twice, stop waiting for in-flight links
+            if abort is None:
+                raise KeyboardInterrupt
+            print(f"\nReceived {signal.Signals(signum).name} again, abandoning in-flight links", flush=True)
+            abort()
+        shutdown_event.set()
+        print(f"\nReceived {signal.Signals(signum).name}, finishing in-flight links and saving progress "
+              f"(send again to exit immediately)", flush=True)
+
+    def change_concurrency(signum, frame):
+        if controller is None:
+            print(f"\nReceived {signal.Signals(signum).name}, changing the concurrency is not supported "
+                  f"with --processes", flush=True)
+            return
+        limit = controller.adjust(step if signum == signal.SIGUSR1 else -step)
+        print(f"\nConcurrency set to {limit}", flush=True)
+
+    handlers = {signal.SIGINT: request_shutdown, signal.SIGTERM: request_shutdown}
+    if hasattr(signal, "SIGUSR1"):
+        handlers[signal.SIGUSR1] = change_concurrency
+        handlers[signal.SIGUSR2] = change_concurrency
+    for signum, handler in handlers.items():
+        previous[signum] = signal.signal(signum, handler)
+
+    def restore():
+        for signum, handler in previous.items():
+            signal.signal(signum, handler)
+
+    return restore
+
+
+def exit_after_flush(persister, status=130):
+    """
+    Save what the persister holds and exit the process at once, without waiting for
+    worker threads still blocked in requests
+    """
+    try:
+        persister.close()
+        print("Progress saved, exiting", flush=True)
+    except Exception as e:
+        print(f"Could not save progress: {e}", file=sys.stderr, flush=True)
+    finally:
+        sys.stderr.flush()
+        os._exit(status)
+
+
+def warm_up_dns(hosts):
+    """
+    Resolve hosts ahead of the first requests and print how long each took
+    """
+    timings = warm_dns(hosts)
+    print("DNS warm-up: " + ", ".join(
+        f"{host} {seconds * 1000:.1f}ms" if isinstance(seconds, float) else f"{host} failed ({seconds})"
+        for host, seconds in timings.items()))
+
 
+def process_unprocessed_urls(unprocessed_urls, progress, progress_file, num_workers,
+                             processed_count, total_links, dns_warmup_hosts=None, result_stream=None,
+                             max_workers=None, concurrency_step=5, flush_every=50, flush_interval=5.0,
+                             weights=None, revalidate=False, auto_tune=None):
+    """
+    Resolve the unprocessed URLs with multiple workers
+    Results are handed to a persistence thread that saves progress every flush_every
+    results or flush_interval seconds, so disk latency never holds up result collection
+    Each outcome is also written to result_stream as NDJSON when one is given
+    Links are handed to the pool only while fewer than the current concurrency limit are
+    in flight, so the limit can be changed with signals while the run is going
+    weights ({url: weight}) sends heavier links to the pool first, links without a weight
+    go last; ties keep document order
+    With revalidate, the links are processed ones whose stored start values are revalidated
+    auto_tune holds keyword arguments of ConcurrencyTuner to let it move the concurrency
+    limit between them and max_workers, starting from num_workers
+    Returns False when the run was stopped by a shutdown request before every link was tried
+    """
+    import heapq
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+    if dns_warmup_hosts:
+        warm_up_dns(dns_warmup_hosts)
+
+    remaining_count = len(unprocessed_urls)
     start_time = time.time()
     completed_tasks = 0
 
+    controller = ConcurrencyController(num_workers, max_workers or num_workers * 4)
+    shutdown_event.clear()
+    # Set once the pool exists, see abort
+    executors = []
+
+    def abort():
+        # Leaving the pool's with block would wait for every in-flight request
+        for executor in executors:
+            executor.shutdown(wait=False, cancel_futures=True)
+        exit_after_flush(persister)
+
+    restore_signal_handlers = install_signal_handlers(controller, concurrency_step, abort)
+    tuner = None
+    if auto_tune is not None:
+        tuner = ConcurrencyTuner(controller, step=concurrency_step, captchas=captcha_count, **auto_tune)
+
+    # Heap of (-weight, document position, url)
+    weights = weights or {}
+    pending_urls = [(-weights.get(url, float("-inf")), position, url)
+                    for position, url in enumerate(unprocessed_urls)]
+    heapq.heapify(pending_urls)
+    intermediate = progress["intermediate"]
+    # Taken before the persister starts changing progress
+    stored_starts = {url: progress["processed"][url] for url in unprocessed_urls} if revalidate else {}
+    worker = profiled(resolve_link)
+    future_to_url = {}
+
+    # From here on only the persister thread modifies progress
+    persister = BatchedPersister(lambda record: apply_link_record(progress, record),
+                                 lambda: save_progress(progress_file, progress),
+                                 batch_size=flush_every, interval=flush_interval)
+    persister.start()
+
     # Process the unprocessed links with multiple workers
-    with ThreadPoolExecutor(max_workers=num_workers) as executor:
-        # Submit tasks for unprocessed URLs
-        future_to_url = {executor.submit(process_vcloud_link, url): url for url in unprocessed_urls}
+    try:
+        with ThreadPoolExecutor(max_workers=controller.maximum) as executor:
+            executors.append(executor)
+            while pending_urls or future_to_url:
+                # Submit tasks for unprocessed URLs up to the current concurrency limit
+                while pending_urls and len(future_to_url) < controller.limit and not shutdown_event.is_set():
+                    url = heapq.heappop(pending_urls)[2]
+                    future_to_url[executor.submit(worker, url, intermediate.get(url), stored_starts.get(url))] = url
+
+                if not future_to_url:
+                    # Shutdown requested and nothing left in flight
+                    break
+
+                # Wake up regularly so signals and limit changes take effect promptly
+                done, _ = wait(future_to_url, timeout=0.5, return_when=FIRST_COMPLETED)
+
+                # Process completed tasks
+                for future in done:
+                    url = future_to_url.pop(future)
+                    try:
+                        record = future.result()
+                        if tuner is not None:
+                            tuner.observe(record)
 
-        # Process completed tasks
-        for future in as_completed(future_to_url):
-            url = future_to_url[future]
-            try:
-                result = future.result()
+                        # Storing and saving the result happens on the persister thread
+                        persister.submit(record)
 
-                if result is not None:
-                    # Success - store the result
-                    progress["processed"][url] = result
+                        if result_stream is not None and not write_result_record(result_stream, record):
+                            result_stream = None
 
-            except Exception as e:
-                # Skip failed links - they will be treated as new in the next run
-                print(f"Exception processing {url}: {e}")
-                pass
+                    except Exception as e:
+                        # Skip failed links - they will be treated as new in the next run
+                        print(f"Exception processing {url}: {e}")
+                        pass
+
+                    # Update statistics
+                    completed_tasks += 1
+                    elapsed_time = time.time() - start_time
+                    avg_time_per_task = elapsed_time / completed_tasks if completed_tasks > 0 else 0
+                    remaining_time = avg_time_per_task * (remaining_count - completed_tasks)
+
+                    # Calculate ETA
+                    eta = datetime.now() + timedelta(seconds=remaining_time)
+
+                    # Print progress
+                    print(f"\rProgress: {processed_count + completed_tasks}/{total_links} | "
+                          f"Remaining: {remaining_count - completed_tasks} | "
+                          f"Workers: {controller.limit} | "
+                          f"Elapsed: {timedelta(seconds=int(elapsed_time))} | "
+                          f"ETA: {eta.strftime('%H:%M:%S')}", end='', flush=True)
+
+                if tuner is not None:
+                    change = tuner.tick()
+                    if change is not None and change[0] != change[1]:
+                        old_limit, new_limit, goodput, error_rate = change
+                        print(f"\nAuto-tune: concurrency {old_limit} -> {new_limit} "
+                              f"({goodput:.2f} links/s, {error_rate:.0%} errors/captchas)", flush=True)
+    finally:
+        restore_signal_handlers()
+        # Whatever happened, the results collected so far are on disk
+        persister.close()
 
-            # Save progress after each completed task
-            save_progress(progress_file, progress)
+    print()  # New line after progress indicator
+    if tuner is not None:
+        goodput, limit = tuner.best
+        print(f"Auto-tune: ended at concurrency {controller.limit}, best goodput {goodput:.2f} links/s "
+              f"at {limit}")
+    return not pending_urls
+
+
+def _resolve_claimed_links(table, urls, intermediate, num_workers, stored_starts):
+    """
+    Body of a worker process: num_workers threads claim links from the shared table
+    until none are left and publish each outcome into it
+    """
+    import signal
+    from concurrent.futures import ThreadPoolExecutor
+
+    # The parent decides when to give up, Ctrl-C reaching the whole process group only
+    # stops this process from starting links; SIGTERM from the parent ends it
+    signal.signal(signal.SIGINT, lambda signum, frame: shutdown_event.set())
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    def work():
+        while not shutdown_event.is_set():
+            index = table.claim()
+            if index is None:
+                return
+            url = urls[index]
+            record = resolve_link(url, intermediate.get(url), stored_starts.get(url))
+            fields = {key: record[key] for key in ("timings", "intermediate", "error", "drift", "stale")}
+            if not table.publish(index, record["start"], fields):
+                print(f"\nResult table full, {url} is left for the next run")
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        for future in [executor.submit(work) for _ in range(num_workers)]:
+            future.result()
 
-            # Update statistics
-            completed_tasks += 1
-            elapsed_time = time.time() - start_time
-            avg_time_per_task = elapsed_time / completed_tasks if completed_tasks > 0 else 0
-            remaining_time = avg_time_per_task * (remaining_count - completed_tasks)
 
-            # Calculate ETA
-            eta = datetime.now() + timedelta(seconds=remaining_time)
+def process_urls_in_processes(unprocessed_urls, progress, progress_file, num_workers, processes,
+                              processed_count, total_links, dns_warmup_hosts=None, result_stream=None,
+                              flush_every=50, flush_interval=5.0, weights=None, revalidate=False):
+    """
+    Resolve the unprocessed URLs in several forked worker processes of num_workers threads each
+    Links are claimed from and results published to a SharedResultTable, so nothing is
+    pickled between processes; this process only reads finished slots and hands them to
+    the persister like process_unprocessed_urls does
+    Per-host and per-egress limits apply within each process
+    Returns False when the run was stopped by a shutdown request before every link was tried
+    """
+    import multiprocessing
+    from vcloud_shared import SharedResultTable
+
+    if dns_warmup_hosts:
+        # Before forking, so every worker process starts with a warm cache
+        warm_up_dns(dns_warmup_hosts)
+
+    weights = weights or {}
+    order = sorted(range(len(unprocessed_urls)),
+                   key=lambda position: (-weights.get(unprocessed_urls[position], float("-inf")), position))
+    urls = [unprocessed_urls[position] for position in order]
+    stored_starts = {url: progress["processed"][url] for url in urls} if revalidate else {}
+
+    context = multiprocessing.get_context("fork")
+    table = SharedResultTable.create(len(urls), context.Lock())
+    shutdown_event.clear()
+    persister = BatchedPersister(lambda record: apply_link_record(progress, record),
+                                 lambda: save_progress(progress_file, progress),
+                                 batch_size=flush_every, interval=flush_interval)
+
+    workers = [context.Process(target=_resolve_claimed_links,
+                               args=(table, urls, progress["intermediate"], num_workers, stored_starts),
+                               daemon=True)
+               for _ in range(processes)]
+
+    def abort():
+        # Results published but not collected yet are resolved again next run, the table's
+        # lock may be held by the loop below
+        for process in workers:
+            if process.is_alive():
+                process.kill()
+        table.memory.unlink()
+        exit_after_flush(persister)
+
+    restore_signal_handlers = install_signal_handlers(None, 0, abort)
+    collected = 0
+    start_time = time.time()
+    completed_tasks = 0
+    try:
+        for process in workers:
+            process.start()
+        # Started only once every worker is forked, so no child inherits the thread's
+        # locks in whatever state they were at the fork
+        persister.start()
+        while True:
+            if shutdown_event.is_set() and not table.stopped():
+                table.request_stop()
+            alive = any(process.is_alive() for process in workers)
+            results, collected = table.collect(collected)
+            for index, start, fields in results:
+                record = dict(fields, url=urls[index], start=start)
+                persister.submit(record)
+                if result_stream is not None and not write_result_record(result_stream, record):
+                    result_stream = None
+                completed_tasks += 1
 
-            # Print progress
-            print(f"\rProgress: {processed_count + completed_tasks}/{total_links} | "
-                  f"Remaining: {remaining_count - completed_tasks} | "
-                  f"Elapsed: {timedelta(seconds=int(elapsed_time))} | "
-                  f"ETA: {eta.strftime('%H:%M:%S')}", end='', flush=True)
+            elapsed_time = time.time() - start_time
+            if completed_tasks:
+                remaining_time = elapsed_time / completed_tasks * (len(urls) - completed_tasks)
+                print(f"\rProgress: {processed_count + completed_tasks}/{total_links} | "
+                      f"Remaining: {len(urls) - completed_tasks} | "
+                      f"Workers: {processes}x{num_workers} | "
+                      f"Elapsed: {timedelta(seconds=int(elapsed_time))} | "
+                      f"ETA: {(datetime.now() + timedelta(seconds=remaining_time)).strftime('%H:%M:%S')}",
+                      end='', flush=True)
+            if not alive:
+                break
+            time.sleep(0.5)
+    finally:
+        restore_signal_handlers()
+        for process in workers:
+            if process.is_alive():
+                # Only still running when the loop above was interrupted
+                process.terminate()
+            if process.pid is not None:
+                process.join()
+        if persister.ident is not None:
+            persister.close()
+        finished = not table.stopped() and table.claimed() >= len(urls)
+        table.close()
 
     print()  # New line after progress indicator
+    return finished
+
+
+def discovery_signature(priority_field=None, scan=False):
+    """
+    Identify how links are discovered, so a manifest built differently is rebuilt
+    """
+    signature = resolvers_signature()
+    if priority_field:
+        signature += f"|priority={priority_field}"
+    if scan:
+        signature += "|scan"
+    return signature
 
-    # Update the original data with successful results
-    for url, start_param in progress["processed"].items():
-        # Find and replace the URL in the original data
-        def replace_url_recursive(obj):
-            if isinstance(obj, dict):
-                for key, value in obj.items():
-                    if key == "url" and isinstance(value, str) and value == url:
-                        obj[key] = start_param
-                    elif isinstance(value, (dict, list)):
-                        replace_url_recursive(value)
-            elif isinstance(obj, list):
-                for item in obj:
-                    replace_url_recursive(item)
-
-        replace_url_recursive(data)
+
+def scan_links(input_file):
+    """
+    Build a manifest of the input's links from its raw bytes, without loading it
+    The manifest also holds the byte range of every link so the output can be spliced,
+    it has no entry digests, catalogue known values or catalogue weights
+    """
+    fingerprint = file_fingerprint(input_file)
+    print("Scanning input for vcloud.zip links...")
+    links, offsets = scan_url_fields(input_file, lambda url: match_resolver(url) is not None)
+    manifest = build_link_manifest(input_file, fingerprint, links, discovery=discovery_signature(scan=True))
+    manifest["offsets"] = offsets
+    return manifest
+
+
+def discover_links(input_file, priority_field=None):
+    """
+    Load the input and build a manifest of its vcloud.zip links
+    With priority_field, the weight of each link is read from that field of its parent object
+    Returns the loaded data and the new manifest
+    """
+    fingerprint = file_fingerprint(input_file)
+
+    # Load the JSON data
+    with open(input_file, 'r') as f:
+        data = json.load(f)
+
+    # Find all vcloud.zip links, remembering which top-level entry each one is in
+    print("Finding vcloud.zip links in JSON data...")
+    entries = top_level_entries(data)
+    if entries is None:
+        links = find_vcloud_links(data)
+        manifest = build_link_manifest(input_file, fingerprint, [link[1] for link in links],
+                                       discovery=discovery_signature(priority_field))
+        manifest["known"] = catalogue_known_values(links)
+        manifest["weights"] = catalogue_weights(links, priority_field)
+        return data, manifest
+
+    links = []
+    link_entries = []
+    entry_digests = []
+    for position, (key, entry) in enumerate(entries):
+        for link in find_vcloud_links(entry):
+            links.append(link)
+            link_entries.append(position)
+        entry_digests.append([key, entry_digest(entry)])
+
+    manifest = build_link_manifest(input_file, fingerprint, [link[1] for link in links], link_entries,
+                                   entry_digests, discovery=discovery_signature(priority_field))
+    manifest["known"] = catalogue_known_values(links)
+    manifest["weights"] = catalogue_weights(links, priority_field)
+    return data, manifest
+
+
+def catalogue_known_values(links):
+    """
+    Collect intermediate values the catalogue already supplies for its links
+    Returns {url: {output name: value}}
+    """
+    known = {}
+    for path, url in links:
+        parent = path[0]
+        values = {name: parent[field] for field, name in CATALOGUE_KNOWN_FIELDS.items()
+                  if isinstance(parent.get(field), str) and parent[field]}
+        if values:
+            known.setdefault(url, {}).update(values)
+    return known
+
+
+def priority_weight(value):
+    """
+    Turn a catalogue field into a weight: numbers as they are, numeric strings parsed,
+    ISO dates as timestamps so newer entries weigh more
+    Returns None for anything else
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        try:
+            return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            return None
+    return None
+
+
+def catalogue_weights(links, field):
+    """
+    Read the weight of each link from a field of its parent object
+    A link found more than once gets its highest weight
+    Returns {url: weight}
+    """
+    weights = {}
+    if not field:
+        return weights
+    for path, url in links:
+        weight = priority_weight(path[0].get(field))
+        if weight is not None and weight > weights.get(url, float("-inf")):
+            weights[url] = weight
+    return weights
+
+
+def link_weights(manifest, priority_field=None, priority_file=None):
+    """
+    Combine the weights of the links: the catalogue field ("@position" weighs links by
+    their position, later entries first) and a sidecar file {url: weight}, which wins
+    """
+    if priority_field == "@position":
+        weights = {url: float(position) for position, url in enumerate(manifest["links"])}
+    else:
+        weights = dict(manifest.get("weights") or {})
+    if priority_file:
+        with open(priority_file, 'r') as f:
+            for url, value in json.load(f).items():
+                weight = priority_weight(value)
+                if weight is not None:
+                    weights[url] = weight
+    return weights
+
+
+def merge_known_values(progress, known):
+    """
+    Merge externally supplied intermediate values into the progress data
+    Values an earlier run found stale are skipped
+    Returns the number of links that got new values
+    """
+    updated = 0
+    for url, values in known.items():
+        stale = progress["stale"].get(url)
+        if stale:
+            values = {name: value for name, value in values.items() if stale.get(name) != value}
+            if not values:
+                continue
+        current = progress["intermediate"].setdefault(url, {})
+        if any(current.get(name) != value for name, value in values.items()):
+            current.update(values)
+            updated += 1
+    return updated
+
+
+def changed_entry_urls(manifest, previous_manifest):
+    """
+    Return the links of the entries that are new or changed since previous_manifest
+    """
+    previous_digests = {digest for _, digest in previous_manifest["entries"]}
+    changed_positions = {position for position, (_, digest) in enumerate(manifest["entries"])
+                         if digest not in previous_digests}
+    return [url for url, position in zip(manifest["links"], manifest["link_entries"])
+            if position in changed_positions]
+
+
+def patch_previous_output(output_file, input_file, data, manifest, previous_manifest, results_map,
+                          result_digests):
+    """
+    Build the new output from the previous one, reusing every entry that didn't change
+    Only entries that are new, changed or whose results differ from the ones applied to
+    the previous output are rewritten; result_digests comes from entry_result_digests
+    data is the loaded input, or None when it is unchanged and only has to be loaded
+    if an entry needs rewriting
+    Returns the new output data and the number of entries that had to be rewritten
+    """
+    previous_output = load_json_output(output_file)
+
+    previous_pairs = top_level_entries(previous_output)
+    if previous_pairs is None or len(previous_pairs) != len(previous_manifest["entries"]):
+        raise ValueError("previous output does not match the previous manifest")
+
+    # Manifests written before the applied results were recorded reuse nothing that has links
+    previous_results = previous_manifest.get("output_results") or [None] * len(previous_pairs)
+    previous_by_digest = {}
+    for (_, digest), (_, value), applied in zip(previous_manifest["entries"], previous_pairs, previous_results):
+        previous_by_digest.setdefault(digest, (value, applied))
+
+    reused = []
+    for (_, digest), applied in zip(manifest["entries"], result_digests):
+        previous = previous_by_digest.get(digest)
+        reused.append(previous[0] if previous is not None and previous[1] == applied else None)
+    if all(value is not None for value in reused):
+        return rebuild_from_entries(data if data is not None else previous_output,
+                                    [(key, value) for (key, _), value in zip(manifest["entries"], reused)]), 0
+
+    # Entries are rewritten from the input, the previous output has results in place of their links
+    if data is None:
+        with open(input_file, 'r') as f:
+            data = json.load(f)
+
+    pairs = []
+    rewritten = 0
+    for (key, _), (_, value), previous in zip(manifest["entries"], top_level_entries(data), reused):
+        if previous is not None:
+            pairs.append((key, previous))
+            continue
+        update_json_with_results(value, results_map)
+        pairs.append((key, value))
+        rewritten += 1
+
+    return rebuild_from_entries(data, pairs), rewritten
+
+
+def process_json_file(input_file, num_workers=5, incremental=False, dns_warmup_hosts=None, known_values=None,
+                      result_stream=None, max_workers=None, concurrency_step=5, flush_every=50,
+                      flush_interval=5.0, refresh=None, priority_field=None, priority_file=None,
+                      compact=False, compression=None, output_workers=1, scan=False, revalidate=None,
+                      auto_tune=None, processes=1):
+    """
+    Process the JSON file with vcloud.zip links
+    Uses parallel processing with multiple workers
+    In incremental mode only links in entries that are new or changed since the
+    previous run are resolved, and the previous output is patched instead of regenerated
+    known_values maps links to already known ids/decoded r URLs ({url: {"id": ..., "decoded_r": ...}})
+    result_stream receives an NDJSON record for each link as soon as it is resolved
+    max_workers and concurrency_step bound and size live concurrency changes (SIGUSR1/SIGUSR2)
+    flush_every and flush_interval control how often progress is saved while links resolve
+    refresh="all" resolves already processed links again, refresh="unmapped" only those whose
+    start value doesn't point at a channel message, skipping links mapped to known messages
+    priority_field and priority_file set the order links are resolved in, see link_weights
+    The output is written without whitespace when compact is set, compressed with
+    compression ("gzip"/"zstd", adding .gz/.zst to its name) and serialized by
+    output_workers processes
+    With scan, links are found by scanning the input bytes (see scan_links) and the output
+    is the input with the results spliced in, keeping its formatting; incremental mode
+    and catalogue fields aren't available then
+    revalidate, a number of seconds, revalidates the processed links not confirmed for that
+    long (0 for all of them) instead of resolving new ones, see LinkResolver.revalidate
+    auto_tune holds ConcurrencyTuner options to tune the concurrency while links resolve
+    processes > 1 resolves links in that many worker processes of num_workers threads each,
+    see process_urls_in_processes
+    """
+    # Define progress and output file names
+    base_name = os.path.splitext(input_file)[0]
+    progress_file = f"{base_name}_progress.json"
+    output_file = output_path(f"{base_name}_output.json", compression)
+    manifest_file = f"{base_name}_manifest.json"
+
+    previous_manifest = read_link_manifest(manifest_file)
+    if incremental and scan:
+        print("Incremental runs need the parsed input, running a full pass with the byte scan")
+        incremental = False
+    if incremental and not (previous_manifest and previous_manifest.get("entries") is not None
+                            and output_matches_manifest(previous_manifest, output_file)):
+        print("No output from a previous run to patch, running a full pass")
+        incremental = False
+
+    # Reuse the link list from the manifest when the input hasn't changed,
+    # so the JSON load and tree walk are deferred until the output is written
+    data = None
+    catalogue_field = priority_field if priority_field != "@position" else None
+    manifest = load_link_manifest(manifest_file, input_file, discovery_signature(catalogue_field, scan))
+    if manifest is not None:
+        print(f"Using cached link manifest {manifest_file}")
+    elif scan:
+        with profile_section("discover_links"):
+            manifest = scan_links(input_file)
+        save_link_manifest(manifest_file, manifest)
+    else:
+        with profile_section("discover_links"):
+            data, manifest = discover_links(input_file, catalogue_field)
+        # An incremental run only replaces the previous manifest together with its output,
+        # so a crash part-way through still diffs against the last completed run next time
+        if not incremental:
+            save_link_manifest(manifest_file, manifest)
+        if incremental and manifest["entries"] is None:
+            print("Input has no top-level entries to diff, running a full pass")
+            incremental = False
+
+    vcloud_urls = manifest["links"]
+    print(f"Found {len(vcloud_urls)} vcloud.zip links to process")
+
+    # Load previous progress
+    progress = load_progress(progress_file)
+
+    # Ids and decoded r URLs from the catalogue or a sidecar file let links skip phase 1
+    known_updates = merge_known_values(progress, manifest.get("known") or {})
+    if known_values:
+        known_updates += merge_known_values(progress, known_values)
+    # The message each processed link points at is stored as results arrive, only progress
+    # written before that was stored needs decoding, once
+    decoded = update_message_keys(progress["processed"], progress["messages"])
+    if known_updates:
+        print(f"Known ids/decoded URLs supplied for {known_updates} links")
+    if known_updates or decoded:
+        save_progress(progress_file, progress)
+
+    # Determine which links still need processing
+    if incremental:
+        # Links that failed before are retried even when their entry didn't change
+        candidate_urls = list(dict.fromkeys(
+            changed_entry_urls(manifest, previous_manifest)
+            + [url for url in vcloud_urls if url not in progress["processed"]]))
+    else:
+        candidate_urls = vcloud_urls
+    if revalidate is not None:
+        validated = progress["validated"]
+        now = time.time()
+        unprocessed_urls = [url for url in dict.fromkeys(candidate_urls)
+                            if url in progress["processed"] and now - validated.get(url, 0) >= revalidate]
+    elif refresh == "all":
+        unprocessed_urls = list(candidate_urls)
+    elif refresh == "unmapped":
+        unprocessed_urls = [url for url in candidate_urls if progress["messages"].get(url) is None]
+    else:
+        unprocessed_urls = [url for url in candidate_urls if url not in progress["processed"]]
+    if revalidate is not None:
+        print(f"Links to revalidate: {len(unprocessed_urls)}")
+    else:
+        print(f"Unprocessed links: {len(unprocessed_urls)}")
+
+    weights = link_weights(manifest, priority_field, priority_file)
+    if weights:
+        weighted = sum(1 for url in unprocessed_urls if url in weights)
+        print(f"Prioritising {weighted} weighted links, {len(unprocessed_urls) - weighted} without a weight go last")
+
+    # Calculate statistics
+    total_links = len(vcloud_urls)
+    processed_count = len(progress["processed"]) - sum(1 for url in unprocessed_urls if url in progress["processed"])
+
+    if unprocessed_urls:
+        stored_starts = {}
+        if revalidate is not None:
+            stored_starts = {url: progress["processed"][url] for url in unprocessed_urls}
+        run_started = time.time()
+        if processes > 1:
+            finished = process_urls_in_processes(unprocessed_urls, progress, progress_file, num_workers, processes,
+                                                 processed_count, total_links, dns_warmup_hosts, result_stream,
+                                                 flush_every, flush_interval, weights, revalidate is not None)
+        else:
+            finished = process_unprocessed_urls(unprocessed_urls, progress, progress_file, num_workers,
+                                                processed_count, total_links, dns_warmup_hosts, result_stream,
+                                                max_workers, concurrency_step, flush_every, flush_interval,
+                                                weights, revalidate is not None, auto_tune)
+        if stored_starts:
+            confirmed = sum(1 for url in stored_starts if progress["validated"].get(url, 0) >= run_started)
+            drifted = sum(1 for url, start in stored_starts.items() if progress["processed"][url] != start)
+            print(f"Revalidated {confirmed} of {len(stored_starts)} links: {confirmed - drifted} unchanged, "
+                  f"{drifted} drifted and re-resolved, {len(stored_starts) - confirmed} couldn't be checked")
+        stats = hedge_stats()
+        if stats["hedged"]:
+            print(f"Hedged {stats['hedged']} of {stats['requests']} requests, "
+                  f"{stats['hedge_wins']} answered first")
+        stats = redirect_memo_stats()
+        if stats["hits"] or stats["stored"]:
+            lookups = stats["hits"] + stats["misses"]
+            print(f"Redirect memo: {stats['hits']} hits / {lookups} lookups "
+                  f"({100.0 * stats['hits'] / max(1, lookups):.1f}%), {stats['stored']} hops stored")
+        stats = dns_stats()
+        if stats["hits"] or stats["misses"]:
+            print(f"DNS cache: {stats['hits']} hits, {stats['misses']} lookups")
+        for stats in egress_stats():
+            print(f"Egress {stats['name']}: {stats['links']} links, {stats['errors']} errors, "
+                  f"{stats['captchas']} captchas, health {stats['health']:.2f}")
+
+        if not finished:
+            print(f"Stopped before all links were processed. Progress saved to {progress_file}, "
+                  f"run again to resume")
+            return
+
+    results_map = progress["processed"]
+    if incremental:
+        # Compared against the results applied to the previous output rather than this run's,
+        # so results from a run stopped before writing its output aren't lost
+        result_digests = entry_result_digests(manifest, results_map)
+        if data is None and result_digests == previous_manifest.get("output_results"):
+            print(f"\nNothing changed. Output {output_file} is up to date")
+            return
+        with profile_section("finalize_walk"):
+            data, rewritten = profiled(patch_previous_output)(output_file, input_file, data, manifest,
+                                                              previous_manifest, results_map, result_digests)
+        print(f"Patched {rewritten} of {len(manifest['entries'])} entries of the previous output")
+    elif not scan:
+        # The input is only needed now that the results are written back into it
+        if data is None:
+            with open(input_file, 'r') as f, profile_section("finalize_load"):
+                data = json.load(f)
+
+        # Update the original data with successful results in a single walk
+        with profile_section("finalize_walk"):
+            profiled(update_json_with_results)(data, results_map)
 
     # Save the updated JSON data
-    with open(output_file, 'w') as f:
-        json.dump(data, f, indent=2)
+    with profile_section("finalize_write"):
+        if scan and not manifest_matches_input(manifest, input_file):
+            # The byte ranges only hold for the input that was scanned
+            print(f"{input_file} changed since it was scanned, scanning it again")
+            manifest = scan_links(input_file)
+            save_link_manifest(manifest_file, manifest)
+        if scan:
+            # The input bytes with the results spliced in, the input is never parsed
+            profiled(atomic_write_bytes)(output_file, splice_values(input_file, manifest["links"],
+                                                                    manifest["offsets"], results_map), compression)
+        else:
+            profiled(write_json_output)(output_file, data, None if compact else 2, compression, output_workers)
+    record_output_in_manifest(manifest_file, manifest, output_file, results_map)
 
     print(f"\nProcessing complete. Output saved to {output_file}")
     print(f"Progress saved to {progress_file}")
     print(f"Successfully processed: {len(progress['processed'])} links")
+    mapped = [key for key in progress["messages"].values() if key is not None]
+    print(f"Start index: {len(mapped)} links across {len({key[0] for key in mapped})} channels, "
+          f"{len(progress['messages']) - len(mapped)} not pointing at a channel message")
 
 
-def main():
-    input_file = "rogd.json"
-    num_workers = 50  # You can adjust this number as needed
+def parse_key_value(item):
+    """
+    Split a KEY=VALUE command line argument
+    """
+    key, sep, value = item.partition("=")
+    if not sep:
+        raise ValueError(f"Expected KEY=VALUE, got {item!r}")
+    return key, value
 
-    if not os.path.exists(input_file):
-        print(f"Input file does not exist: {input_file}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert vcloud.zip links in a JSON file to start parameters")
+    parser.add_argument("input_file", nargs="?", default="rogd.json", help="JSON file to process (default: rogd.json)")
+    parser.add_argument("-w", "--workers", type=int, default=50, help="number of parallel workers (default: 50)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only resolve links in entries changed since the last run and patch the previous output")
+    parser.add_argument("--stage-timeout", action="append", default=[], metavar="STAGE=SECONDS",
+                        help="total timeout for one stage (vcloud_api, vcloud_page, hubcloud_go, redirect_hop) "
+                             "including its redirects and body, default 5, can be repeated")
+    parser.add_argument("--hedge", action="store_true",
+                        help="send a duplicate request when a hop is slower than its p95 latency")
+    parser.add_argument("--hedge-budget", type=float, default=0.05,
+                        help="fraction of requests that may be hedged (default: 0.05)")
+    parser.add_argument("--redirect-memo", action="store_true",
+                        help="remember redirect hops so chains sharing a prefix skip them")
+    parser.add_argument("--redirect-memo-ttl", type=float, default=300.0,
+                        help="seconds a remembered redirect hop stays valid (default: 300)")
+    parser.add_argument("--dns-ttl", type=float, default=300.0,
+                        help="seconds resolved addresses are reused, 0 disables the DNS cache (default: 300)")
+    parser.add_argument("--dns-warmup", action="append", default=[], metavar="HOST",
+                        help="extra host to resolve before the first request, can be repeated")
+    parser.add_argument("--no-dns-warmup", action="store_true",
+                        help="don't pre-resolve the known hosts at startup")
+    parser.add_argument("--host-limit", action="append", default=[], metavar="HOST=N",
+                        help="maximum concurrent requests to a host, can be repeated")
+    parser.add_argument("--resolver-plugin", action="append", default=[], metavar="MODULE",
+                        help="import a module that registers extra link resolvers, can be repeated")
+    parser.add_argument("--known-ids", metavar="FILE",
+                        help="JSON file mapping links to known {\"id\": ..., \"decoded_r\": ...} values, "
+                             "links with one skip the stages that produce it")
+    parser.add_argument("--stream", metavar="PATH",
+                        help="write an NDJSON record per resolved link to PATH (a file or FIFO, - for stdout)")
+    parser.add_argument("--max-workers", type=int,
+                        help="upper bound for live concurrency changes (default: 4x --workers)")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="resolve links in this many worker processes of --workers threads each, sharing "
+                             "results through shared memory; host and proxy limits apply per process (default: 1)")
+    parser.add_argument("--auto-tune", action="store_true",
+                        help="tune the concurrency automatically between --min-workers and --max-workers, "
+                             "starting from --workers and moving by --concurrency-step")
+    parser.add_argument("--min-workers", type=int, default=1,
+                        help="lowest concurrency the auto-tuner goes down to (default: 1)")
+    parser.add_argument("--tune-window", type=float, default=30.0,
+                        help="seconds of results the auto-tuner measures before each change (default: 30)")
+    parser.add_argument("--tune-max-errors", type=float, default=0.2,
+                        help="error/captcha rate above which the auto-tuner backs off (default: 0.2)")
+    parser.add_argument("--concurrency-step", type=int, default=5,
+                        help="workers added/removed by SIGUSR1/SIGUSR2 (default: 5)")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="append per-link hop traces to FILE as NDJSON (.gz to compress)")
+    parser.add_argument("--trace-sample", type=float, default=0.01,
+                        help="fraction of successful, fast links whose trace is kept (default: 0.01)")
+    parser.add_argument("--trace-slow", type=float, default=30.0,
+                        help="always keep traces of links taking longer than this many seconds (default: 30)")
+    parser.add_argument("--profile", nargs="?", const="sample", choices=["sample", "cprofile"],
+                        help="profile the run: sample (default, flamegraph-compatible folded stacks) "
+                             "or cprofile (deterministic, .pstats)")
+    parser.add_argument("--profile-out", metavar="PREFIX",
+                        help="prefix of the profile files (default: <input>_profile)")
+    parser.add_argument("--flush-every", type=int, default=50,
+                        help="save progress after this many results (default: 50)")
+    parser.add_argument("--flush-interval", type=float, default=5.0,
+                        help="save progress at least this often in seconds while results arrive (default: 5)")
+    parser.add_argument("--accept-encoding", action="append", default=[], metavar="STAGE=ENCODINGS",
+                        help="Accept-Encoding for one stage: auto (what can be decoded here), identity, "
+                             "or an explicit list; can be repeated")
+    parser.add_argument("--refresh", choices=["all", "unmapped"],
+                        help="resolve already processed links again: all of them, or only those whose "
+                             "start value doesn't point at a channel message")
+    parser.add_argument("--revalidate", nargs="?", type=float, const=0.0, metavar="SECONDS",
+                        help="instead of resolving new links, check processed links not confirmed for SECONDS "
+                             "(default: all) by re-fetching only their first stored intermediate value, "
+                             "and fully re-resolve those that drifted")
+    parser.add_argument("--priority-field", metavar="FIELD",
+                        help="resolve links with a higher value of this field of their parent object first "
+                             "(numbers or ISO dates); @position favours entries later in the catalogue")
+    parser.add_argument("--priority-file", metavar="FILE",
+                        help="JSON file of {url: weight}, overriding --priority-field for the links it lists")
+    parser.add_argument("--proxy", action="append", default=[], metavar="URL",
+                        help="egress proxy (http://, https:// or socks5:// with httpx[socks]); can be repeated, "
+                             "'direct' adds the machine's own address to the pool")
+    parser.add_argument("--proxy-file", metavar="FILE", help="file with one egress proxy per line")
+    parser.add_argument("--proxy-limit", type=int, default=10,
+                        help="maximum requests in flight through each egress (default: 10)")
+    parser.add_argument("--proxy-cooldown", type=float, default=60.0,
+                        help="seconds an egress failing on errors or captchas is rested (default: 60)")
+    parser.add_argument("--record", metavar="ARCHIVE",
+                        help="record every request/response and link outcome to ARCHIVE (gzipped NDJSON) "
+                             "for offline replay with benchmark_vcloud_links.py replay")
+    parser.add_argument("--compact", action="store_true",
+                        help="write the output without indentation or whitespace")
+    parser.add_argument("--compress", choices=["gzip", "zstd"],
+                        help="compress the output, adding .gz/.zst to its name (zstd needs the zstandard package)")
+    parser.add_argument("--output-workers", type=int, default=1,
+                        help="processes serializing the output in parallel (default: 1, serialized "
+                             "in this process)")
+    parser.add_argument("--scan", action="store_true",
+                        help="find links by scanning the input bytes instead of loading it, and write the "
+                             "output by splicing the results into a copy of the input (keeps its formatting, "
+                             "ignores --compact; no --incremental or catalogue fields)")
+    parser.add_argument("--export", metavar="FILE",
+                        help="after processing, write the decoded start values of all processed links "
+                             "to FILE (.csv, .tsv or column-oriented .json)")
+    args = parser.parse_args()
+
+    # Before --host-limit is applied, so limits given on the command line win over the
+    # ones plugin resolvers register
+    load_resolver_plugins(args.resolver_plugin)
+    try:
+        configure_timeouts(dict(parse_key_value(item) for item in args.stage_timeout))
+        configure_host_limits({host: int(limit) for host, limit in map(parse_key_value, args.host_limit)})
+        configure_accept_encoding(dict(parse_key_value(item) for item in args.accept_encoding))
+        check_compression(args.compress)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.processes > 1:
+        import multiprocessing
+        if "fork" not in multiprocessing.get_all_start_methods():
+            parser.error("--processes needs the fork start method, not available on this platform")
+        for flag, value in (("--record", args.record), ("--trace", args.trace), ("--auto-tune", args.auto_tune),
+                            ("--profile", args.profile)):
+            if value:
+                parser.error(f"{flag} only works with a single process")
+    if args.revalidate is not None and args.refresh:
+        parser.error("--revalidate and --refresh are alternatives, pick one")
+    if args.scan and args.priority_field not in (None, "@position"):
+        parser.error("--scan doesn't read catalogue fields, use --priority-file or --priority-field @position")
+    proxies = list(args.proxy)
+    if args.proxy_file:
+        with open(args.proxy_file, 'r') as f:
+            proxies += [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    if proxies:
+        try:
+            configure_proxies(proxies, args.proxy_limit, cooldown=args.proxy_cooldown)
+        except ValueError as e:
+            parser.error(str(e))
+        if args.workers < egress_capacity():
+            print(f"Note: {args.workers} workers can't use all {egress_capacity()} request slots "
+                  f"of the {len(proxies)} egresses, raise --workers to scale with the pool")
+    configure_hedging(args.hedge, args.hedge_budget)
+    configure_redirect_memo(args.redirect_memo, args.redirect_memo_ttl)
+    configure_dns_cache(args.dns_ttl)
+    dns_warmup_hosts = None
+    if args.dns_ttl > 0 and not args.no_dns_warmup:
+        dns_warmup_hosts = KNOWN_HOSTS + args.dns_warmup
+
+    if not os.path.exists(args.input_file):
+        print(f"Input file does not exist: {args.input_file}")
         sys.exit(1)
 
     # Using multiple workers for parallel processing
-    process_json_file(input_file, num_workers)
+    known_values = None
+    if args.known_ids:
+        with open(args.known_ids, 'r') as f:
+            known_values = json.load(f)
+
+    result_stream = open_result_stream(args.stream) if args.stream else None
+    if args.trace:
+        configure_tracing(args.trace, args.trace_sample, args.trace_slow)
+    if args.record:
+        start_recording(args.record)
+    if args.profile:
+        start_profiling(args.profile, args.profile_out or f"{os.path.splitext(args.input_file)[0]}_profile")
+
+    try:
+        process_json_file(args.input_file, args.workers, incremental=args.incremental,
+                          dns_warmup_hosts=dns_warmup_hosts, known_values=known_values,
+                          result_stream=result_stream, max_workers=args.max_workers,
+                          concurrency_step=args.concurrency_step, flush_every=args.flush_every,
+                          flush_interval=args.flush_interval, refresh=args.refresh,
+                          priority_field=args.priority_field, priority_file=args.priority_file,
+                          compact=args.compact, compression=args.compress, output_workers=args.output_workers,
+                          scan=args.scan, revalidate=args.revalidate,
+                          auto_tune=dict(minimum=args.min_workers, window=args.tune_window,
+                                         max_error_rate=args.tune_max_errors) if args.auto_tune else None,
+                          processes=args.processes)
+    finally:
+        if result_stream is not None:
+            close_result_stream(result_stream, args.stream)
+    if args.export and not shutdown_event.is_set():
+        progress = load_progress(f"{os.path.splitext(args.input_file)[0]}_progress.json")
+        with profile_section("export"):
+            rows, failed = export_progress(progress, args.export)
+        print(f"Exported {rows} links to {args.export}" + (f", {failed} start values didn't decode" if failed else ""))
+    close_tracing()
+    if args.record:
+        print(f"Recorded {stop_recording()} exchanges to {args.record}")
+    stop_profiling()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
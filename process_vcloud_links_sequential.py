@@ -6,6 +6,7 @@ Features:
 - Sequential processing to avoid rate limiting
 - Error handling for failed links
 - Minimal output showing progress
+- Crash-safe progress and output writes with fallback to the last good snapshot
 - Uses fresh HTTP clients like the working individual resolver
 """
 
@@ -21,6 +22,8 @@ from concurrent.futures import ThreadPoolExecutor, as_completed
 import logging
 from datetime import datetime, timedelta
 
+from vcloud_store import atomic_write_json, load_json_with_fallback
+
 # Set up logging to only show warnings and errors
 logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -368,21 +371,16 @@ def load_progress(progress_file):
     """
     Load progress from a file
     """
-    if os.path.exists(progress_file):
-        # Check if file is empty
-        if os.path.getsize(progress_file) == 0:
-            return {"processed": {}}
-        with open(progress_file, 'r') as f:
-            return json.load(f)
-    return {"processed": {}}
+    # A truncated or corrupt file falls back to the last good snapshot instead of resetting
+    return load_json_with_fallback(progress_file, default={"processed": {}})
 
 
 def save_progress(progress_file, progress_data):
     """
     Save progress to a file
     """
-    with open(progress_file, 'w') as f:
-        json.dump(progress_data, f, indent=2)
+    # Written to a temp file and renamed into place so a crash never truncates it
+    atomic_write_json(progress_file, progress_data, indent=2)
 
 
 def process_json_file(input_file, num_workers=1):
@@ -474,8 +472,7 @@ def process_json_file(input_file, num_workers=1):
         replace_url_recursive(data)
 
     # Save the updated JSON data
-    with open(output_file, 'w') as f:
-        json.dump(data, f, indent=2)
+    atomic_write_json(output_file, data, indent=2, keep_backup=False)
 
     print(f"\nProcessing complete. Output saved to {output_file}")
     print(f"Progress saved to {progress_file}")
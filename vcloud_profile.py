@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Profiling support for the vcloud.zip link processing scripts.
+Features:
+- Sections (resolution stages, progress saving, finalize steps) timed per thread,
+  both wall clock and CPU time, so time can be attributed to a stage
+- Sampling profiler writing flamegraph-compatible folded stacks
+  (flamegraph.pl / speedscope / inferno), with the section as a stack frame
+- Deterministic mode running each worker call under cProfile
+- Costs nothing beyond a flag check while profiling is off
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+
+_mode = None
+_output_prefix = None
+_lock = threading.Lock()
+
+# Thread ident -> stack of section names the thread is in
+_thread_sections = {}
+# (section, thread name) -> [calls, wall seconds, cpu seconds]
+_section_totals = {}
+
+_sampler = None
+_profiles = []
+_thread_profile = threading.local()
+
+
+def start_profiling(mode, output_prefix, interval=0.005):
+    """
+    Start profiling, mode is "sample" or "cprofile"
+    Results are written to files starting with output_prefix by stop_profiling
+    """
+    global _mode, _output_prefix, _sampler
+    if mode not in ("sample", "cprofile"):
+        raise ValueError(f"Unknown profile mode {mode!r}, expected sample or cprofile")
+    _mode = mode
+    _output_prefix = output_prefix
+    if mode == "sample":
+        _sampler = SamplingProfiler(interval)
+        _sampler.start()
+
+
+@contextmanager
+def profile_section(name):
+    """
+    Attribute the time spent inside the block to the named section
+    """
+    if _mode is None:
+        yield
+        return
+
+    ident = threading.get_ident()
+    with _lock:
+        _thread_sections.setdefault(ident, []).append(name)
+    wall_started = time.perf_counter()
+    cpu_started = time.thread_time()
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - wall_started
+        cpu = time.thread_time() - cpu_started
+        key = (name, threading.current_thread().name)
+        with _lock:
+            _thread_sections[ident].pop()
+            totals = _section_totals.setdefault(key, [0, 0.0, 0.0])
+            totals[0] += 1
+            totals[1] += wall
+            totals[2] += cpu
+
+
+def profiled(func):
+    """
+    Wrap a worker function so each call runs under the thread's cProfile profiler
+    Returns func unchanged unless profiling in cprofile mode
+    """
+    if _mode != "cprofile":
+        return func
+
+    import cProfile
+
+    def wrapper(*args, **kwargs):
+        profile = getattr(_thread_profile, "profile", None)
+        if profile is None:
+            profile = _thread_profile.profile = cProfile.Profile()
+            with _lock:
+                _profiles.append(profile)
+        profile.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.disable()
+
+    return wrapper
+
+
+class SamplingProfiler(threading.Thread):
+    """
+    Samples the stacks of all other threads at a fixed interval
+    """
+
+    def __init__(self, interval):
+        super().__init__(name="profiler", daemon=True)
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        own = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            with _lock:
+                sections = {ident: stack[-1] for ident, stack in _thread_sections.items() if stack}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                frames.reverse()
+                thread_name = names.get(ident, f"thread-{ident}")
+                section = sections.get(ident, "-")
+                self.stacks[";".join([thread_name, section] + frames)] += 1
+            self.samples += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def stop_profiling():
+    """
+    Stop profiling, write the profile files and print a summary table
+    """
+    global _mode, _sampler
+    if _mode is None:
+        return
+
+    written = []
+    if _sampler is not None:
+        _sampler.stop()
+        folded_file = f"{_output_prefix}.folded"
+        with open(folded_file, 'w') as f:
+            for stack, count in sorted(_sampler.stacks.items()):
+                f.write(f"{stack} {count}\n")
+        written.append(folded_file)
+        _print_top_functions(_sampler.stacks)
+
+    if _profiles:
+        import pstats
+
+        stats_file = f"{_output_prefix}.pstats"
+        stats = pstats.Stats(*_profiles)
+        stats.dump_stats(stats_file)
+        written.append(stats_file)
+        print("\nTop functions by cumulative time (all worker threads):")
+        stats.sort_stats("cumulative").print_stats(15)
+
+    _print_section_table()
+    for path in written:
+        print(f"Profile written to {path}")
+    _mode = None
+    _sampler = None
+
+
+def _print_top_functions(stacks, limit=15):
+    """
+    Print the functions most often at the top of a sampled stack
+    """
+    own = Counter()
+    total = 0
+    for stack, count in stacks.items():
+        own[stack.rsplit(";", 1)[-1]] += count
+        total += count
+    if not total:
+        return
+    print("\nTop functions by samples (self time, all threads):")
+    for name, count in own.most_common(limit):
+        print(f"{100.0 * count / total:6.1f}%  {count:8d}  {name}")
+
+
+def _print_section_table():
+    """
+    Print wall and CPU time per section, overall and per thread
+    """
+    with _lock:
+        totals = dict(_section_totals)
+    if not totals:
+        return
+
+    per_section = {}
+    for (section, _), (calls, wall, cpu) in totals.items():
+        row = per_section.setdefault(section, [0, 0.0, 0.0, 0])
+        row[0] += calls
+        row[1] += wall
+        row[2] += cpu
+        row[3] += 1
+
+    print(f"\n{'Section':<20} {'Calls':>8} {'Wall s':>10} {'CPU s':>10} {'CPU %':>6} {'Threads':>8}")
+    for section, (calls, wall, cpu, threads) in sorted(per_section.items(), key=lambda item: -item[1][2]):
+        share = 100.0 * cpu / wall if wall else 0.0
+        print(f"{section:<20} {calls:>8} {wall:>10.3f} {cpu:>10.3f} {share:>5.1f}% {threads:>8}")
+
+    print(f"\n{'Thread':<28} {'Section':<20} {'Calls':>8} {'Wall s':>10} {'CPU s':>10}")
+    for (section, thread_name), (calls, wall, cpu) in sorted(totals.items(), key=lambda item: -item[1][2])[:20]:
+        print(f"{thread_name:<28} {section:<20} {calls:>8} {wall:>10.3f} {cpu:>10.3f}")
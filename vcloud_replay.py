@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Record and replay of the HTTP traffic of the vcloud.zip link processing scripts.
+Features:
+- Record mode capturing every request/response pair of a real run, plus each link's
+  outcome, into a compact archive (gzipped NDJSON, identical bodies stored once)
+- Replay transport serving the recorded responses, as fast as possible or at a
+  multiple of the recorded speed, so extraction can be regression-tested and the
+  engine benchmarked offline and repeatably
+- Responses are stored as received (still compressed), so replay exercises the same
+  decoding path as a live run
+"""
+
+import json
+import gzip
+import time
+import base64
+import hashlib
+import threading
+
+
+ARCHIVE_VERSION = 1
+
+_recorder = None
+
+
+class Recorder:
+    """
+    Appends exchanges and link outcomes to an archive, safe to share between threads
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = gzip.open(path, 'wt', encoding='utf-8')
+        self.bodies = set()
+        self.exchanges = 0
+        self._write({"version": ARCHIVE_VERSION, "recorded": time.time()})
+
+    def _write(self, entry):
+        self.file.write(json.dumps(entry, separators=(',', ':')) + "\n")
+
+    def exchange(self, request, status, headers, body, seconds):
+        digest = hashlib.sha1(body).hexdigest()
+        with self.lock:
+            if digest not in self.bodies:
+                self.bodies.add(digest)
+                self._write({"body": digest, "data": base64.b64encode(body).decode('ascii')})
+            self._write({
+                "method": request.method,
+                "url": str(request.url),
+                "status": status,
+                "headers": headers,
+                "body_ref": digest,
+                "seconds": round(seconds, 4),
+            })
+            self.exchanges += 1
+
+    def link(self, url, start, error):
+        with self.lock:
+            self._write({"link": url, "start": start, "error": error})
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def _recording_transport(inner, recorder):
+    import httpx
+
+    class RecordingTransport(httpx.BaseTransport):
+        """
+        Passes requests to inner and records what comes back
+        """
+
+        def handle_request(self, request):
+            started = time.monotonic()
+            response = inner.handle_request(request)
+            try:
+                # Raw bytes as received, Content-Encoding still applies to them
+                body = b"".join(response.stream)
+            finally:
+                response.close()
+            seconds = time.monotonic() - started
+            headers = [[name, value] for name, value in response.headers.multi_items()]
+            recorder.exchange(request, response.status_code, headers, body, seconds)
+            return httpx.Response(response.status_code, headers=headers, content=body,
+                                  extensions=response.extensions, request=request)
+
+        def close(self):
+            inner.close()
+
+    return RecordingTransport()
+
+
+def start_recording(path, transport_factory=None):
+    """
+    Record every request made through new_client to the archive at path
+    transport_factory(proxy=...) builds the transport really sending them, the default one if None
+    """
+    global _recorder
+    import httpx
+    from vcloud_transport import set_transport_factory, default_transport
+
+    if transport_factory is None:
+        transport_factory = lambda proxy=None: default_transport(proxy) or httpx.HTTPTransport()
+    _recorder = Recorder(path)
+    recorder = _recorder
+    set_transport_factory(lambda proxy=None: _recording_transport(transport_factory(proxy=proxy), recorder))
+
+
+def record_link_result(url, start, error):
+    """
+    Store a link's outcome in the archive being recorded, if any, for replays to compare against
+    """
+    if _recorder is not None:
+        _recorder.link(url, start, error)
+
+
+def stop_recording():
+    """
+    Finish the archive being recorded, returns the number of exchanges in it
+    """
+    global _recorder
+    if _recorder is None:
+        return 0
+    from vcloud_transport import set_transport_factory
+
+    set_transport_factory(None)
+    _recorder.close()
+    exchanges = _recorder.exchanges
+    _recorder = None
+    return exchanges
+
+
+class Archive:
+    """
+    Recorded exchanges by (method, URL), plus the recorded link outcomes
+    A URL requested several times is answered with its recordings in order,
+    the last one repeating once they run out
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.exchanges = {}
+        self.links = {}
+        bodies = {}
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            header = json.loads(f.readline() or "{}")
+            if header.get("version") != ARCHIVE_VERSION:
+                raise ValueError(f"{path} is not a version {ARCHIVE_VERSION} traffic archive")
+            try:
+                for line in f:
+                    entry = json.loads(line)
+                    if "body" in entry:
+                        bodies[entry["body"]] = base64.b64decode(entry["data"])
+                    elif "link" in entry:
+                        self.links[entry["link"]] = {"start": entry["start"], "error": entry["error"]}
+                    else:
+                        entry["body"] = bodies[entry.pop("body_ref")]
+                        self.exchanges.setdefault((entry["method"], entry["url"]), []).append(entry)
+            except (EOFError, ValueError):
+                # A run that was killed leaves the archive truncated, everything before that is fine
+                print(f"Warning: {path} is truncated, replaying what was recorded before the cut")
+        self.lock = threading.Lock()
+        self.served = {}
+        self.misses = 0
+
+    def next_exchange(self, method, url):
+        key = (method, url)
+        with self.lock:
+            recorded = self.exchanges.get(key)
+            if not recorded:
+                self.misses += 1
+                return None
+            count = self.served.get(key, 0)
+            self.served[key] = count + 1
+            return recorded[min(count, len(recorded) - 1)]
+
+
+def replay_transport(archive, speed=0.0):
+    """
+    Build an httpx transport answering from the archive
+    speed 0 answers immediately, 1 takes as long as the recording, 2 half as long...
+    Requests that weren't recorded fail with a ConnectError
+    """
+    import httpx
+
+    class ReplayTransport(httpx.BaseTransport):
+        def handle_request(self, request):
+            exchange = archive.next_exchange(request.method, str(request.url))
+            if exchange is None:
+                raise httpx.ConnectError(f"No recorded response for {request.method} {request.url}",
+                                         request=request)
+            if speed > 0:
+                time.sleep(exchange["seconds"] / speed)
+            return httpx.Response(exchange["status"], headers=exchange["headers"], content=exchange["body"],
+                                  request=request)
+
+    return ReplayTransport()
+
+
+def start_replay(path, speed=0.0):
+    """
+    Answer every request made through new_client from the archive at path
+    Returns the loaded Archive
+    """
+    from vcloud_transport import set_transport_factory
+
+    archive = Archive(path)
+    set_transport_factory(lambda proxy=None: replay_transport(archive, speed))
+    return archive
+
+
+def compare_with_recording(archive, records):
+    """
+    Compare link outcomes of a replay with the recorded ones
+    Returns the list of (url, recorded start, replayed start) that differ
+    """
+    differences = []
+    for record in records:
+        recorded = archive.links.get(record["url"])
+        if recorded is not None and recorded["start"] != record["start"]:
+            differences.append((record["url"], recorded["start"], record["start"]))
+    return differences
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Byte-level scanning of the input catalogue, for link discovery without json.load.
+Features:
+- Memory-maps the input and finds the string values of "url" fields with one regex
+  pass over the raw bytes, no Python objects are built for the rest of the document
+- Records the byte range of every value found, so the output can be produced by
+  splicing the resolved values into the input bytes instead of loading, updating and
+  serializing the whole tree again
+- Only depends on the standard library
+"""
+
+import re
+import json
+import mmap
+
+
+# A "url" key with a string value; the literal is matched unrolled, a run of plain bytes
+# at a time, and the pattern starts with a fixed string so the regex engine skips ahead
+# to candidates at memchr speed
+_URL_FIELD_RE = re.compile(rb'"url"\s*:\s*("[^"\\]*(?:\\.[^"\\]*)*")')
+
+# How far back to look for the { or , before a key, past the whitespace between them
+_KEY_LOOKBEHIND = 256
+
+# Bytes copied from the input at once while splicing
+SPLICE_COPY_SIZE = 1024 * 1024
+
+
+def _open_map(f):
+    """
+    Read-only map of an open file, None for an empty one (which mmap refuses)
+    """
+    if f.seek(0, 2) == 0:
+        return None
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _decode_literal(literal):
+    """
+    Python string of a JSON string literal given as bytes, quotes included
+    """
+    if b"\\" not in literal:
+        return literal[1:-1].decode('utf-8')
+    return json.loads(literal)
+
+
+def _starts_key(mapped, position):
+    """
+    Check that a string at position is an object key, preceded by { or ,
+    The same text inside a string value has its quotes escaped, so it never is
+    """
+    before = mapped[max(0, position - _KEY_LOOKBEHIND):position].rstrip()
+    return before[-1:] in (b"{", b",")
+
+
+def scan_url_fields(path, accept=None):
+    """
+    Find the string values of "url" fields in the JSON file at path
+    accept(url) selects the values to keep, all of them when None
+    Returns (urls, offsets) in document order, offsets holding the [start, end) byte
+    range of each value's literal, quotes included
+    """
+    urls = []
+    offsets = []
+    with open(path, 'rb') as f:
+        mapped = _open_map(f)
+        if mapped is None:
+            return urls, offsets
+        try:
+            for match in _URL_FIELD_RE.finditer(mapped):
+                if not _starts_key(mapped, match.start()):
+                    continue
+                url = _decode_literal(match.group(1))
+                if accept is None or accept(url):
+                    urls.append(url)
+                    offsets.append([match.start(1), match.end(1)])
+        finally:
+            mapped.close()
+    return urls, offsets
+
+
+def splice_values(path, urls, offsets, replacements):
+    """
+    Yield the bytes of the JSON file at path with the value at each offset replaced
+    by replacements[url], as a JSON string, values without a replacement stay as they are
+    urls and offsets are what scan_url_fields returned for the same file contents
+    """
+    with open(path, 'rb') as f:
+        mapped = _open_map(f)
+        if mapped is None:
+            return
+        try:
+            position = 0
+            for url, (start, end) in zip(urls, offsets):
+                if url not in replacements:
+                    continue
+                while position < start:
+                    chunk_end = min(start, position + SPLICE_COPY_SIZE)
+                    yield mapped[position:chunk_end]
+                    position = chunk_end
+                yield json.dumps(replacements[url]).encode('utf-8')
+                position = end
+            while position < len(mapped):
+                chunk_end = min(len(mapped), position + SPLICE_COPY_SIZE)
+                yield mapped[position:chunk_end]
+                position = chunk_end
+        finally:
+            mapped.close()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Result table in shared memory for resolving links in several processes at once.
+Features:
+- One fixed-width slot per link, addressed by the link's position in the run's link
+  list, so no process needs a map of its own to find a link's result
+- Start values and the rest of each record (error, timings, intermediate values) live
+  in a heap in the same segment, addressed by offset from the slot, written once
+- Links are handed out by a shared counter, workers of every process claim the next
+  one themselves, so no queue or pipe carries work or results between processes
+- Finished links are appended to a completion log, the parent reads the new entries
+  and their slots directly to save progress, nothing is pickled
+- Only depends on the standard library
+"""
+
+import json
+import struct
+from multiprocessing import shared_memory
+
+
+# Header: magic, slot count, stop flag, next link to claim, bytes of the heap in use,
+# entries in the completion log
+_HEADER = struct.Struct("<4sIIQQI")
+_HEADER_SIZE = 32
+_MAGIC = b"VCRT"
+
+# Slot: state, then offset and length in the heap of the start value and of the record's
+# other fields as JSON
+_SLOT = struct.Struct("<B7xQIQI")
+
+# Completion log entry: index of a finished link, in the order they finished
+_LOG_ENTRY = struct.Struct("<I")
+
+EMPTY = 0
+DONE = 1
+FAILED = 2
+
+# Heap reserved per link; a start value is ~60 bytes, errors and timings make up the rest.
+# Pages are only backed by memory once written to
+HEAP_BYTES_PER_LINK = 2048
+
+
+class SharedResultTable:
+    """
+    Slots, completion log and heap in one shared memory segment
+    Writes (claims and results) happen under lock, a multiprocessing lock shared by every
+    process using the table; a slot and the data it points at never change once its link
+    is in the log, so they are read without it
+    Worker processes are forked after the table is created and use the inherited object
+    (attaching by name would register the segment with their resource tracker, which
+    unlinks it when they exit)
+    """
+
+    def __init__(self, memory, lock, owner=False):
+        self.memory = memory
+        self.lock = lock
+        self.owner = owner
+        self.buffer = memory.buf
+        _, self.count, _, _, _, _ = _HEADER.unpack_from(self.buffer, 0)
+        self.log_start = _HEADER_SIZE + self.count * _SLOT.size
+        self.heap_start = self.log_start + self.count * _LOG_ENTRY.size
+        self.heap_size = memory.size - self.heap_start
+
+    @classmethod
+    def create(cls, count, lock, heap_bytes_per_link=HEAP_BYTES_PER_LINK):
+        """
+        Create a table for count links
+        """
+        size = _HEADER_SIZE + count * (_SLOT.size + _LOG_ENTRY.size) + max(1, count) * heap_bytes_per_link
+        memory = shared_memory.SharedMemory(create=True, size=size)
+        # A new segment is zero-filled, every slot starts EMPTY
+        _HEADER.pack_into(memory.buf, 0, _MAGIC, count, 0, 0, 0, 0)
+        return cls(memory, lock, owner=True)
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    def _header(self):
+        return _HEADER.unpack_from(self.buffer, 0)
+
+    def _set_header(self, stop, next_index, heap_used, logged):
+        _HEADER.pack_into(self.buffer, 0, _MAGIC, self.count, stop, next_index, heap_used, logged)
+
+    def claim(self):
+        """
+        Claim the next link for the calling worker
+        Returns its index, or None when every link is claimed or a stop was requested
+        """
+        with self.lock:
+            _, _, stop, next_index, heap_used, logged = self._header()
+            if stop or next_index >= self.count:
+                return None
+            self._set_header(stop, next_index + 1, heap_used, logged)
+            return next_index
+
+    def claimed(self):
+        """
+        Number of links handed out so far
+        """
+        return self._header()[3]
+
+    def request_stop(self):
+        """
+        Stop handing out links, the ones already claimed still finish
+        """
+        with self.lock:
+            _, _, _, next_index, heap_used, logged = self._header()
+            self._set_header(1, next_index, heap_used, logged)
+
+    def stopped(self):
+        return self._header()[2] != 0
+
+    def _slot_offset(self, index):
+        if not 0 <= index < self.count:
+            raise IndexError(f"slot {index} out of range")
+        return _HEADER_SIZE + index * _SLOT.size
+
+    def publish(self, index, start, fields):
+        """
+        Store the result of the link at index: its start value (None when it failed)
+        and a dict of the record's other fields
+        Returns False when the heap is full, the link then stays unfinished
+        """
+        start_bytes = start.encode('utf-8') if start is not None else b""
+        field_bytes = json.dumps(fields, separators=(',', ':')).encode('utf-8')
+        with self.lock:
+            _, _, stop, next_index, heap_used, logged = self._header()
+            if heap_used + len(start_bytes) + len(field_bytes) > self.heap_size:
+                return False
+            start_offset = heap_used
+            field_offset = heap_used + len(start_bytes)
+            position = self.heap_start + start_offset
+            self.buffer[position:position + len(start_bytes)] = start_bytes
+            position += len(start_bytes)
+            self.buffer[position:position + len(field_bytes)] = field_bytes
+            slot = self._slot_offset(index)
+            _SLOT.pack_into(self.buffer, slot, DONE if start is not None else FAILED,
+                            start_offset, len(start_bytes), field_offset, len(field_bytes))
+            # The link enters the log last, once everything it points at is in place
+            _LOG_ENTRY.pack_into(self.buffer, self.log_start + logged * _LOG_ENTRY.size, index)
+            self._set_header(stop, next_index, field_offset + len(field_bytes), logged + 1)
+        return True
+
+    def read(self, index):
+        """
+        Return (state, start, fields) of the link at index, (EMPTY, None, None) before it finished
+        """
+        state, start_offset, start_length, field_offset, field_length = _SLOT.unpack_from(
+            self.buffer, self._slot_offset(index))
+        if state == EMPTY:
+            return EMPTY, None, None
+        position = self.heap_start + start_offset
+        start = bytes(self.buffer[position:position + start_length]).decode('utf-8') if state == DONE else None
+        position = self.heap_start + field_offset
+        fields = json.loads(bytes(self.buffer[position:position + field_length]))
+        return state, start, fields
+
+    def collect(self, cursor):
+        """
+        Read the results published after the first cursor ones
+        Returns (list of (index, start, fields), cursor for the next call)
+        """
+        # Holding the lock orders the reads below after the writes of every publish it counts
+        with self.lock:
+            logged = self._header()[5]
+        results = []
+        for entry in range(cursor, logged):
+            index, = _LOG_ENTRY.unpack_from(self.buffer, self.log_start + entry * _LOG_ENTRY.size)
+            _, start, fields = self.read(index)
+            results.append((index, start, fields))
+        return results, logged
+
+    def close(self):
+        """
+        Detach from the table, the process that created it also frees it
+        """
+        self.buffer.release()
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Decoding of the start parameters stored by the vcloud.zip link processing scripts.
+Features:
+- Decoding of start values (base64 -> reverse -> base64)
+- Parsing of the decoded payloads into typed fields (channel id, message id, timestamp)
+- Export of the progress store as a columnar table (CSV, TSV or column-oriented JSON)
+- (channel id, message id) of every processed link stored in the progress store next to
+  its start value, written as results arrive so nothing is decoded again on later runs
+- Secondary index channel id -> sorted message ids -> links built from those pairs,
+  with range lookups (--channel/--messages)
+- Only depends on the standard library
+"""
+
+import os
+import re
+import sys
+import csv
+import base64
+import argparse
+from bisect import bisect_left, bisect_right
+from urllib.parse import urlparse, unquote
+
+# Payload of links pointing at a channel message: <channel id>_<message id>_<timestamp>
+_CHANNEL_MESSAGE_RE = re.compile(r'(-?\d+)_(\d+)_(\d+)')
+
+# Columns of the exported table, in order
+EXPORT_COLUMNS = ["url", "link_id", "start", "payload", "channel_id", "message_id", "timestamp"]
+
+
+def decode_start(value):
+    """
+    Decode a single start value to its payload, or None when it doesn't decode
+    """
+    try:
+        return base64.b64decode(base64.b64decode(value, validate=True)[::-1], validate=True).decode('utf-8')
+    except (ValueError, TypeError):
+        return None
+
+
+def decode_start_values(values):
+    """
+    Decode many start values, returning the payload strings in the same order
+    (None for values that don't decode)
+    """
+    return [decode_start(value) for value in values]
+
+
+def parse_start_payload(payload):
+    """
+    Split a decoded payload into (channel id, message id, timestamp) as ints
+    Returns (None, None, None) for payloads of other shapes
+    """
+    match = _CHANNEL_MESSAGE_RE.fullmatch(payload) if payload else None
+    if not match:
+        return None, None, None
+    return int(match.group(1)), int(match.group(2)), int(match.group(3))
+
+
+def message_key(start):
+    """
+    Return [channel id, message id] of the message a start value points at, None when
+    it doesn't point at a channel message
+    Stored as a list, the form it takes after a round trip through JSON
+    """
+    channel_id, message_id, _ = parse_start_payload(decode_start(start))
+    return None if channel_id is None else [channel_id, message_id]
+
+
+def update_message_keys(processed, messages):
+    """
+    Fill in the message keys ({url: [channel id, message id] or None}) of processed links
+    ({url: start}) that have none yet, decoding only their start values
+    Returns the number of links added
+    """
+    missing = [url for url in processed if url not in messages]
+    for url, payload in zip(missing, decode_start_values([processed[url] for url in missing])):
+        channel_id, message_id, _ = parse_start_payload(payload)
+        messages[url] = None if channel_id is None else [channel_id, message_id]
+    return len(missing)
+
+
+def link_id(url):
+    """
+    Return the id of a vcloud link, the last segment of its path
+    API-style links (/api/index.php?link=TOKEN) return their link token, which is not
+    the id of the vcloud.zip page they lead to
+    """
+    parsed = urlparse(url)
+    if "/api/" in parsed.path:
+        # Not parse_qs, it would turn the + of the base64 token into spaces
+        for field in parsed.query.split("&"):
+            name, _, value = field.partition("=")
+            if name == "link" and value:
+                return unquote(value)
+    return parsed.path.rstrip("/").rsplit("/", 1)[-1]
+
+
+def start_table(processed):
+    """
+    Build the columnar export table {column: [values]} from the processed links
+    ({url: start}) of the progress store
+    """
+    urls = list(processed)
+    starts = [processed[url] for url in urls]
+    payloads = decode_start_values(starts)
+    fields = [parse_start_payload(payload) for payload in payloads]
+    channel_ids, message_ids, timestamps = (list(column) for column in zip(*fields)) if fields else ([], [], [])
+    return {
+        "url": urls,
+        "link_id": [link_id(url) for url in urls],
+        "start": starts,
+        "payload": payloads,
+        "channel_id": channel_ids,
+        "message_id": message_ids,
+        "timestamp": timestamps,
+    }
+
+
+class StartIndex:
+    """
+    Index of processed links by the channel message their start value points at
+    Per channel, message ids are kept sorted with the links in a parallel list, so a
+    range of messages is found by bisection. Links whose start isn't a channel message
+    are left out.
+    """
+
+    def __init__(self):
+        # channel id -> ([message ids, sorted], [links, same order])
+        self.channels = {}
+
+    @classmethod
+    def from_messages(cls, messages):
+        """
+        Build the index from stored message keys ({url: [channel id, message id] or None},
+        see update_message_keys), nothing is decoded
+        """
+        index = cls()
+        entries = {}
+        for url, key in messages.items():
+            if key is not None:
+                channel_id, message_id = key
+                entries.setdefault(channel_id, []).append((message_id, url))
+        for channel_id, pairs in entries.items():
+            pairs.sort()
+            index.channels[channel_id] = ([message_id for message_id, _ in pairs], [url for _, url in pairs])
+        return index
+
+    def range(self, channel_id, first=None, last=None):
+        """
+        Return (message id, link) pairs of a channel with first <= message id <= last,
+        in message order; None leaves that end open
+        """
+        message_ids, urls = self.channels.get(channel_id, ((), ()))
+        low = 0 if first is None else bisect_left(message_ids, first)
+        high = len(message_ids) if last is None else bisect_right(message_ids, last)
+        return list(zip(message_ids[low:high], urls[low:high]))
+
+
+def write_start_table(table, path):
+    """
+    Write the export table, the format follows the extension:
+    .json for column-oriented JSON, .tsv for tab-separated, anything else CSV
+    """
+    from vcloud_store import atomic_write_json, temp_file_for
+
+    if path.endswith(".json"):
+        atomic_write_json(path, {"columns": EXPORT_COLUMNS, "rows": len(table["url"]), "data": table},
+                          keep_backup=False)
+        return
+
+    fd, tmp_path = temp_file_for(path)
+    try:
+        with os.fdopen(fd, 'w', newline='') as f:
+            writer = csv.writer(f, delimiter='\t' if path.endswith(".tsv") else ',')
+            writer.writerow(EXPORT_COLUMNS)
+            writer.writerows(zip(*(table[column] for column in EXPORT_COLUMNS)))
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def export_progress(progress, path):
+    """
+    Decode every start value in the progress data and write the export table to path
+    Returns the number of rows and of values that didn't decode
+    """
+    table = start_table(progress.get("processed", {}))
+    write_start_table(table, path)
+    failed = sum(1 for payload in table["payload"] if payload is None)
+    return len(table["url"]), failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the decoded start values of a progress file")
+    parser.add_argument("progress_file", nargs="?", default="rogd_progress.json",
+                        help="Progress file to export (default: rogd_progress.json)")
+    parser.add_argument("-o", "--output", default="rogd_starts.csv",
+                        help="Output table: .csv, .tsv or .json (default: rogd_starts.csv)")
+    parser.add_argument("--channel", type=int,
+                        help="Instead of exporting, list the links pointing at messages of this channel")
+    parser.add_argument("--messages", metavar="FIRST[-LAST]",
+                        help="With --channel, only this message id or range of message ids")
+    args = parser.parse_args()
+
+    from vcloud_store import load_json_with_fallback
+
+    progress = load_json_with_fallback(args.progress_file, default={"processed": {}})
+    if args.channel is not None:
+        first = last = None
+        if args.messages:
+            first, _, last = args.messages.partition("-")
+            first, last = int(first), int(last or first)
+        # Message keys stored by the processing script, only links without one are decoded
+        messages = progress.get("messages", {})
+        update_message_keys(progress.get("processed", {}), messages)
+        index = StartIndex.from_messages(messages)
+        for message_id, url in index.range(args.channel, first, last):
+            print(f"{message_id}\t{url}")
+        return
+
+    rows, failed = export_progress(progress, args.output)
+    print(f"Exported {rows} links to {args.output}" + (f", {failed} start values didn't decode" if failed else ""))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
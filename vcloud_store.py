@@ -0,0 +1,611 @@
+#!/usr/bin/env python3
+"""
+Persistence helpers shared by the vcloud.zip link processing scripts.
+Features:
+- Link manifest caching so unchanged inputs skip the JSON load and tree walk
+- Per-entry digests so incremental runs can diff a new input against the last one
+- Crash-safe JSON writes (temp file + fsync + rename) with checksums and a last
+  good snapshot to fall back to
+- Background persistence thread that applies results and saves them in batches
+- Output writer serializing top-level entries in parallel worker processes, written
+  in order, with a compact mode and optional gzip/zstd compression
+- Only depends on the standard library so importing it keeps startup cheap
+"""
+
+import io
+import json
+import os
+import sys
+import gzip
+import time
+import queue
+import hashlib
+import tempfile
+import threading
+
+
+# Read once, os.umask can only be read by setting it
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+# File name suffix of the output for each supported compression
+OUTPUT_COMPRESSION = {"gzip": ".gz", "zstd": ".zst"}
+
+# Entries a worker process serializes at once are aimed at this many chunks per worker,
+# enough to keep every worker busy while the writer waits for the next chunk in order
+OUTPUT_CHUNKS_PER_WORKER = 4
+
+
+# Bump this whenever the way links are discovered changes, so old manifests are ignored
+MANIFEST_VERSION = 2
+
+
+def file_fingerprint(path, with_hash=True):
+    """
+    Return the mtime/size (and optionally sha256) identifying the contents of a file
+    """
+    stat = os.stat(path)
+    fingerprint = {
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+    }
+    if with_hash:
+        fingerprint["sha256"] = file_sha256(path)
+    return fingerprint
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """
+    Hash a file in chunks so large inputs don't need to be held in memory
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_link_manifest(manifest_file):
+    """
+    Read a manifest without checking it against any input
+    Returns None when there is no usable manifest
+    """
+    if not os.path.exists(manifest_file) or os.path.getsize(manifest_file) == 0:
+        return None
+
+    try:
+        with open(manifest_file, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+
+    return manifest
+
+
+def load_link_manifest(manifest_file, input_file, discovery=None):
+    """
+    Load the cached list of link URLs for input_file
+    discovery identifies how links were found, a manifest built differently is ignored
+    Returns None when there is no manifest or it doesn't describe the current input
+    """
+    manifest = read_link_manifest(manifest_file)
+    if manifest is None or manifest.get("discovery") != discovery:
+        return None
+
+    recorded_mtime = manifest.get("input", {}).get("mtime_ns")
+    if not manifest_matches_input(manifest, input_file):
+        return None
+    if manifest["input"]["mtime_ns"] != recorded_mtime:
+        # Refresh the mtime so the next run takes the fast path again
+        save_link_manifest(manifest_file, manifest)
+    return manifest
+
+
+def manifest_matches_input(manifest, input_file):
+    """
+    Check that input_file still holds the contents manifest was built from
+    When only its mtime changed, the manifest's recorded mtime is updated in place
+    """
+    recorded = manifest.get("input", {})
+    current = file_fingerprint(input_file, with_hash=False)
+
+    # Fast path: nothing touched the input since the manifest was written
+    if recorded.get("mtime_ns") == current["mtime_ns"] and recorded.get("size") == current["size"]:
+        return True
+
+    # The file was touched; only trust the manifest if the contents are really the same
+    if recorded.get("size") == current["size"] and recorded.get("sha256") == file_sha256(input_file):
+        manifest["input"]["mtime_ns"] = current["mtime_ns"]
+        return True
+
+    return False
+
+
+def build_link_manifest(input_file, fingerprint, links, link_entries=None, entries=None, discovery=None):
+    """
+    Build a manifest recording the input fingerprint and the link URLs found in it
+    The fingerprint should be taken before the input is read so a concurrent edit
+    invalidates the manifest instead of being hidden by it
+    link_entries gives the top-level entry position of each link and entries the
+    [key, digest] pair of every top-level entry, both used by incremental runs
+    """
+    return {
+        "version": MANIFEST_VERSION,
+        "discovery": discovery,
+        "input": dict(fingerprint, path=os.path.basename(input_file)),
+        "links": links,
+        "link_entries": link_entries,
+        "entries": entries,
+        # Filled in once an output has been written for exactly this input
+        "output": None,
+        "output_results": None,
+    }
+
+
+def top_level_entries(data):
+    """
+    Return the top-level entries of a JSON document as (key, value) pairs
+    Keys are list indexes or object keys; returns None for scalar documents
+    """
+    if isinstance(data, list):
+        return list(enumerate(data))
+    if isinstance(data, dict):
+        return list(data.items())
+    return None
+
+
+def rebuild_from_entries(template, pairs):
+    """
+    Rebuild a document of the same kind as template from (key, value) pairs
+    """
+    if isinstance(template, list):
+        return [value for _, value in pairs]
+    return {key: value for key, value in pairs}
+
+
+def entry_digest(entry):
+    """
+    Digest of a JSON value that only changes when its content changes
+    """
+    canonical = json.dumps(entry, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+def output_matches_manifest(manifest, output_file):
+    """
+    Check that output_file is the output last written for this manifest's input
+    """
+    recorded = manifest.get("output") if manifest else None
+    if not recorded or not os.path.exists(output_file):
+        return False
+    current = file_fingerprint(output_file, with_hash=False)
+    return recorded.get("mtime_ns") == current["mtime_ns"] and recorded.get("size") == current["size"]
+
+
+def entry_result_digests(manifest, results_map):
+    """
+    Digest of the results applied to each top-level entry, None for entries without links
+    Two runs give the same digest for an entry only if its links have the same results
+    """
+    starts = [None] * len(manifest["entries"])
+    for url, position in zip(manifest["links"], manifest["link_entries"]):
+        if starts[position] is None:
+            starts[position] = []
+        starts[position].append(results_map.get(url))
+    return [entry_digest(values) if values is not None else None for values in starts]
+
+
+def record_output_in_manifest(manifest_file, manifest, output_file, results_map=None):
+    """
+    Remember which output file corresponds to the manifest's input
+    With results_map the results applied to each entry are recorded too, so an
+    incremental run can tell which entries of that output are missing a result
+    """
+    manifest["output"] = file_fingerprint(output_file, with_hash=False)
+    if results_map is not None and manifest.get("entries") is not None:
+        manifest["output_results"] = entry_result_digests(manifest, results_map)
+    save_link_manifest(manifest_file, manifest)
+
+
+def save_link_manifest(manifest_file, manifest):
+    """
+    Save the link manifest to a file
+    """
+    atomic_write_json(manifest_file, manifest, keep_backup=False)
+
+
+class _HashingWriter:
+    """
+    File wrapper that hashes everything written through it
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.digest = hashlib.sha256()
+
+    def write(self, text):
+        data = text.encode('utf-8') if isinstance(text, str) else text
+        self.digest.update(data)
+        self.f.write(data)
+
+    def flush(self):
+        self.f.flush()
+
+
+def _fsync_directory(directory):
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        # Not supported on this platform
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def temp_file_for(path):
+    """
+    Create a temp file next to path to be renamed over it, returns (fd, temp path)
+    mkstemp creates it owner-only; it gets the mode path has, or the one a plain open()
+    would give a new file, so the rename doesn't change who can read path
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        mode = os.stat(path).st_mode & 0o7777
+    except OSError:
+        mode = 0o666 & ~_UMASK
+    try:
+        os.fchmod(fd, mode)
+    except (AttributeError, OSError):
+        # No fchmod on this platform
+        pass
+    return fd, tmp_path
+
+
+def _write_checksum(path, checksum):
+    fd, tmp_path = temp_file_for(path)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(f"{checksum}\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _atomic_write(path, write, keep_backup):
+    """
+    Call write with a file to write path's new contents to, so that a crash at any
+    point leaves either the old or the new file
+    The contents go to a temp file that is fsynced and renamed over the destination,
+    their sha256 is written to <path>.sha256, and the previous version is kept as
+    <path>.bak (with its checksum) when keep_backup is set
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = temp_file_for(path)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            writer = _HashingWriter(f)
+            write(writer)
+            f.flush()
+            os.fsync(f.fileno())
+
+        checksum_path = f"{path}.sha256"
+        if keep_backup and os.path.exists(path):
+            # The current file was fully written by an earlier call, it becomes the last good snapshot
+            os.replace(path, f"{path}.bak")
+            if os.path.exists(checksum_path):
+                os.replace(checksum_path, f"{path}.bak.sha256")
+        elif os.path.exists(checksum_path):
+            os.unlink(checksum_path)
+
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+    _write_checksum(checksum_path, writer.digest.hexdigest())
+    _fsync_directory(directory)
+
+
+def atomic_write_json(path, data, indent=None, keep_backup=True):
+    """
+    Write data as JSON so that a crash at any point leaves either the old or the new file
+    See _atomic_write for the checksum and last good snapshot kept next to it
+    """
+    _atomic_write(path, lambda writer: json.dump(data, writer, indent=indent), keep_backup)
+
+
+def output_path(path, compression=None):
+    """
+    Name of the output file path is written to with the given compression
+    """
+    return path + OUTPUT_COMPRESSION[compression] if compression else path
+
+
+def check_compression(compression):
+    """
+    Raise ValueError when compression is unknown or its module isn't installed
+    """
+    if compression is None:
+        return
+    if compression not in OUTPUT_COMPRESSION:
+        raise ValueError(f"unknown compression {compression!r}, expected one of {', '.join(OUTPUT_COMPRESSION)}")
+    if compression == "zstd":
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            raise ValueError("zstd output needs the zstandard package (pip install zstandard)")
+
+
+def _compressed_writer(f, compression):
+    """
+    Binary writer compressing into f, closing it finishes the stream but leaves f open
+    """
+    if compression == "gzip":
+        # mtime 0 keeps the output byte for byte the same for the same data
+        return gzip.GzipFile(fileobj=f, mode='wb', compresslevel=6, mtime=0)
+    import zstandard
+    return zstandard.ZstdCompressor(level=3).stream_writer(f, closefd=False)
+
+
+def load_json_output(path):
+    """
+    Load an output written by write_json_output, decompressing it according to its suffix
+    """
+    with open(path, 'rb') as f:
+        if path.endswith(OUTPUT_COMPRESSION["gzip"]):
+            return json.load(gzip.GzipFile(fileobj=f, mode='rb'))
+        if path.endswith(OUTPUT_COMPRESSION["zstd"]):
+            import zstandard
+            return json.load(io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(f)))
+        return json.load(f)
+
+
+def _json_layout(data, indent):
+    """
+    Return (opening, separator, closing, pad) that json.dump puts around the top-level
+    entries of data, or None for scalar documents
+    pad is the indentation of nested lines of an entry
+    """
+    if isinstance(data, list):
+        brackets = "[]"
+    elif isinstance(data, dict):
+        brackets = "{}"
+    else:
+        return None
+    if not data:
+        return brackets[0], "", brackets[1], ""
+    if indent is None:
+        return brackets[0], ",", brackets[1], ""
+    pad = " " * indent
+    return f"{brackets[0]}\n{pad}", f",\n{pad}", f"\n{brackets[1]}", pad
+
+
+def _dump_entries(chunk):
+    """
+    Serialize a chunk of top-level entries exactly as json.dump would inside the document
+    Runs in worker processes, so it only takes and returns plain values
+    """
+    pairs, is_dict, indent, separator, pad = chunk
+    # Same separators json.dump uses: compact without indent, ", " / ": " style with it
+    separators = (',', ':') if indent is None else (',', ': ')
+    pieces = []
+    for key, value in pairs:
+        text = json.dumps(value, indent=indent, separators=separators)
+        if pad:
+            # Strings never hold raw newlines, so every newline is layout to indent one level deeper
+            text = text.replace("\n", "\n" + pad)
+        if is_dict:
+            text = json.dumps(key) + separators[1] + text
+        pieces.append(text)
+    return separator.join(pieces)
+
+
+def _json_pieces(data, indent, workers):
+    """
+    Yield the JSON text of data in order, one chunk of top-level entries at a time,
+    serialized by up to workers processes
+    """
+    layout = _json_layout(data, indent)
+    if layout is None:
+        yield json.dumps(data, indent=indent, separators=(',', ':') if indent is None else None)
+        return
+
+    opening, separator, closing, pad = layout
+    is_dict = isinstance(data, dict)
+    pairs = list(data.items()) if is_dict else [(None, value) for value in data]
+    size = max(1, -(-len(pairs) // (max(1, workers) * OUTPUT_CHUNKS_PER_WORKER)))
+    chunks = [(pairs[start:start + size], is_dict, indent, separator, pad) for start in range(0, len(pairs), size)]
+
+    yield opening
+    if workers <= 1 or len(chunks) < 2:
+        # Chunks serialized one by one still keep only one of them in memory as text
+        for number, text in enumerate(map(_dump_entries, chunks)):
+            yield text if number == 0 else separator + text
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # map hands results back in submission order, so chunks are written as soon as
+            # they and every chunk before them are done
+            for number, text in enumerate(executor.map(_dump_entries, chunks)):
+                yield text if number == 0 else separator + text
+    yield closing
+
+
+def write_json_output(path, data, indent=2, compression=None, workers=1):
+    """
+    Write data as JSON the way atomic_write_json does, without a backup
+    indent=None writes compact JSON without any whitespace; with workers > 1 the
+    top-level entries are serialized in that many processes and written in order
+    compression is None, "gzip" or "zstd", path should carry the matching suffix (see output_path)
+    """
+    atomic_write_bytes(path, (piece.encode('utf-8') for piece in _json_pieces(data, indent, workers)), compression)
+
+
+def atomic_write_bytes(path, chunks, compression=None):
+    """
+    Write an iterable of bytes the way atomic_write_json writes JSON, without a backup,
+    compressed with compression (None, "gzip" or "zstd")
+    """
+    check_compression(compression)
+
+    def write(writer):
+        out = _compressed_writer(writer, compression) if compression else writer
+        for chunk in chunks:
+            out.write(chunk)
+        if compression:
+            out.close()
+
+    _atomic_write(path, write, keep_backup=False)
+
+
+def _read_verified_json(path):
+    """
+    Read a JSON file written by atomic_write_json, checking its checksum when there is one
+    Raises ValueError when the file is empty, corrupt or doesn't match its checksum
+    """
+    with open(path, 'rb') as f:
+        raw = f.read()
+    if not raw:
+        raise ValueError("file is empty")
+
+    checksum_path = f"{path}.sha256"
+    if os.path.exists(checksum_path):
+        with open(checksum_path, 'r') as f:
+            expected = f.read().strip()
+        if expected and hashlib.sha256(raw).hexdigest() != expected:
+            # A file edited by hand after it was written is newer than its checksum,
+            # keep it as long as it still parses
+            if os.path.getmtime(path) <= os.path.getmtime(checksum_path):
+                raise ValueError("checksum mismatch")
+            data = json.loads(raw)
+            print(f"Warning: {path} was modified outside this script, using it as is", file=sys.stderr)
+            return data
+    # Without a checksum (older files, or a crash just before it was written)
+    # the file is trusted if it parses, which a truncated file never does
+
+    return json.loads(raw)
+
+
+def load_json_with_fallback(path, default=None):
+    """
+    Load a JSON file written by atomic_write_json, falling back to its last good
+    snapshot when the file is missing, truncated or corrupt
+    Returns default when neither exists; raises ValueError when both are unusable
+    rather than silently starting over
+    """
+    errors = []
+    for candidate in (path, f"{path}.bak"):
+        if not os.path.exists(candidate):
+            continue
+        try:
+            data = _read_verified_json(candidate)
+        except ValueError as e:
+            errors.append(f"{candidate}: {e}")
+            print(f"Warning: ignoring {candidate} ({e})", file=sys.stderr)
+            continue
+        if candidate != path:
+            print(f"Warning: recovered {path} from its last good snapshot {candidate}", file=sys.stderr)
+        return data
+
+    if errors:
+        raise ValueError(f"No usable copy of {path}: {'; '.join(errors)}. "
+                         f"Delete it to start over.")
+    return default
+
+
+class BatchedPersister(threading.Thread):
+    """
+    Applies submitted items to some state and saves it from a dedicated thread
+    apply(item) is called for every item and save() once per batch, when batch_size
+    items arrived or interval seconds passed since the first unsaved one, whichever
+    comes first. Only this thread calls apply and save, so the state needs no lock
+    as long as other threads only read it.
+    """
+
+    _STOP = object()
+
+    def __init__(self, apply, save, batch_size=50, interval=5.0):
+        super().__init__(name="persister", daemon=True)
+        self.apply = apply
+        self.save = save
+        self.batch_size = max(1, batch_size)
+        self.interval = interval
+        self.queue = queue.Queue()
+        self.saves = 0
+        self.error = None
+        # First exception raised by apply, the item it was applied to is lost
+        self.apply_error = None
+
+    def submit(self, item):
+        """
+        Hand an item to the persistence thread, never blocks
+        """
+        self.queue.put(item)
+
+    def run(self):
+        unsaved = 0
+        first_unsaved = None
+        while True:
+            timeout = None
+            if unsaved:
+                timeout = max(0.0, self.interval - (time.monotonic() - first_unsaved))
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            stopping = item is self._STOP
+            if item is not None and not stopping:
+                try:
+                    self.apply(item)
+                except Exception as e:
+                    # Keep going, the other items still get applied and saved
+                    if self.apply_error is None:
+                        self.apply_error = e
+                    print(f"\nWarning: could not apply a result: {e!r}", file=sys.stderr)
+                    continue
+                if not unsaved:
+                    first_unsaved = time.monotonic()
+                unsaved += 1
+
+            if unsaved and (stopping or unsaved >= self.batch_size
+                            or time.monotonic() - first_unsaved >= self.interval):
+                self._save()
+                unsaved = 0
+            if stopping:
+                return
+
+    def _save(self):
+        try:
+            self.save()
+            self.saves += 1
+            self.error = None
+        except Exception as e:
+            # Keep the results in memory, the next batch tries again
+            self.error = e
+            print(f"\nWarning: could not save progress: {e}", file=sys.stderr)
+
+    def close(self):
+        """
+        Apply and save everything submitted so far, then stop the thread
+        Raises the last save error if the final save failed, otherwise the first
+        error of apply if there was one
+        """
+        self.queue.put(self._STOP)
+        self.join()
+        if self.error is not None:
+            raise self.error
+        if self.apply_error is not None:
+            raise self.apply_error
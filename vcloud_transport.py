@@ -0,0 +1,886 @@
+#!/usr/bin/env python3
+"""
+HTTP helpers shared by the vcloud.zip link processing scripts.
+Features:
+- Per-stage deadlines covering every redirect followed and the body, so a stalled
+  or trickling hop can't hold a worker past its stage timeout
+- Optional request hedging: a duplicate request is sent when a hop is slower than
+  its p95 latency, within a global hedge budget
+- Opt-in memo of redirect hops so chains sharing a prefix skip the hops already seen
+- DNS cache with TTL shared by every client, plus warm-up of the known hosts
+- Per-host concurrency limits
+- Sampled per-link traces with a span per hop, always kept for failed and slow links
+- Accept-Encoding negotiated per stage, limited to the encodings httpx can decode here
+- Pool of egress proxies with per-proxy concurrency limits, health scores fed by
+  errors and captchas, and sticky assignment so a link's whole chain uses one egress
+- httpx is imported lazily so importing this module keeps startup cheap
+"""
+
+import json
+import random
+import socket
+import threading
+import time
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+
+
+# Timeout in seconds for each stage of the resolution chain, covering every hop the
+# stage follows and reading the body. Never above httpx's 5s default the requests
+# used before, which only bounded each connect/read on its own
+STAGE_TIMEOUTS = {
+    "vcloud_api": 5.0,
+    "vcloud_page": 5.0,
+    "hubcloud_go": 5.0,
+    "redirect_hop": 5.0,
+}
+
+# Accept-Encoding per stage: "auto" offers every encoding the installed httpx extras
+# can decode, anything else is sent as is. The bodies are HTML, which compresses well
+# and decodes in well under a millisecond, so compression is offered everywhere;
+# benchmark_vcloud_links.py encoding compares the options, but its mock pages are
+# padded and overstate the savings. hubcloud_go doesn't read its body at all
+# (headers_only) but compressed bytes still leave less to drain from the socket
+STAGE_ACCEPT_ENCODING = {
+    "vcloud_api": "auto",
+    "vcloud_page": "auto",
+    "hubcloud_go": "auto",
+    "redirect_hop": "auto",
+}
+
+# Connect timeout is capped regardless of the stage, a host that doesn't accept
+# the connection within this time is not going to answer the request either
+CONNECT_TIMEOUT = 5.0
+
+# Number of latency samples kept per stage and needed before hedging kicks in
+LATENCY_WINDOW = 200
+MIN_HEDGE_SAMPLES = 20
+
+_hedging_enabled = False
+# Fraction of primary requests that may be duplicated
+_hedge_budget = 0.05
+# Hedges allowed before the budget has any primaries to be a fraction of
+_hedge_burst = 5
+
+_stats_lock = threading.Lock()
+_latencies = {}
+_hedge_stats = {"requests": 0, "hedged": 0, "hedge_wins": 0}
+_hedge_executor = None
+
+# Redirect memo: URL -> (next URL, expiry), oldest entries are evicted first
+REDIRECT_MEMO_SIZE = 10000
+_redirect_memo_enabled = False
+_redirect_memo_ttl = 300.0
+_redirect_memo = OrderedDict()
+_redirect_memo_stats = {"hits": 0, "misses": 0, "stored": 0}
+
+# Hosts every run talks to, resolved before the first request goes out
+KNOWN_HOSTS = ["vcloud.zip", "hubcloud.one"]
+
+# DNS cache: host -> (addresses, expiry). getaddrinfo doesn't report record TTLs,
+# so every entry lives for the same configurable time
+_dns_ttl = 300.0
+_dns_cache = {}
+_dns_host_locks = {}
+_dns_stats = {"hits": 0, "misses": 0}
+_caching_backend = None
+_auto_accept_encoding = None
+
+# Called by new_client to build the transport, see set_transport_factory
+_transport_factory = None
+
+# Host -> semaphore capping concurrent requests to it
+_host_limits = {}
+
+# Egress pool, empty when all traffic goes out directly. The egress of the link a
+# worker thread is resolving lives in _egress_local
+_egresses = []
+_egress_lock = threading.Lock()
+_egress_local = threading.local()
+# Weight of the latest outcome in an egress's health score
+EGRESS_HEALTH_ALPHA = 0.2
+_egress_min_health = 0.3
+_egress_cooldown = 60.0
+# Captchas seen by every link, with or without a proxy pool
+_captcha_total = 0
+
+# Tracing: the trace of the link a worker thread is resolving lives in _trace_local
+_trace_local = threading.local()
+_trace_file = None
+_trace_lock = threading.Lock()
+_trace_sample_rate = 0.0
+_trace_slow_threshold = 30.0
+
+
+def configure_timeouts(stage_timeouts):
+    """
+    Override the timeouts of some stages, given as {stage: seconds}
+    """
+    for stage, seconds in stage_timeouts.items():
+        if stage not in STAGE_TIMEOUTS:
+            raise ValueError(f"Unknown stage {stage!r}, expected one of {', '.join(STAGE_TIMEOUTS)}")
+        STAGE_TIMEOUTS[stage] = float(seconds)
+
+
+def configure_hedging(enabled, budget=0.05):
+    """
+    Enable or disable hedged requests
+    budget is the fraction of requests that may be sent a second time
+    """
+    global _hedging_enabled, _hedge_budget
+    _hedging_enabled = enabled
+    _hedge_budget = budget
+
+
+def stage_timeout(stage, deadline=None):
+    """
+    Return the httpx timeout to use for a stage
+    With a deadline (time.monotonic()) only the time left until it is given, and
+    TimeoutError is raised once it has passed
+    """
+    import httpx
+
+    seconds = STAGE_TIMEOUTS[stage]
+    if deadline is not None:
+        seconds = min(seconds, deadline - time.monotonic())
+        if seconds <= 0:
+            raise TimeoutError(f"{stage} stage timed out after {STAGE_TIMEOUTS[stage]}s")
+    return httpx.Timeout(seconds, connect=min(CONNECT_TIMEOUT, seconds))
+
+
+def new_client(**kwargs):
+    """
+    Create a fresh httpx client like the working individual resolver
+    Connections are opened through the shared DNS cache unless it is disabled
+    """
+    import httpx
+
+    if "transport" not in kwargs:
+        egress = current_egress()
+        proxy = egress.proxy if egress is not None else None
+        if _transport_factory is not None:
+            transport = _transport_factory(proxy=proxy)
+        else:
+            transport = default_transport(proxy)
+        if transport is not None:
+            kwargs["transport"] = transport
+    return httpx.Client(**kwargs)
+
+
+def default_transport(proxy=None):
+    """
+    Return the transport new_client uses without a transport factory, through proxy
+    when given, or None for httpx's own default
+    """
+    if proxy is not None:
+        import httpx
+
+        # The proxy resolves the target host, only its own name goes through DNS here
+        return httpx.HTTPTransport(proxy=proxy)
+    return _dns_cached_transport()
+
+
+def set_transport_factory(factory):
+    """
+    Make new_client build its transport with factory(proxy=...), e.g. to route requests
+    to a local mock or a recording; proxy is the URL of the link's egress proxy or None
+    None restores the default DNS-cached transport
+    """
+    global _transport_factory
+    _transport_factory = factory
+
+
+def configure_accept_encoding(stage_encodings):
+    """
+    Override the Accept-Encoding of some stages, given as {stage: value}
+    "auto" offers every encoding that can be decoded, "identity" disables compression
+    """
+    for stage, value in stage_encodings.items():
+        if stage not in STAGE_ACCEPT_ENCODING:
+            raise ValueError(f"Unknown stage {stage!r}, expected one of {', '.join(STAGE_ACCEPT_ENCODING)}")
+        STAGE_ACCEPT_ENCODING[stage] = value
+
+
+def auto_accept_encoding():
+    """
+    Return the encodings httpx can decode with the extras installed here
+    Offering br or zstd without the brotli/zstandard packages makes httpx hand back
+    the compressed bytes undecoded
+    """
+    global _auto_accept_encoding
+    if _auto_accept_encoding is None:
+        import importlib.util
+
+        encodings = ["gzip", "deflate"]
+        if importlib.util.find_spec("brotli") or importlib.util.find_spec("brotlicffi"):
+            encodings.append("br")
+        if importlib.util.find_spec("zstandard"):
+            encodings.append("zstd")
+        _auto_accept_encoding = ", ".join(encodings)
+    return _auto_accept_encoding
+
+
+def _stage_headers(stage, headers):
+    value = STAGE_ACCEPT_ENCODING.get(stage, "auto")
+    if value == "auto":
+        value = auto_accept_encoding()
+    headers = dict(headers or {})
+    headers['Accept-Encoding'] = value
+    return headers
+
+
+def configure_dns_cache(ttl):
+    """
+    Set how long resolved addresses are reused, 0 disables the cache
+    """
+    global _dns_ttl
+    _dns_ttl = ttl
+    with _stats_lock:
+        _dns_cache.clear()
+
+
+def resolve_host(host, port=443):
+    """
+    Resolve host through the DNS cache and return its addresses
+    Concurrent lookups of the same host wait for a single resolution
+    """
+    now = time.monotonic()
+    with _stats_lock:
+        entry = _dns_cache.get(host)
+        if entry is not None and entry[1] > now:
+            _dns_stats["hits"] += 1
+            return entry[0]
+        host_lock = _dns_host_locks.setdefault(host, threading.Lock())
+
+    with host_lock:
+        # Another thread may have resolved it while we waited
+        with _stats_lock:
+            entry = _dns_cache.get(host)
+            if entry is not None and entry[1] > time.monotonic():
+                _dns_stats["hits"] += 1
+                return entry[0]
+            _dns_stats["misses"] += 1
+
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        addresses = []
+        for info in infos:
+            address = info[4][0]
+            if address not in addresses:
+                addresses.append(address)
+
+        with _stats_lock:
+            _dns_cache[host] = (addresses, time.monotonic() + _dns_ttl)
+        return addresses
+
+
+def warm_dns(hosts=None):
+    """
+    Pre-resolve hosts in parallel so the first requests don't wait on the resolver
+    Returns {host: seconds taken or the error raised}
+    """
+    hosts = list(hosts or KNOWN_HOSTS)
+    timings = {}
+
+    def resolve(host):
+        started = time.monotonic()
+        try:
+            resolve_host(host)
+            timings[host] = time.monotonic() - started
+        except OSError as e:
+            timings[host] = e
+
+    threads = [threading.Thread(target=resolve, args=(host,), daemon=True) for host in hosts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return timings
+
+
+def dns_stats():
+    """
+    Return a copy of the DNS cache counters
+    """
+    with _stats_lock:
+        return dict(_dns_stats)
+
+
+def _is_ip_address(host):
+    for family in (socket.AF_INET, socket.AF_INET6):
+        try:
+            socket.inet_pton(family, host)
+            return True
+        except OSError:
+            pass
+    return False
+
+
+def _get_caching_backend():
+    """
+    Return the httpcore network backend that connects through the DNS cache
+    """
+    global _caching_backend
+    if _caching_backend is not None:
+        return _caching_backend
+
+    import httpcore
+
+    class CachingBackend(httpcore.SyncBackend):
+        def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+            if _dns_ttl <= 0 or _is_ip_address(host):
+                return super().connect_tcp(host, port, timeout, local_address, socket_options)
+            try:
+                addresses = resolve_host(host, port)
+            except OSError as e:
+                raise httpcore.ConnectError(str(e))
+
+            # Try each address in turn like socket.create_connection does,
+            # TLS still uses the host name for SNI and certificate checks
+            error = None
+            for address in addresses:
+                try:
+                    return super().connect_tcp(address, port, timeout, local_address, socket_options)
+                except (httpcore.ConnectError, httpcore.ConnectTimeout) as e:
+                    error = e
+            raise error
+
+    _caching_backend = CachingBackend()
+    return _caching_backend
+
+
+def _dns_cached_transport():
+    """
+    Return an httpx transport resolving through the DNS cache, or None to use the default
+    """
+    import httpx
+    from urllib.request import getproxies
+
+    # A custom transport stops httpx from picking up proxies from the environment,
+    # so leave those setups alone
+    if _dns_ttl <= 0 or getproxies():
+        return None
+
+    transport = httpx.HTTPTransport()
+    pool = getattr(transport, "_pool", None)
+    if pool is None or not hasattr(pool, "_network_backend"):
+        # httpcore internals changed, fall back to resolving on every connection
+        return None
+    pool._network_backend = _get_caching_backend()
+    return transport
+
+
+def record_latency(stage, seconds):
+    """
+    Record how long a successful request of a stage took
+    """
+    with _stats_lock:
+        window = _latencies.get(stage)
+        if window is None:
+            window = _latencies[stage] = deque(maxlen=LATENCY_WINDOW)
+        window.append(seconds)
+
+
+def latency_percentile(stage, percentile):
+    """
+    Return the given latency percentile of a stage, or None without enough samples
+    """
+    with _stats_lock:
+        window = _latencies.get(stage)
+        if not window or len(window) < MIN_HEDGE_SAMPLES:
+            return None
+        ordered = sorted(window)
+    index = min(len(ordered) - 1, int(len(ordered) * percentile / 100))
+    return ordered[index]
+
+
+def hedge_stats():
+    """
+    Return a copy of the hedging counters
+    """
+    with _stats_lock:
+        return dict(_hedge_stats)
+
+
+def _take_hedge_token():
+    """
+    Check the global hedge budget and count a hedge if it allows one
+    """
+    with _stats_lock:
+        allowed = _hedge_budget * _hedge_stats["requests"] + _hedge_burst
+        if _hedge_stats["hedged"] >= allowed:
+            return False
+        _hedge_stats["hedged"] += 1
+        return True
+
+
+def _get_executor():
+    global _hedge_executor
+    from concurrent.futures import ThreadPoolExecutor
+
+    with _stats_lock:
+        if _hedge_executor is None:
+            _hedge_executor = ThreadPoolExecutor(max_workers=256, thread_name_prefix="hedge")
+        return _hedge_executor
+
+
+def configure_host_limits(limits):
+    """
+    Cap concurrent requests per host, given as {host: maximum}
+    """
+    for host, limit in limits.items():
+        if limit < 1:
+            raise ValueError(f"Host limit for {host} must be at least 1")
+        _host_limits[host.lower()] = threading.BoundedSemaphore(limit)
+
+
+def _host_semaphore(url):
+    if not _host_limits:
+        return None
+    from urllib.parse import urlparse
+
+    return _host_limits.get((urlparse(url).hostname or "").lower())
+
+
+def _send_before(client, request, stage, deadline, follow_redirects, headers_only):
+    """
+    Send request, following redirects and reading the body, before the stage deadline
+    Every hop is sent with only the time left as its timeout and the deadline is checked
+    between body chunks, so extra hops or a slowly trickling body can't stretch the stage
+    With headers_only the response is closed before its body is read, only the status,
+    headers and final URL are available
+    """
+    import httpx
+
+    history = []
+    while True:
+        request.extensions = dict(request.extensions, timeout=stage_timeout(stage, deadline).as_dict())
+        response = client.send(request, stream=True, follow_redirects=False)
+        if not follow_redirects or response.next_request is None:
+            break
+        response.close()
+        history.append(response)
+        if len(history) > client.max_redirects:
+            raise httpx.TooManyRedirects("Exceeded maximum allowed redirects.", request=request)
+        request = response.next_request
+
+    response.history = history
+    if headers_only:
+        response.close()
+        return response
+
+    class DeadlineStream(httpx.SyncByteStream):
+        def __init__(self, stream):
+            self.stream = stream
+
+        def __iter__(self):
+            for chunk in self.stream:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"{stage} stage timed out after {STAGE_TIMEOUTS[stage]}s "
+                                       f"reading {request.url}")
+                yield chunk
+
+        def close(self):
+            self.stream.close()
+
+    response.stream = DeadlineStream(response.stream)
+    try:
+        response.read()
+    finally:
+        response.close()
+    return response
+
+
+def _timed_get(client, url, stage, kwargs, trace=None, hedge=False, egress=None, deadline=None):
+    semaphore = _host_semaphore(url)
+    if semaphore is not None:
+        semaphore.acquire()
+    if egress is not None:
+        egress.slots.acquire()
+    started = time.monotonic()
+    if deadline is None:
+        deadline = started + STAGE_TIMEOUTS[stage]
+    try:
+        kwargs = dict(kwargs)
+        headers_only = kwargs.pop("headers_only", False)
+        follow_redirects = kwargs.pop("follow_redirects", False)
+        request = client.build_request("GET", url, **kwargs)
+        response = _send_before(client, request, stage, deadline, follow_redirects, headers_only)
+        record_latency(stage, time.monotonic() - started)
+    except Exception as e:
+        if trace is not None:
+            _add_span(trace, stage, url, started, error=e, hedge=hedge)
+        raise
+    finally:
+        if egress is not None:
+            egress.slots.release()
+        if semaphore is not None:
+            semaphore.release()
+    if trace is not None:
+        _add_span(trace, stage, url, started, response=response, hedge=hedge)
+    return response
+
+
+def _hedge_get(url, stage, kwargs, trace, egress, deadline):
+    # The duplicate gets its own client so it doesn't queue behind the stalled connection,
+    # through the same egress as the rest of the link
+    _egress_local.egress = egress
+    try:
+        with new_client() as client:
+            return _timed_get(client, url, stage, kwargs, trace, hedge=True, egress=egress, deadline=deadline)
+    finally:
+        _egress_local.egress = None
+
+
+def hedged_get(client, url, stage, **kwargs):
+    """
+    GET url with the timeout of the given stage, a deadline for the whole request
+    including the redirects it follows and reading the body
+    headers_only=True skips downloading the body, for hops where only the status,
+    headers or final URL are used
+    When hedging is enabled and the request takes longer than the stage's p95 latency,
+    a duplicate request is sent and whichever answers first is used
+    """
+    with _stats_lock:
+        _hedge_stats["requests"] += 1
+
+    kwargs["headers"] = _stage_headers(stage, kwargs.get("headers"))
+    trace = current_trace()
+    egress = current_egress()
+    deadline = time.monotonic() + STAGE_TIMEOUTS[stage]
+    hedge_delay = latency_percentile(stage, 95) if _hedging_enabled else None
+    if hedge_delay is None:
+        return _timed_get(client, url, stage, kwargs, trace, egress=egress, deadline=deadline)
+
+    from concurrent.futures import wait, FIRST_COMPLETED
+
+    executor = _get_executor()
+    primary = executor.submit(_timed_get, client, url, stage, kwargs, trace, False, egress, deadline)
+    done, _ = wait([primary], timeout=hedge_delay)
+    if done or not _take_hedge_token():
+        return primary.result()
+
+    # The duplicate shares the primary's deadline, hedging never extends the stage
+    hedge = executor.submit(_hedge_get, url, stage, kwargs, trace, egress, deadline)
+    pending = {primary, hedge}
+    error = None
+    while pending:
+        done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for future in done:
+            try:
+                response = future.result()
+            except Exception as e:
+                # The other request may still succeed
+                error = e
+                continue
+            if future is hedge:
+                with _stats_lock:
+                    _hedge_stats["hedge_wins"] += 1
+            return response
+
+    if error is not None:
+        raise error
+    raise TimeoutError(f"{stage} request to {url} timed out after {STAGE_TIMEOUTS[stage]}s")
+
+
+class Egress:
+    """
+    One way out: a proxy URL, or None for direct connections
+    slots caps the requests in flight through it; health is a moving average of link
+    outcomes (1.0 = every recent link succeeded), captchas counting as failures
+    """
+
+    def __init__(self, proxy, limit):
+        self.proxy = proxy
+        self.limit = limit
+        self.slots = threading.BoundedSemaphore(limit)
+        self.health = 1.0
+        self.resting_until = 0.0
+        self.active_links = 0
+        self.links = 0
+        self.errors = 0
+        self.captchas = 0
+
+    @property
+    def name(self):
+        if self.proxy is None:
+            return "direct"
+        from urllib.parse import urlparse
+
+        # Leave credentials out of anything printed
+        parsed = urlparse(self.proxy)
+        return f"{parsed.scheme}://{parsed.hostname}:{parsed.port}" if parsed.port else f"{parsed.scheme}://{parsed.hostname}"
+
+    def record(self, failed):
+        self.health = (1 - EGRESS_HEALTH_ALPHA) * self.health + (0.0 if failed else EGRESS_HEALTH_ALPHA)
+        if self.health < _egress_min_health and not self.resting_until:
+            self.resting_until = time.monotonic() + _egress_cooldown
+            print(f"\nEgress {self.name} is failing (health {self.health:.2f}), resting it for {_egress_cooldown:g}s")
+
+
+def configure_proxies(proxies, limit=10, min_health=0.3, cooldown=60.0):
+    """
+    Send traffic through a pool of egress proxies ("direct" for no proxy), each with at
+    most limit requests in flight. An egress whose health drops below min_health rests
+    for cooldown seconds and then gets another chance.
+    SOCKS proxies need the httpx[socks] extra
+    """
+    global _egresses, _egress_min_health, _egress_cooldown
+    if limit < 1:
+        raise ValueError("Per-proxy limit must be at least 1")
+    _egresses = [Egress(None if proxy == "direct" else proxy, limit) for proxy in proxies]
+    _egress_min_health = min_health
+    _egress_cooldown = cooldown
+
+
+def egress_capacity():
+    """
+    Return the number of requests the egress pool allows in flight, None without a pool
+    """
+    return sum(egress.limit for egress in _egresses) if _egresses else None
+
+
+def _pick_egress():
+    now = time.monotonic()
+    candidates = []
+    for egress in _egresses:
+        if egress.resting_until and egress.resting_until <= now:
+            # Rested long enough, one more failure sends it back
+            egress.resting_until = 0.0
+            egress.health = _egress_min_health
+        if not egress.resting_until:
+            candidates.append(egress)
+    # With every egress resting, the least unhealthy one is better than stalling the run
+    candidates = candidates or _egresses
+    # Healthy egresses with few links on them first, spreading links in proportion to limits
+    return max(candidates, key=lambda egress: egress.health * egress.limit / (1 + egress.active_links))
+
+
+@contextmanager
+def link_egress():
+    """
+    Pin the calling thread to one egress while it resolves a link, so every hop of the
+    chain leaves from the same address. The link's outcome feeds the egress's health:
+    the block failing (raising or calling egress_failed) counts against it
+    Does nothing without a proxy pool
+    """
+    if not _egresses:
+        yield None
+        return
+
+    with _egress_lock:
+        egress = _pick_egress()
+        egress.active_links += 1
+        egress.links += 1
+    _egress_local.egress = egress
+    _egress_local.failed = False
+    try:
+        yield egress
+    except Exception:
+        _egress_local.failed = True
+        raise
+    finally:
+        _egress_local.egress = None
+        with _egress_lock:
+            egress.active_links -= 1
+            if _egress_local.failed:
+                egress.errors += 1
+            egress.record(_egress_local.failed)
+
+
+def current_egress():
+    """
+    Return the egress the calling thread's link is pinned to, or None
+    """
+    return getattr(_egress_local, "egress", None)
+
+
+def egress_failed():
+    """
+    Mark the current link as failed for its egress's health
+    """
+    if current_egress() is not None:
+        _egress_local.failed = True
+
+
+def report_captcha():
+    """
+    Count a captcha against the current link's egress
+    """
+    global _captcha_total
+    egress = current_egress()
+    with _egress_lock:
+        _captcha_total += 1
+        if egress is not None:
+            egress.captchas += 1
+            egress.record(True)
+
+
+def captcha_count():
+    """
+    Return the number of captchas reported so far
+    """
+    return _captcha_total
+
+
+def egress_stats():
+    """
+    Return per-egress counters: name, links, errors, captchas, health
+    """
+    with _egress_lock:
+        return [{"name": egress.name, "links": egress.links, "errors": egress.errors,
+                 "captchas": egress.captchas, "health": round(egress.health, 2)} for egress in _egresses]
+
+
+def configure_redirect_memo(enabled, ttl=300.0):
+    """
+    Enable or disable the redirect memo, entries expire after ttl seconds
+    """
+    global _redirect_memo_enabled, _redirect_memo_ttl
+    _redirect_memo_enabled = enabled
+    _redirect_memo_ttl = ttl
+
+
+def redirect_memo_lookup(url):
+    """
+    Return the remembered next hop for url, or None
+    """
+    if not _redirect_memo_enabled:
+        return None
+    with _stats_lock:
+        entry = _redirect_memo.get(url)
+        if entry is not None and entry[1] > time.monotonic():
+            _redirect_memo_stats["hits"] += 1
+            return entry[0]
+        if entry is not None:
+            del _redirect_memo[url]
+        _redirect_memo_stats["misses"] += 1
+        return None
+
+
+def redirect_memo_store(url, response, next_url):
+    """
+    Remember that url redirects to next_url
+    Responses that set cookies are not remembered, skipping them would lose the cookie
+    """
+    if not _redirect_memo_enabled or 'set-cookie' in response.headers:
+        return
+    with _stats_lock:
+        _redirect_memo[url] = (next_url, time.monotonic() + _redirect_memo_ttl)
+        _redirect_memo.move_to_end(url)
+        _redirect_memo_stats["stored"] += 1
+        while len(_redirect_memo) > REDIRECT_MEMO_SIZE:
+            _redirect_memo.popitem(last=False)
+
+
+def redirect_memo_stats():
+    """
+    Return a copy of the redirect memo counters
+    """
+    with _stats_lock:
+        return dict(_redirect_memo_stats)
+
+
+def configure_tracing(path, sample_rate=0.0, slow_threshold=30.0):
+    """
+    Write per-link traces to path as NDJSON (gzip compressed when it ends in .gz)
+    Traces of failed links and links slower than slow_threshold seconds are always
+    kept, other links are kept with probability sample_rate
+    """
+    global _trace_file, _trace_sample_rate, _trace_slow_threshold
+    if path.endswith(".gz"):
+        import gzip
+        _trace_file = gzip.open(path, 'at')
+    else:
+        _trace_file = open(path, 'a')
+    _trace_sample_rate = sample_rate
+    _trace_slow_threshold = slow_threshold
+
+
+def close_tracing():
+    """
+    Flush and close the trace file
+    """
+    global _trace_file
+    with _trace_lock:
+        if _trace_file is not None:
+            _trace_file.close()
+            _trace_file = None
+
+
+def start_link_trace(url):
+    """
+    Start collecting spans for the link the current thread is about to resolve
+    """
+    if _trace_file is None:
+        _trace_local.trace = None
+        return
+    _trace_local.trace = {"url": url, "started": time.monotonic(), "spans": []}
+
+
+def current_trace():
+    return getattr(_trace_local, "trace", None)
+
+
+def trace_branch(branch):
+    """
+    Note which parsing branch handled the response of the current link's last hop
+    """
+    trace = current_trace()
+    if trace is not None and trace["spans"]:
+        trace["spans"][-1].setdefault("branch", []).append(branch)
+
+
+def _body_size(response):
+    # None for headers_only responses, whose body was never read
+    try:
+        return len(response.content)
+    except Exception:
+        return None
+
+
+def _add_span(trace, stage, url, started, response=None, error=None, hedge=False):
+    finished = time.monotonic()
+    offset = round(started - trace["started"], 3)
+    if response is not None:
+        # Hops followed inside httpx (follow_redirects=True) get their own spans
+        for hop in response.history:
+            trace["spans"].append({"stage": stage, "url": str(hop.url), "status": hop.status_code,
+                                   "bytes": _body_size(hop), "t": offset})
+    span = {"stage": stage, "url": url, "t": offset, "ms": round((finished - started) * 1000, 1)}
+    if response is not None:
+        span["status"] = response.status_code
+        span["bytes"] = _body_size(response)
+        if response.history:
+            span["url"] = str(response.url)
+    if error is not None:
+        span["error"] = f"{type(error).__name__}: {error}"
+    if hedge:
+        span["hedge"] = True
+    trace["spans"].append(span)
+
+
+def finish_link_trace(start, error):
+    """
+    Decide whether to keep the current link's trace and write it if so
+    """
+    trace = current_trace()
+    _trace_local.trace = None
+    if trace is None:
+        return
+    total = time.monotonic() - trace["started"]
+    if error is None and total < _trace_slow_threshold and random.random() >= _trace_sample_rate:
+        return
+
+    line = json.dumps({
+        "url": trace["url"],
+        "start": start,
+        "error": error,
+        "total": round(total, 3),
+        "spans": trace["spans"],
+    }, separators=(',', ':'))
+    with _trace_lock:
+        if _trace_file is not None:
+            _trace_file.write(line + "\n")
+            _trace_file.flush()